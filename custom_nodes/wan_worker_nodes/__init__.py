@@ -0,0 +1,33 @@
+"""
+ComfyUI custom nodes shipped with the Wan2.2 I2V Lightning worker.
+"""
+
+from .latent_cache import CachedWanImageToVideo
+from .step_cache import WanStepCache, WanStepCacheStats
+from .streaming_decode import StreamingVAEDecodeSave
+from .text_cache import CachedCLIPTextEncode
+from . import shared_weights
+
+
+# Custom nodes load before any model, so loads from here on use the shared mapping
+if shared_weights.SHARED_WEIGHTS:
+    shared_weights.install()
+
+
+NODE_CLASS_MAPPINGS = {
+    "CachedCLIPTextEncode": CachedCLIPTextEncode,
+    "CachedWanImageToVideo": CachedWanImageToVideo,
+    "StreamingVAEDecodeSave": StreamingVAEDecodeSave,
+    "WanStepCache": WanStepCache,
+    "WanStepCacheStats": WanStepCacheStats,
+}
+
+NODE_DISPLAY_NAME_MAPPINGS = {
+    "CachedCLIPTextEncode": "CLIP Text Encode (Cached)",
+    "CachedWanImageToVideo": "WanImageToVideo (Cached Start Image)",
+    "StreamingVAEDecodeSave": "VAE Decode + Save Video (Streaming)",
+    "WanStepCache": "Wan Step Cache",
+    "WanStepCacheStats": "Wan Step Cache Stats",
+}
+
+__all__ = ["NODE_CLASS_MAPPINGS", "NODE_DISPLAY_NAME_MAPPINGS"]
@@ -0,0 +1,161 @@
+"""
+Start-image latent cache for WanImageToVideo.
+
+WanImageToVideo VAE-encodes the start image padded to the full clip length
+on every prompt. The encoded latent depends only on the image content, the
+target size, the length and the VAE, so it is cached under that key and
+repeat-image jobs skip the VAE encode. Each lookup is reported as a
+"tensor_cache" UI output, like CachedCLIPTextEncode's.
+"""
+
+import hashlib
+import os
+from typing import Callable, Tuple
+
+import torch
+
+from .tensor_cache import TensorCache, cache_key
+
+
+LATENT_CACHE_DIR = os.getenv("LATENT_CACHE_DIR", "")
+LATENT_CACHE_MAX_MB = int(os.getenv("LATENT_CACHE_MAX_MB", "1024"))
+
+_cache = None
+
+
+def get_latent_cache() -> TensorCache:
+    """Return the process-wide start-image latent cache."""
+    global _cache
+    if _cache is None:
+        _cache = TensorCache(LATENT_CACHE_MAX_MB * 1024 * 1024, cache_dir=LATENT_CACHE_DIR or None)
+    return _cache
+
+
+def image_hash(image: torch.Tensor) -> str:
+    """Content hash of an image tensor (shape, dtype and pixel data)."""
+    image = image.detach().to('cpu').contiguous()
+    digest = hashlib.sha256()
+    digest.update(f"{tuple(image.shape)}:{image.dtype}".encode('utf-8'))
+    digest.update(image.view(torch.uint8).numpy().tobytes())
+    return digest.hexdigest()
+
+
+def encode_start_image(
+    vae,
+    start_image: torch.Tensor,
+    width: int,
+    height: int,
+    length: int,
+    upscale_fn: Callable[[torch.Tensor, int, int], torch.Tensor]
+) -> torch.Tensor:
+    """
+    VAE-encode the start image padded to the clip length, as WanImageToVideo does.
+
+    Args:
+        vae: VAE with an encode(pixels) method taking [frames, H, W, C]
+        start_image: Image batch [frames, H, W, C] in 0..1
+        width: Target width
+        height: Target height
+        length: Clip length in frames
+        upscale_fn: Resizes [frames, C, H, W] to (width, height)
+
+    Returns:
+        Encoded concat latent
+    """
+    start_image = upscale_fn(start_image[:length].movedim(-1, 1), width, height).movedim(1, -1)
+    image = torch.ones((length, height, width, start_image.shape[-1]), device=start_image.device, dtype=start_image.dtype) * 0.5
+    image[:start_image.shape[0]] = start_image
+    return vae.encode(image[:, :, :, :3])
+
+
+def encode_start_image_cached(
+    cache: TensorCache,
+    vae_name: str,
+    vae,
+    start_image: torch.Tensor,
+    width: int,
+    height: int,
+    length: int,
+    upscale_fn: Callable[[torch.Tensor, int, int], torch.Tensor]
+) -> Tuple[torch.Tensor, bool]:
+    """
+    Cached wrapper around encode_start_image keyed by image hash, size, length and VAE.
+
+    Returns:
+        Tuple of (encoded concat latent, whether it came from the cache)
+    """
+    key = cache_key("start_image", vae_name, image_hash(start_image), str(width), str(height), str(length))
+    entry = cache.get(key)
+    if entry is not None:
+        return entry[0]["latent"], True
+
+    latent = encode_start_image(vae, start_image, width, height, length, upscale_fn)
+    cache.put(key, {"latent": latent})
+    return latent, False
+
+
+class CachedWanImageToVideo:
+    """WanImageToVideo with the start-image VAE encode served from a cache."""
+
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "positive": ("CONDITIONING",),
+                "negative": ("CONDITIONING",),
+                "vae": ("VAE",),
+                "width": ("INT", {"default": 832, "min": 16, "max": 16384, "step": 16}),
+                "height": ("INT", {"default": 480, "min": 16, "max": 16384, "step": 16}),
+                "length": ("INT", {"default": 81, "min": 1, "max": 16384, "step": 4}),
+                "batch_size": ("INT", {"default": 1, "min": 1, "max": 4096}),
+                "vae_name": ("STRING", {"default": ""}),
+            },
+            "optional": {
+                "clip_vision_output": ("CLIP_VISION_OUTPUT",),
+                "start_image": ("IMAGE",),
+            }
+        }
+
+    RETURN_TYPES = ("CONDITIONING", "CONDITIONING", "LATENT")
+    RETURN_NAMES = ("positive", "negative", "latent")
+    FUNCTION = "encode"
+    CATEGORY = "conditioning/video_models/wan_worker"
+
+    def encode(self, positive, negative, vae, width, height, length, batch_size, vae_name,
+               start_image=None, clip_vision_output=None):
+        import comfy.model_management
+        import comfy.utils
+        import node_helpers
+
+        reports = []
+        latent = torch.zeros(
+            [batch_size, 16, ((length - 1) // 4) + 1, height // 8, width // 8],
+            device=comfy.model_management.intermediate_device()
+        )
+
+        if start_image is not None:
+            def upscale_fn(samples, target_width, target_height):
+                return comfy.utils.common_upscale(samples, target_width, target_height, "bilinear", "center")
+
+            concat_latent_image, hit = encode_start_image_cached(
+                get_latent_cache(), vae_name, vae, start_image, width, height, length, upscale_fn
+            )
+            concat_latent_image = concat_latent_image.to(start_image.device)
+            reports.append({"cache": "start_latent", "result": "hit" if hit else "miss"})
+
+            mask = torch.ones(
+                (1, 1, latent.shape[2], concat_latent_image.shape[-2], concat_latent_image.shape[-1]),
+                device=start_image.device, dtype=start_image.dtype
+            )
+            mask[:, :, :((start_image[:length].shape[0] - 1) // 4) + 1] = 0.0
+
+            values = {"concat_latent_image": concat_latent_image, "concat_mask": mask}
+            positive = node_helpers.conditioning_set_values(positive, values)
+            negative = node_helpers.conditioning_set_values(negative, values)
+
+        if clip_vision_output is not None:
+            positive = node_helpers.conditioning_set_values(positive, {"clip_vision_output": clip_vision_output})
+            negative = node_helpers.conditioning_set_values(negative, {"clip_vision_output": clip_vision_output})
+
+        ui = {"tensor_cache": reports} if reports else {}
+        return {"ui": ui, "result": (positive, negative, {"samples": latent})}
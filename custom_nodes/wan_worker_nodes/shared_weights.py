@@ -0,0 +1,234 @@
+"""
+Shared host memory for model weights across ComfyUI processes.
+
+With one ComfyUI per GPU, every process normally reads each safetensors
+file into its own private host memory (~30 GB for the two 14B UNets,
+umt5-xxl and the VAE), so host RAM caps how many instances fit on a pod.
+With SHARED_WEIGHTS=1, comfy.utils.load_torch_file maps safetensors files
+under ComfyUI's model directories (including those configured in
+extra_model_paths.yaml) copy-on-write and returns tensors that view the
+mapping. Unmodified pages are shared by all processes through the page
+cache, or through tmpfs when SHARED_WEIGHTS_DIR stages the files in
+/dev/shm. A write (e.g. an in-place LoRA patch) copies only the touched
+pages into the writing process.
+
+While ComfyUI loads a diffusion model's weights (BaseModel.load_model_weights),
+that model's load_state_dict assigns mapped tensors whose dtype and shape
+already match a parameter instead of copying them. UNet weights therefore
+stay shared until ComfyUI moves them to the GPU, which makes the device
+copy. Tensors that need a dtype conversion are copied as before, and no
+other module's load_state_dict is touched.
+"""
+
+import fcntl
+import hashlib
+import json
+import mmap
+import os
+import shutil
+import struct
+import threading
+import types
+import weakref
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import torch
+
+
+SHARED_WEIGHTS = os.getenv("SHARED_WEIGHTS", "0") == "1"
+# Stage files here (e.g. /dev/shm/wan-weights) instead of mapping them in place; empty maps in place
+SHARED_WEIGHTS_DIR = os.getenv("SHARED_WEIGHTS_DIR", "")
+
+# safetensors dtype codes
+DTYPES = {
+    "F64": torch.float64, "F32": torch.float32, "F16": torch.float16, "BF16": torch.bfloat16,
+    "F8_E4M3": torch.float8_e4m3fn, "F8_E5M2": torch.float8_e5m2,
+    "I64": torch.int64, "I32": torch.int32, "I16": torch.int16, "I8": torch.int8,
+    "U8": torch.uint8, "BOOL": torch.bool,
+}
+
+_lock = threading.Lock()
+# [start, end) addresses of live mappings; a mapping is released with its last tensor
+_ranges: List[Tuple[int, int, weakref.ref]] = []
+
+
+def stage_file(path: str, stage_dir: str) -> str:
+    """
+    Copy a model file into a shared directory once per host.
+
+    Concurrent processes serialize on a lock file; the copy is written to a
+    temporary name and renamed, so no process ever maps a partial file.
+
+    Args:
+        path: Model file
+        stage_dir: Shared directory (typically on /dev/shm)
+
+    Returns:
+        Path of the staged copy
+    """
+    os.makedirs(stage_dir, exist_ok=True)
+    name = hashlib.sha256(os.path.abspath(path).encode("utf-8")).hexdigest()[:16] + "_" + os.path.basename(path)
+    staged = os.path.join(stage_dir, name)
+    source = os.stat(path)
+    with open(os.path.join(stage_dir, ".lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            current = os.stat(staged)
+            if current.st_size == source.st_size and current.st_mtime >= source.st_mtime:
+                return staged
+        except FileNotFoundError:
+            pass
+        print(f"Staging {os.path.basename(path)} in {stage_dir}...")
+        tmp_path = f"{staged}.{os.getpid()}.tmp"
+        with open(path, "rb") as src, open(tmp_path, "wb") as dst:
+            shutil.copyfileobj(src, dst, 16 * 1024 * 1024)
+            # The staged copy is what gets shared; do not keep a second copy in the page cache
+            os.posix_fadvise(src.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+        os.replace(tmp_path, staged)
+    return staged
+
+
+def map_safetensors(path: str) -> Tuple[Dict[str, torch.Tensor], Dict[str, str]]:
+    """
+    Tensors of a safetensors file as views of a copy-on-write mapping.
+
+    Every call maps the file anew, so pages one load modified in place are
+    never seen by the next; unmodified pages are shared either way.
+
+    Args:
+        path: safetensors file
+
+    Returns:
+        Tuple of (tensors, metadata)
+    """
+    with open(path, "rb") as f:
+        (header_size,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(header_size))
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    metadata = header.pop("__metadata__", None) or {}
+    data_start = 8 + header_size
+
+    tensors = {}
+    for name, info in header.items():
+        dtype = DTYPES[info["dtype"]]
+        start, end = info["data_offsets"]
+        count = (end - start) // dtype.itemsize
+        if count == 0:
+            tensors[name] = torch.empty(info["shape"], dtype=dtype)
+        else:
+            # The tensor keeps the mapping alive
+            tensors[name] = torch.frombuffer(
+                mapping, dtype=dtype, count=count, offset=data_start + start
+            ).reshape(info["shape"])
+
+    address = torch.frombuffer(mapping, dtype=torch.uint8, count=1).data_ptr()
+    with _lock:
+        _ranges[:] = [entry for entry in _ranges if entry[2]() is not None]
+        _ranges.append((address, address + len(mapping), weakref.ref(mapping)))
+    return tensors, metadata
+
+
+def is_shared(tensor: Any) -> bool:
+    """Whether a tensor views a shared mapping."""
+    if not isinstance(tensor, torch.Tensor) or tensor.device.type != "cpu" or tensor.numel() == 0:
+        return False
+    address = tensor.data_ptr()
+    with _lock:
+        return any(start <= address < end and mapping() is not None for start, end, mapping in _ranges)
+
+
+def load_shared(path: str, stage_dir: Optional[str] = None) -> Tuple[Dict[str, torch.Tensor], Dict[str, str]]:
+    """Map a model file, staging it first when stage_dir is set."""
+    return map_safetensors(stage_file(path, stage_dir) if stage_dir else path)
+
+
+def load_state_dict_shared(original):
+    """
+    Wrap a load_state_dict method to assign mapped tensors instead of copying them.
+
+    Only tensors from a shared mapping whose dtype and shape match the
+    module's tensor are assigned; everything else is loaded by the original
+    method, which keeps ComfyUI's dtype conversions.
+    """
+    def load_state_dict(self, state_dict, strict=True, assign=False):
+        if assign or not any(is_shared(value) for value in state_dict.values()):
+            return original(self, state_dict, strict=strict, assign=assign)
+
+        own = self.state_dict(keep_vars=True)
+        shared = {
+            key: value for key, value in state_dict.items()
+            if is_shared(value) and key in own
+            and own[key].dtype == value.dtype and own[key].shape == value.shape
+        }
+        copied = {key: value for key, value in state_dict.items() if key not in shared}
+        result = original(self, copied, strict=False)
+        original(self, shared, strict=False, assign=True)
+
+        result = result._replace(missing_keys=[key for key in result.missing_keys if key not in shared])
+        if strict and (result.missing_keys or result.unexpected_keys):
+            raise RuntimeError(
+                f"Error(s) in loading state_dict for {type(self).__name__}: "
+                f"missing keys {result.missing_keys}, unexpected keys {result.unexpected_keys}"
+            )
+        return result
+
+    load_state_dict.shared_weights = True
+    return load_state_dict
+
+
+def model_roots() -> List[str]:
+    """ComfyUI's model directories, including those from extra_model_paths.yaml."""
+    import folder_paths
+
+    roots = {folder_paths.models_dir}
+    for name, (paths, _) in folder_paths.folder_names_and_paths.items():
+        if name != "custom_nodes":
+            roots.update(paths)
+    return sorted(os.path.realpath(root) for root in roots)
+
+
+def install(roots: Optional[Iterable[str]] = None, stage_dir: Optional[str] = None) -> None:
+    """
+    Route safetensors loads under roots through the shared mapping, and
+    let diffusion model loads assign the mapped tensors.
+
+    Args:
+        roots: Directories whose files are shared (defaults to ComfyUI's model directories)
+        stage_dir: Staging directory (defaults to SHARED_WEIGHTS_DIR)
+    """
+    import comfy.model_base
+    import comfy.utils
+
+    if getattr(comfy.utils.load_torch_file, "shared_weights", False):
+        return
+    roots = tuple(os.path.join(os.path.realpath(root), "") for root in (roots if roots is not None else model_roots()))
+    stage_dir = stage_dir if stage_dir is not None else SHARED_WEIGHTS_DIR
+    original = comfy.utils.load_torch_file
+
+    def load_torch_file(ckpt, *args, **kwargs):
+        device = kwargs.get("device", args[1] if len(args) > 1 else None)
+        return_metadata = kwargs.get("return_metadata", args[2] if len(args) > 2 else False)
+        path = os.path.realpath(ckpt)
+        on_cpu = device is None or torch.device(device).type == "cpu"
+        if not (on_cpu and path.lower().endswith(".safetensors") and path.startswith(roots)):
+            return original(ckpt, *args, **kwargs)
+        tensors, metadata = load_shared(path, stage_dir or None)
+        return (tensors, metadata) if return_metadata else tensors
+
+    load_torch_file.shared_weights = True
+    comfy.utils.load_torch_file = load_torch_file
+
+    original_load_model_weights = comfy.model_base.BaseModel.load_model_weights
+
+    def load_model_weights(self, *args, **kwargs):
+        # Bound on this model only for the duration of its weight load
+        model = self.diffusion_model
+        model.load_state_dict = types.MethodType(load_state_dict_shared(type(model).load_state_dict), model)
+        try:
+            return original_load_model_weights(self, *args, **kwargs)
+        finally:
+            del model.load_state_dict
+
+    comfy.model_base.BaseModel.load_model_weights = load_model_weights
+    print(f"Shared weights: mapping safetensors under {', '.join(roots)}"
+          + (f" (staged in {stage_dir})" if stage_dir else ""))
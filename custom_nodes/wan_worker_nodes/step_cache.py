@@ -0,0 +1,284 @@
+"""
+Step-output cache for the Wan diffusion transformer (TeaCache style).
+
+Between adjacent sampler steps some steps change the transformer's input
+very little, so the residual that the block stack adds to its input is
+nearly the same as on the previous step. WanStepCache measures the
+relative L1 change of the first block's modulated input from step to
+step, accumulates it, and while the accumulated change stays below a
+threshold it skips all blocks and adds the residual cached on the last
+computed step instead. The first step of every sampling run is always
+computed.
+
+The cache is installed through ComfyUI's "dit" block-replace patches
+(one patch per transformer block), so the model's forward pass is not
+copied. State is kept per cond/uncond stream and reset whenever a new
+sampling run starts (the sigma stops decreasing).
+"""
+
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import torch
+
+
+def relative_l1(current: torch.Tensor, previous: torch.Tensor) -> float:
+    """Mean absolute change of current relative to the mean magnitude of previous."""
+    scale = previous.abs().mean().clamp_min(1e-8)
+    return ((current - previous).abs().mean() / scale).item()
+
+
+def wan_modulated_input(block, x: torch.Tensor, e: torch.Tensor) -> torch.Tensor:
+    """
+    Input of a Wan block's self-attention after AdaLN modulation.
+
+    Computes norm1(x) * (1 + scale) + shift from the block's modulation
+    table and the timestep embedding e [B, 6, dim]. Falls back to e when the
+    block's layout does not match.
+    """
+    try:
+        modulation = block.modulation.to(dtype=x.dtype, device=x.device)
+        shift, scale = (modulation + e).chunk(6, dim=1)[:2]
+        return block.norm1(x) * (1 + scale) + shift
+    except (AttributeError, RuntimeError, ValueError):
+        return e
+
+
+class _StreamState:
+    """Cache state of one cond/uncond stream within a sampling run."""
+
+    def __init__(self):
+        self.sigma: Optional[float] = None
+        self.shape: Optional[Tuple[int, ...]] = None
+        self.indicator: Optional[torch.Tensor] = None
+        self.accumulated = 0.0
+        self.residual: Optional[torch.Tensor] = None
+        self.block_input: Optional[torch.Tensor] = None
+        self.skip = False
+
+
+class StepCache:
+    """Decides per step whether to reuse the cached block residual, and counts skips."""
+
+    def __init__(
+        self,
+        threshold: float,
+        num_blocks: int,
+        first_block=None,
+        indicator_fn: Callable[[Any, torch.Tensor, torch.Tensor], torch.Tensor] = wan_modulated_input
+    ):
+        """
+        Initialize step cache.
+
+        Args:
+            threshold: Accumulated relative L1 change below which a step is skipped (0 disables)
+            num_blocks: Number of transformer blocks
+            first_block: First transformer block (passed to indicator_fn)
+            indicator_fn: Computes the change indicator from (first_block, x, e)
+        """
+        self.threshold = threshold
+        self.num_blocks = num_blocks
+        self.first_block = first_block
+        self.indicator_fn = indicator_fn
+        self.steps = 0
+        self.skipped = 0
+        self._streams: Dict[Tuple, _StreamState] = {}
+
+    def __deepcopy__(self, memo):
+        # ComfyUI may deep-copy model options; the patches must keep sharing this state
+        return self
+
+    def reset(self) -> None:
+        """Forget cached residuals and statistics (start of a sampling run)."""
+        self.steps = 0
+        self.skipped = 0
+        self._streams = {}
+
+    def stats(self) -> Dict[str, Any]:
+        """Statistics of the current (or last) sampling run."""
+        return {
+            "threshold": self.threshold,
+            "steps": self.steps,
+            "skipped": self.skipped,
+            "skip_rate": self.skipped / self.steps if self.steps else 0.0,
+        }
+
+    def begin_step(self, key: Tuple, x: torch.Tensor, e: torch.Tensor, sigma: Optional[float]) -> bool:
+        """
+        Start a model call for one stream and decide whether to skip the blocks.
+
+        Args:
+            key: Stream key (cond/uncond layout of the batch)
+            x: Input of the first block
+            e: Timestep embedding passed to the blocks
+            sigma: Current noise level (None if unknown)
+
+        Returns:
+            True if the cached residual should replace the block stack
+        """
+        state = self._streams.get(key)
+        # A stream whose noise level stops decreasing (or whose shape changes) belongs to a new run
+        restart = state is not None and (
+            state.shape != tuple(x.shape)
+            or (sigma is not None and state.sigma is not None and sigma >= state.sigma)
+        )
+        if restart:
+            self.reset()
+        if state is None or restart:
+            state = _StreamState()
+            self._streams[key] = state
+
+        indicator = self.indicator_fn(self.first_block, x, e).detach()
+        skip = False
+        if state.indicator is not None and state.residual is not None and self.threshold > 0:
+            state.accumulated += relative_l1(indicator, state.indicator)
+            skip = state.accumulated < self.threshold
+        if not skip:
+            state.accumulated = 0.0
+            state.block_input = x
+
+        state.indicator = indicator
+        state.sigma = sigma
+        state.shape = tuple(x.shape)
+        state.skip = skip
+        self.steps += 1
+        self.skipped += int(skip)
+        return skip
+
+    def end_step(self, key: Tuple, x: torch.Tensor) -> torch.Tensor:
+        """
+        Finish a model call: apply the cached residual or store a new one.
+
+        Args:
+            key: Stream key passed to begin_step
+            x: Output of the last block (its input when skipping)
+
+        Returns:
+            Block stack output for this step
+        """
+        state = self._streams[key]
+        if state.skip:
+            return x + state.residual
+        state.residual = (x - state.block_input).detach()
+        state.block_input = None
+        return x
+
+    def is_skipping(self, key: Tuple) -> bool:
+        """Whether the current step of a stream skips the blocks."""
+        state = self._streams.get(key)
+        return state is not None and state.skip
+
+    def block_patch(self, index: int) -> "StepCachePatch":
+        """ComfyUI "dit" block-replace patch for transformer block index."""
+        return StepCachePatch(self, index)
+
+
+def stream_key(transformer_options: Dict[str, Any]) -> Tuple:
+    """Key separating cond and uncond batches of the same step."""
+    return tuple(transformer_options.get("cond_or_uncond") or ())
+
+
+def current_sigma(transformer_options: Dict[str, Any]) -> Optional[float]:
+    """Noise level of the current model call, if ComfyUI provides it."""
+    sigmas = transformer_options.get("sigmas")
+    if sigmas is None:
+        return None
+    return float(sigmas.flatten()[0]) if isinstance(sigmas, torch.Tensor) else float(sigmas)
+
+
+class StepCachePatch:
+    """Replaces one transformer block: runs it, or passes through while the step is cached."""
+
+    def __init__(self, cache: StepCache, index: int):
+        self.cache = cache
+        self.index = index
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __call__(self, args: Dict[str, Any], extra: Dict[str, Any]) -> Dict[str, Any]:
+        options = args.get("transformer_options") or {}
+        key = stream_key(options)
+        x = args["img"]
+
+        if self.index == 0:
+            self.cache.begin_step(key, x, args["vec"], current_sigma(options))
+        if not self.cache.is_skipping(key):
+            x = extra["original_block"](args)["img"]
+        if self.index == self.cache.num_blocks - 1:
+            x = self.cache.end_step(key, x)
+        return {"img": x}
+
+
+def apply_step_cache(model, threshold: float):
+    """
+    Clone a Wan ModelPatcher with a StepCache installed on every block.
+
+    Args:
+        model: ComfyUI ModelPatcher wrapping a Wan diffusion model
+        threshold: Skip threshold (see StepCache)
+
+    Returns:
+        Tuple of (patched model clone, StepCache)
+    """
+    blocks = model.get_model_object("diffusion_model").blocks
+    cache = StepCache(threshold, len(blocks), first_block=blocks[0])
+    patched = model.clone()
+    for index in range(len(blocks)):
+        patched.set_model_patch_replace(cache.block_patch(index), "dit", "double_block", index)
+    patched.model_options["transformer_options"]["wan_step_cache"] = cache
+    return patched, cache
+
+
+class WanStepCache:
+    """Wraps a Wan model so sampler steps with little input change reuse cached block residuals."""
+
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "model": ("MODEL",),
+                "threshold": ("FLOAT", {"default": 0.1, "min": 0.0, "max": 1.0, "step": 0.01}),
+                # Unique per job so concurrent prompts never share cache state
+                "label": ("STRING", {"default": ""}),
+            }
+        }
+
+    RETURN_TYPES = ("MODEL",)
+    FUNCTION = "patch"
+    CATEGORY = "advanced/model/wan_worker"
+
+    def patch(self, model, threshold, label):
+        return (apply_step_cache(model, threshold)[0],)
+
+
+class WanStepCacheStats:
+    """Reports skip statistics of the step caches on the models that produced a latent."""
+
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "samples": ("LATENT",),
+                "model_high": ("MODEL",),
+                "model_low": ("MODEL",),
+                "label": ("STRING", {"default": ""}),
+            }
+        }
+
+    RETURN_TYPES = ()
+    OUTPUT_NODE = True
+    FUNCTION = "report"
+    CATEGORY = "advanced/model/wan_worker"
+
+    @classmethod
+    def IS_CHANGED(cls, **kwargs):
+        # Statistics belong to the latest sampling run; never serve them from the node cache
+        return float("nan")
+
+    def report(self, samples, model_high, model_low, label):
+        stats = []
+        for name, model in (("high_noise", model_high), ("low_noise", model_low)):
+            cache = model.model_options.get("transformer_options", {}).get("wan_step_cache")
+            if cache is not None:
+                stats.append(dict(cache.stats(), model=name, label=label))
+        return {"ui": {"step_cache": stats}}
@@ -0,0 +1,271 @@
+"""
+Streaming VAE decode straight into an ffmpeg encoder.
+
+The stock VAEDecode -> CreateVideo -> SaveVideo chain materializes every
+decoded frame as one float32 tensor (121 frames at 1024x1024 is ~1.5 GB,
+plus copies) before encoding starts. StreamingVAEDecodeSave decodes the
+latent a few temporal frames at a time, converts each chunk to uint8 and
+hands it to an ffmpeg process over stdin through a bounded queue, so only
+a couple of chunks are ever resident and decoding overlaps encoding.
+
+The Wan VAE is temporally causal: it decodes one latent frame at a time and
+carries each causal convolution's trailing activations (its feature cache)
+to the next frame. Chunks are decoded the same way with one cache kept
+across all of them, so the streamed frames are those of a full decode.
+VAEs other than the Wan 2.1 VAE are decoded in one pass and only the
+conversion and encoding are streamed.
+"""
+
+import os
+import queue
+import subprocess
+import threading
+from typing import List, Optional
+
+import torch
+
+
+def temporal_stride(vae) -> int:
+    """Pixel frames per latent frame after the first (1 for image VAEs)."""
+    stride = getattr(vae, "temporal_compression_decode", None)
+    if callable(stride):
+        stride = stride()
+    return int(stride) if stride else 1
+
+
+def to_uint8_frames(images: torch.Tensor) -> torch.Tensor:
+    """Convert decoded frames in 0..1 to contiguous uint8 [frames, H, W, 3] on CPU."""
+    images = images.reshape(-1, *images.shape[-3:])[..., :3]
+    return images.clamp(0, 1).mul(255).round().to(device="cpu", dtype=torch.uint8).contiguous()
+
+
+class FrameEncoder:
+    """ffmpeg fed raw RGB frames from a bounded queue, started once the frame size is known."""
+
+    def __init__(
+        self,
+        output_path: str,
+        fps: float,
+        crf: int = 19,
+        queue_size: int = 2,
+        codec_args: Optional[List[str]] = None
+    ):
+        """
+        Initialize frame encoder.
+
+        Args:
+            output_path: Destination video path
+            fps: Output frame rate
+            crf: libx264 constant rate factor (ignored with codec_args)
+            queue_size: Chunks buffered between decode and encode
+            codec_args: Encoder arguments replacing the default libx264 settings
+        """
+        self.output_path = output_path
+        self.fps = fps
+        self.frames_written = 0
+        self.codec_args = codec_args or ["-c:v", "libx264", "-crf", str(crf), "-preset", "veryfast",
+                                         "-pix_fmt", "yuv420p", "-movflags", "+faststart"]
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._error = None
+        self._process = None
+        self._thread = None
+
+    def _start(self, width: int, height: int) -> None:
+        cmd = [
+            "ffmpeg", "-hide_banner", "-loglevel", "error", "-y",
+            "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{width}x{height}", "-r", str(self.fps),
+            "-i", "-", "-an"
+        ] + self.codec_args + [self.output_path]
+        try:
+            self._process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+        except FileNotFoundError:
+            raise RuntimeError("ffmpeg not found")
+        self._thread = threading.Thread(target=self._write_loop, daemon=True)
+        self._thread.start()
+
+    def _write_loop(self) -> None:
+        while True:
+            frames = self._queue.get()
+            if frames is None:
+                break
+            if self._error is not None:
+                continue
+            try:
+                self._process.stdin.write(frames.numpy().tobytes())
+                self.frames_written += frames.shape[0]
+            except (BrokenPipeError, OSError) as e:
+                # Keep draining so the producer never blocks on a full queue
+                self._error = e
+        try:
+            self._process.stdin.close()
+        except (BrokenPipeError, OSError):
+            pass
+
+    def write(self, frames: torch.Tensor) -> None:
+        """
+        Queue uint8 frames [frames, H, W, 3] for encoding, blocking while the queue is full.
+
+        Raises:
+            RuntimeError: If the encoder has already failed
+        """
+        if self._error is not None:
+            raise RuntimeError(f"ffmpeg encoder failed: {self._error}")
+        if self._process is None:
+            self._start(frames.shape[2], frames.shape[1])
+        self._queue.put(frames)
+
+    def close(self) -> str:
+        """
+        Flush queued frames and wait for ffmpeg to finish.
+
+        Returns:
+            output_path
+
+        Raises:
+            RuntimeError: If ffmpeg failed or no frames were written
+        """
+        if self._process is None:
+            raise RuntimeError("No frames to encode")
+        self._queue.put(None)
+        self._thread.join()
+        stderr = self._process.stderr.read().decode("utf-8", errors="replace").strip()
+        returncode = self._process.wait()
+        if returncode != 0 or self._error is not None:
+            raise RuntimeError(f"ffmpeg encoder failed ({returncode}): {stderr[-500:]}")
+        return self.output_path
+
+    def abort(self) -> None:
+        """Stop the encoder after an upstream failure, discarding queued frames."""
+        self._error = self._error or RuntimeError("aborted")
+        if self._process is None:
+            return
+        self._queue.put(None)
+        self._process.kill()
+        self._thread.join()
+        self._process.wait()
+
+
+def wan_model(vae):
+    """The Wan 2.1 VAE module behind a ComfyUI VAE, or None for any other VAE."""
+    try:
+        from comfy.ldm.wan.vae import WanVAE
+    except ImportError:
+        return None
+    model = getattr(vae, "first_stage_model", None)
+    return model if isinstance(model, WanVAE) else None
+
+
+class CausalDecoder:
+    """Wan VAE decode split across calls, keeping the causal feature cache between them."""
+
+    def __init__(self, model):
+        """
+        Initialize causal decoder.
+
+        Args:
+            model: comfy.ldm.wan.vae.WanVAE
+        """
+        from comfy.ldm.wan.vae import count_conv3d
+
+        self.model = model
+        self.feat_map = [None] * count_conv3d(model.decoder)
+
+    def decode(self, latent: torch.Tensor) -> torch.Tensor:
+        """
+        Decode the next latent frames, as WanVAE.decode does for the whole latent.
+
+        Args:
+            latent: Latent [batch, channels, frames, H, W] following the previous call's
+
+        Returns:
+            Frames [batch, 3, frames, H, W] in -1..1
+        """
+        x = self.model.conv2(latent)
+        out = [
+            self.model.decoder(x[:, :, i:i + 1], feat_cache=self.feat_map, feat_idx=[0])
+            for i in range(x.shape[2])
+        ]
+        return torch.cat(out, 2)
+
+
+def decode_to_encoder(vae, samples: torch.Tensor, encoder: FrameEncoder, chunk_size: int = 4) -> int:
+    """
+    Decode a video latent chunk by chunk into an encoder.
+
+    Args:
+        vae: ComfyUI VAE; other VAEs only need decode(latent) returning frames in 0..1
+        samples: Latent [batch, channels, frames, H, W]
+        encoder: Receives uint8 frames via write()
+        chunk_size: Latent frames decoded per chunk
+
+    Returns:
+        Number of frames written
+    """
+    model = wan_model(vae)
+    if model is None:
+        print("StreamingVAEDecodeSave: not a Wan 2.1 VAE, decoding in one pass")
+        frames = to_uint8_frames(vae.decode(samples))
+        step = chunk_size * temporal_stride(vae)
+        for start in range(0, frames.shape[0], step):
+            encoder.write(frames[start:start + step])
+        return frames.shape[0]
+
+    if hasattr(vae, "patcher"):
+        import comfy.model_management
+
+        memory = vae.memory_used_decode(samples[:, :, :chunk_size].shape, vae.vae_dtype)
+        comfy.model_management.load_models_gpu([vae.patcher], memory_required=memory)
+
+    decoder = CausalDecoder(model)
+    total = 0
+    for start in range(0, samples.shape[2], chunk_size):
+        latent = samples[:, :, start:start + chunk_size].to(vae.vae_dtype).to(vae.device)
+        with torch.no_grad():
+            out = decoder.decode(latent)
+        images = vae.process_output(out.to(vae.output_device).float()).movedim(1, -1)
+        frames = to_uint8_frames(images)
+        del out, images
+        encoder.write(frames)
+        total += frames.shape[0]
+    return total
+
+
+class StreamingVAEDecodeSave:
+    """VAEDecode + CreateVideo + SaveVideo in one node, without holding all frames."""
+
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "samples": ("LATENT",),
+                "vae": ("VAE",),
+                "fps": ("FLOAT", {"default": 16.0, "min": 1.0, "max": 120.0, "step": 1.0}),
+                "filename_prefix": ("STRING", {"default": "video/ComfyUI"}),
+                "chunk_size": ("INT", {"default": 4, "min": 1, "max": 64}),
+                "crf": ("INT", {"default": 19, "min": 0, "max": 51}),
+                "queue_size": ("INT", {"default": 2, "min": 1, "max": 16}),
+            }
+        }
+
+    RETURN_TYPES = ()
+    OUTPUT_NODE = True
+    FUNCTION = "save"
+    CATEGORY = "latent/video/wan_worker"
+
+    def save(self, samples, vae, fps, filename_prefix, chunk_size, crf, queue_size):
+        import folder_paths
+
+        full_output_folder, filename, counter, subfolder, _ = folder_paths.get_save_image_path(
+            filename_prefix, folder_paths.get_output_directory()
+        )
+        file = f"{filename}_{counter:05}_.mp4"
+
+        encoder = FrameEncoder(os.path.join(full_output_folder, file), fps, crf, queue_size)
+        try:
+            decode_to_encoder(vae, samples["samples"], encoder, chunk_size)
+        except BaseException:
+            encoder.abort()
+            raise
+        encoder.close()
+
+        return {"ui": {"images": [{"filename": file, "subfolder": subfolder, "type": "output"}], "animated": (True,)}}
@@ -0,0 +1,124 @@
+"""
+Byte-bounded LRU cache of tensor dicts with optional safetensors spill to disk.
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+import torch
+from safetensors import safe_open
+from safetensors.torch import save_file
+
+
+def cache_key(*parts: str) -> str:
+    """Build a stable cache key from string parts."""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+class TensorCache:
+    """In-memory LRU of tensor dicts, bounded by total tensor bytes."""
+
+    def __init__(self, max_bytes: int, cache_dir: Optional[str] = None):
+        """
+        Initialize tensor cache.
+
+        Args:
+            max_bytes: Maximum total size of tensors held in memory
+            cache_dir: Directory for safetensors files (None disables disk)
+        """
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, Tuple[Dict[str, torch.Tensor], Dict[str, str], int]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    @property
+    def size_bytes(self) -> int:
+        """Total bytes currently held in memory."""
+        return self._bytes
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.safetensors")
+
+    def get(self, key: str) -> Optional[Tuple[Dict[str, torch.Tensor], Dict[str, str]]]:
+        """
+        Look up an entry, falling back to disk on a memory miss.
+
+        Args:
+            key: Cache key
+
+        Returns:
+            Tuple of (tensors, metadata) or None if not cached
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0], entry[1]
+
+        if self.cache_dir and os.path.exists(self._disk_path(key)):
+            try:
+                with safe_open(self._disk_path(key), framework='pt') as f:
+                    metadata = f.metadata() or {}
+                    tensors = {name: f.get_tensor(name) for name in f.keys()}
+            except Exception as e:
+                print(f"Warning: Failed to read cache entry {key}: {e}")
+            else:
+                self._insert(key, tensors, metadata)
+                with self._lock:
+                    self.hits += 1
+                return tensors, metadata
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, tensors: Dict[str, torch.Tensor], metadata: Optional[Dict[str, str]] = None) -> None:
+        """
+        Store an entry in memory and, if enabled, on disk.
+
+        Args:
+            key: Cache key
+            tensors: Tensors to cache (copied to contiguous CPU tensors)
+            metadata: String metadata stored alongside the tensors
+        """
+        tensors = {name: t.detach().to('cpu').contiguous() for name, t in tensors.items()}
+        metadata = dict(metadata or {})
+        self._insert(key, tensors, metadata)
+
+        if self.cache_dir:
+            tmp_path = self._disk_path(key) + ".tmp"
+            try:
+                save_file(tensors, tmp_path, metadata=metadata)
+                os.replace(tmp_path, self._disk_path(key))
+            except Exception as e:
+                print(f"Warning: Failed to write cache entry {key}: {e}")
+
+    def _insert(self, key: str, tensors: Dict[str, torch.Tensor], metadata: Dict[str, str]) -> None:
+        size = sum(t.numel() * t.element_size() for t in tensors.values())
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[2]
+            self._entries[key] = (tensors, metadata, size)
+            self._bytes += size
+
+            while self._bytes > self.max_bytes:
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
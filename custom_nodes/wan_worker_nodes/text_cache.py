@@ -0,0 +1,128 @@
+"""
+Persistent text-conditioning cache for CLIPTextEncode.
+
+Conditioning is keyed by (text encoder file, text), so repeat prompts and
+the default negative prompt skip the umt5-xxl forward pass entirely, even
+across ComfyUI restarts when the cache directory is on persistent storage.
+Each lookup is reported as a "tensor_cache" UI output, which the worker
+reads from the prompt history into its cache metrics.
+"""
+
+import json
+import os
+from typing import Any, Callable, Dict, List, Tuple
+
+import torch
+
+from .tensor_cache import TensorCache, cache_key
+
+
+TEXT_CACHE_DIR = os.getenv("TEXT_CACHE_DIR", "/ComfyUI/cache/text_conditioning")
+TEXT_CACHE_MAX_MB = int(os.getenv("TEXT_CACHE_MAX_MB", "512"))
+
+_cache = None
+
+
+def get_text_cache() -> TensorCache:
+    """Return the process-wide text-conditioning cache."""
+    global _cache
+    if _cache is None:
+        _cache = TensorCache(TEXT_CACHE_MAX_MB * 1024 * 1024, cache_dir=TEXT_CACHE_DIR or None)
+    return _cache
+
+
+def serialize_conditioning(conditioning: List[List[Any]]) -> Tuple[Dict[str, torch.Tensor], Dict[str, str]]:
+    """
+    Flatten ComfyUI conditioning into tensors plus string metadata.
+
+    Conditioning is a list of [cond_tensor, extras_dict]. Tensor-valued
+    extras (e.g. pooled_output) are stored as tensors; everything else
+    must be JSON-serializable and goes into metadata.
+    """
+    tensors = {}
+    layout = []
+    for index, (cond, extras) in enumerate(conditioning):
+        tensors[f"{index}.cond"] = cond
+        tensor_keys = []
+        plain = {}
+        for name, value in extras.items():
+            if isinstance(value, torch.Tensor):
+                tensors[f"{index}.{name}"] = value
+                tensor_keys.append(name)
+            else:
+                plain[name] = value
+        layout.append({"tensors": tensor_keys, "extras": plain})
+    return tensors, {"conditioning": json.dumps(layout)}
+
+
+def deserialize_conditioning(tensors: Dict[str, torch.Tensor], metadata: Dict[str, str]) -> List[List[Any]]:
+    """Inverse of serialize_conditioning."""
+    conditioning = []
+    for index, entry in enumerate(json.loads(metadata["conditioning"])):
+        extras = dict(entry["extras"])
+        for name in entry["tensors"]:
+            extras[name] = tensors[f"{index}.{name}"]
+        conditioning.append([tensors[f"{index}.cond"], extras])
+    return conditioning
+
+
+def encode_cached(
+    cache: TensorCache,
+    encoder_name: str,
+    text: str,
+    encode_fn: Callable[[str], List[List[Any]]]
+) -> Tuple[List[List[Any]], bool]:
+    """
+    Return conditioning for text, running encode_fn only on a cache miss.
+
+    Args:
+        cache: Tensor cache to consult
+        encoder_name: Text encoder file name (part of the key)
+        text: Prompt text
+        encode_fn: Function producing conditioning for text
+
+    Returns:
+        Tuple of (ComfyUI conditioning list, whether it came from the cache)
+    """
+    key = cache_key(encoder_name, text)
+    entry = cache.get(key)
+    if entry is not None:
+        return deserialize_conditioning(*entry), True
+
+    conditioning = encode_fn(text)
+    try:
+        tensors, metadata = serialize_conditioning(conditioning)
+    except (TypeError, ValueError) as e:
+        # Non-serializable extras: skip caching rather than fail the prompt
+        print(f"Warning: Text conditioning not cacheable: {e}")
+        return conditioning, False
+
+    cache.put(key, tensors, metadata)
+    return conditioning, False
+
+
+class CachedCLIPTextEncode:
+    """Drop-in CLIPTextEncode replacement backed by a persistent cache."""
+
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "text": ("STRING", {"multiline": True, "dynamicPrompts": True}),
+                "clip": ("CLIP",),
+                "clip_name": ("STRING", {"default": ""}),
+            }
+        }
+
+    RETURN_TYPES = ("CONDITIONING",)
+    FUNCTION = "encode"
+    CATEGORY = "conditioning/wan_worker"
+
+    def encode(self, clip, text, clip_name):
+        def encode_fn(prompt_text):
+            tokens = clip.tokenize(prompt_text)
+            return clip.encode_from_tokens_scheduled(tokens)
+
+        conditioning, hit = encode_cached(get_text_cache(), clip_name, text, encode_fn)
+        report = {"cache": "text_conditioning", "result": "hit" if hit else "miss"}
+        return {"ui": {"tensor_cache": [report]}, "result": (conditioning,)}
@@ -34,34 +34,9 @@ fi
 
 echo "✓ All required models found"
 
-# Start ComfyUI server in background
-echo "Starting ComfyUI server..."
-cd /ComfyUI
-python main.py --listen 0.0.0.0 --port 8188 > /tmp/comfyui.log 2>&1 &
-COMFYUI_PID=$!
-
-# Wait for ComfyUI to be ready
-echo "Waiting for ComfyUI to initialize..."
-MAX_WAIT=60
-WAIT_COUNT=0
-
-while [ $WAIT_COUNT -lt $MAX_WAIT ]; do
-    if curl -s http://localhost:8188/ > /dev/null 2>&1; then
-        echo "✓ ComfyUI is ready!"
-        break
-    fi
-    sleep 1
-    WAIT_COUNT=$((WAIT_COUNT + 1))
-done
-
-if [ $WAIT_COUNT -eq $MAX_WAIT ]; then
-    echo "ERROR: ComfyUI failed to start within $MAX_WAIT seconds"
-    echo "ComfyUI logs:"
-    cat /tmp/comfyui.log
-    exit 1
-fi
-
-# Start RunPod handler
+# Start RunPod handler; it launches ComfyUI under a supervisor that restarts
+# it on crashes (COMFYUI_CACHE_LRU / COMFYUI_PREVIEW_METHOD / COMFYUI_EXTRA_ARGS
+# configure the ComfyUI command line, logs go to /tmp/comfyui.log)
 echo "Starting RunPod handler..."
 cd /app
-python -u handler.py
+exec python -u handler.py
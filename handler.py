@@ -2,8 +2,12 @@
 RunPod serverless handler for Wan2.2 I2V Lightning worker.
 """
 
+import asyncio
+import functools
+import hashlib
 import os
 import sys
+import time
 import traceback
 import runpod
 
@@ -12,25 +16,383 @@ from src.utils import (
     download_image_from_url,
     decode_base64_image,
     encode_video_to_base64,
+    iter_base64_chunks,
     cleanup_files,
-    validate_image_file
+    validate_image_file,
+    submit_preprocess
 )
 from src.input_validator import validate_input, ValidationError
-from src.comfy_runner import ComfyUIRunner, ComfyUIError
+from src.aio import ThreadedGenerator, run_blocking
+from src.comfy_runner import ComfyUIRunner, ComfyUIError, file_sha256
+from src.batching import BatchScheduler
+from src.dispatch import DispatchGate, DeadlineExceeded, URGENT_PRIORITY, cache_features
+from src.long_video import SegmentChainer
+from src.media import FFmpegError, count_frames
+from src.postprocess import submit_postprocess, output_mime_type
+from src.concurrency import ConcurrencyController
+from src.supervisor import ComfyUISupervisor, comfyui_command, warm_up
+from src.vram_profile import resolve_profile
+from src.profiling import profile_job, requested_mode
+from src.metrics import (
+    JOBS,
+    JOBS_IN_FLIGHT,
+    BYTES_OUT,
+    COMFYUI_QUEUE_DEPTH,
+    StageTimer,
+    start_http_server,
+    start_textfile_exporter
+)
+
+
+# /run and /runsync return every yielded item; must be disabled for stream_output jobs
+# (rejected otherwise), whose chunks would all be kept in worker memory
+RETURN_AGGREGATE_STREAM = os.getenv("RETURN_AGGREGATE_STREAM", "1") == "1"
+
+# Micro-batching of compatible jobs (disabled when BATCH_WINDOW_MS is 0)
+BATCH_WINDOW_MS = int(os.getenv("BATCH_WINDOW_MS", "0"))
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "4"))
+
+# Graph rewrites enabling the worker's custom nodes (see src/graph_rewrites.py)
+GRAPH_REWRITES = [name.strip() for name in os.getenv("GRAPH_REWRITES", "").split(",") if name.strip()]
+
+# Concurrent jobs per worker, adjusted between the bounds from live load
+# (see src/concurrency.py); batching only groups jobs that run concurrently
+MIN_CONCURRENCY = int(os.getenv("MIN_CONCURRENCY", "1"))
+MAX_CONCURRENCY = int(os.getenv("MAX_CONCURRENCY", "1"))
+CONCURRENCY_LOW_BACKLOG_S = float(os.getenv("CONCURRENCY_LOW_BACKLOG_S", "60"))
+CONCURRENCY_HIGH_BACKLOG_S = float(os.getenv("CONCURRENCY_HIGH_BACKLOG_S", "180"))
+CONCURRENCY_HOLD_S = float(os.getenv("CONCURRENCY_HOLD_S", "30"))
+JOB_MEMORY_MB = float(os.getenv("JOB_MEMORY_MB", "3072"))
+MIN_FREE_MEMORY_MB = float(os.getenv("MIN_FREE_MEMORY_MB", "4096"))
+# Seconds between ComfyUI queue-depth samples feeding the controller
+CONCURRENCY_SAMPLE_S = float(os.getenv("CONCURRENCY_SAMPLE_S", "5"))
+
+# Cache-affinity reordering of concurrent jobs waiting for ComfyUI
+DISPATCH_WINDOW = int(os.getenv("DISPATCH_WINDOW", "4"))
+DISPATCH_MAX_SKIPS = int(os.getenv("DISPATCH_MAX_SKIPS", "3"))
+
+# Metrics exposure: HTTP /metrics on METRICS_PORT and/or a textfile (both off when unset)
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_TEXTFILE = os.getenv("METRICS_TEXTFILE", "")
+METRICS_TEXTFILE_INTERVAL = float(os.getenv("METRICS_TEXTFILE_INTERVAL", "15"))
+
+# ComfyUI process supervision (disable when ComfyUI is managed elsewhere)
+COMFYUI_SERVER = os.getenv("COMFYUI_SERVER", "127.0.0.1:8188")
+SUPERVISE_COMFYUI = os.getenv("SUPERVISE_COMFYUI", "1") == "1"
+COMFYUI_DIR = os.getenv("COMFYUI_DIR", "/ComfyUI")
+COMFYUI_WARMUP = os.getenv("COMFYUI_WARMUP", "1") == "1"
+COMFYUI_STARTUP_TIMEOUT = float(os.getenv("COMFYUI_STARTUP_TIMEOUT", "120"))
+
+# Workflow template; point at wan22_14B_i2v_lightning_merged.json when the UNets were
+# merged with scripts/merge_lora.py
+WORKFLOW_PATH = os.getenv("WORKFLOW_PATH", "/app/workflows/wan22_14B_i2v_lightning.json")
+
+# File transport to ComfyUI: "local" (shared filesystem) or "http" (/upload/image and /view,
+# for handlers running apart from the GPU host; usually with SUPERVISE_COMFYUI=0)
+COMFYUI_TRANSPORT = os.getenv("COMFYUI_TRANSPORT", "local")
+
+# Seconds between history polls (and websocket receive timeout) while a prompt runs
+COMFYUI_POLL_INTERVAL = float(os.getenv("COMFYUI_POLL_INTERVAL", "2.0"))
+
+
+class JobFailed(Exception):
+    """A job finished with an error result; raised so RunPod reports it as FAILED."""
+    pass
+
 
+_batch_scheduler = None
+_supervisor = None
+_dispatch_gate = DispatchGate(window=DISPATCH_WINDOW, max_skips=DISPATCH_MAX_SKIPS)
+_concurrency = ConcurrencyController(
+    min_concurrency=MIN_CONCURRENCY,
+    max_concurrency=MAX_CONCURRENCY,
+    low_backlog_seconds=CONCURRENCY_LOW_BACKLOG_S,
+    high_backlog_seconds=CONCURRENCY_HIGH_BACKLOG_S,
+    hold_seconds=CONCURRENCY_HOLD_S,
+    job_memory_mb=JOB_MEMORY_MB,
+    min_free_memory_mb=MIN_FREE_MEMORY_MB
+)
+
+
+def get_batch_scheduler(runner: ComfyUIRunner) -> BatchScheduler:
+    """Return the process-wide batch scheduler, creating it on first use."""
+    global _batch_scheduler
+    if _batch_scheduler is None:
+        _batch_scheduler = BatchScheduler(
+            runner,
+            window_seconds=BATCH_WINDOW_MS / 1000.0,
+            max_batch_size=BATCH_MAX_SIZE,
+            gate=_dispatch_gate
+        )
+    return _batch_scheduler
 
-def handler(job):
+
+def status_event(stage: str) -> dict:
+    """Build a job-level status event for the progress stream."""
+    return {"type": "status", "stage": stage}
+
+
+def stream_video(video_path: str, chunk_size: int, **tags):
     """
-    RunPod handler function for video generation.
+    Deliver a video as ordered base64 chunk events instead of one string.
+
+    Use with ``yield from`` (or ThreadedGenerator from async code): yields {"type": "video_chunk", "index", "data"}
+    events (plus tags, e.g. the variant index) and returns the summary that
+    replaces video_base64 in the result, so clients can verify reassembly.
 
     Args:
-        job: RunPod job object containing input parameters
+        video_path: Path (or /view URL) of the video to deliver
+        chunk_size: Base64 characters per chunk
+        **tags: Extra fields added to every chunk event
 
     Returns:
-        Dictionary with video_base64 and metadata, or error information
+        Dict with video_chunks, video_bytes and video_sha256 (of the raw video)
+    """
+    digest = hashlib.sha256()
+    chunks = 0
+    size = 0
+    for index, data in enumerate(iter_base64_chunks(video_path, chunk_size, digest)):
+        chunks += 1
+        size += len(data) // 4 * 3 - data.count('=')
+        yield dict(tags, type="video_chunk", index=index, data=data)
+    return {"video_chunks": chunks, "video_bytes": size, "video_sha256": digest.hexdigest()}
+
+
+async def run_prompt_variants(runner: ComfyUIRunner, params: dict, input_image_path: str, output_video_path: str, slot):
+    """
+    Fan out one input image over several prompts and encode each result.
+
+    The dispatch slot is held only while ComfyUI samples. Each variant is
+    post-processed and encoded (or streamed) in its own task from the moment
+    it finishes sampling, so its "variant_complete" event is not held back by
+    the variants still on the GPU; the last deliveries finish after the slot
+    is free for the next job. Yields a "generating" status, the variants'
+    chunks and "variant_complete" events as they finish, and finally
+    {"videos": [...]}.
+
+    Args:
+        runner: ComfyUI runner
+        params: Validated job parameters
+        input_image_path: Path to the prepared input image
+        output_video_path: Output path prefix for the variants
+        slot: Dispatch gate slot (async context manager) held while sampling
+
+    Yields:
+        Events, then {"videos": [...]} with {"prompt", "seed",
+        "delivered_frames", "video_base64"} dicts in request order (with
+        'stream_output', the stream_video summary replaces video_base64)
+    """
+    postprocess = bool(params['target_fps'] or params['output_profile'])
+    videos = [None] * len(params['prompts'])
+    events = asyncio.Queue(maxsize=1)  # bounded so streamed chunks are not buffered ahead of delivery
+    tasks = []
+
+    def spawn(coro) -> None:
+        """Run a sampling or delivery step as a task reporting to the event queue."""
+        async def run():
+            try:
+                await coro
+            except Exception as e:
+                await events.put(e)
+            else:
+                await events.put(None)
+        tasks.append(asyncio.create_task(run()))
+
+    async def sample():
+        async with slot:
+            await events.put(status_event("generating"))
+            gpu_start = time.perf_counter()
+            variants = ThreadedGenerator(runner.iter_variants(
+                prompts=params['prompts'],
+                seeds=params['seeds'],
+                negative_prompt=params['negative_prompt'],
+                input_image_path=input_image_path,
+                output_video_path=output_video_path,
+                width=params['width'],
+                height=params['height'],
+                frames=params['frames'],
+                fps=params['fps'],
+                cfg=params['cfg'],
+                steps=params['steps'],
+                step_cache_threshold=params['step_cache_threshold']
+            ))
+            try:
+                async for index, generated_path in variants:
+                    spawn(deliver(index, generated_path))
+            finally:
+                # An abandoned job's remaining variants are cancelled in ComfyUI
+                variants.close()
+            _concurrency.observe_gpu_time(params, time.perf_counter() - gpu_start)
+
+    async def deliver(index: int, generated_path: str):
+        output_path = generated_path
+        delivered_frames = params['frames']
+        future = None
+        try:
+            if postprocess:
+                future = submit_postprocess(
+                    generated_path,
+                    f"{output_video_path}_{index}_post",
+                    target_fps=params['target_fps'],
+                    profile=params['output_profile']
+                )
+                output_path = await asyncio.wrap_future(future)
+                future = None
+            if params['target_fps']:
+                delivered_frames = await run_blocking(count_frames, output_path) or round(
+                    params['frames'] * params['target_fps'] / params['fps']
+                )
+            print(f"Encoding output video for variant {index}: {output_path}")
+            if params['stream_output']:
+                chunks = ThreadedGenerator(stream_video(output_path, params['output_chunk_size'], video=index))
+                async for event in chunks:
+                    await events.put(event)
+                delivery = chunks.value
+            else:
+                delivery = {"video_base64": await run_blocking(encode_video_to_base64, output_path)}
+            videos[index] = {
+                "prompt": params['prompts'][index],
+                "seed": params['seeds'][index] if params['seeds'] else None,
+                "delivered_frames": delivered_frames,
+                **delivery
+            }
+        finally:
+            cleanup_files(generated_path, output_path)
+            if future is not None:
+                # Failed or abandoned job: drop the output once post-processing ends
+                future.add_done_callback(cleanup_postprocessed)
+        await events.put({"type": "variant_complete", "index": index, "total": len(videos)})
+
+    spawn(sample())
+    try:
+        done = 0
+        while done < len(tasks):
+            event = await events.get()
+            if event is None:
+                done += 1
+            elif isinstance(event, Exception):
+                raise event
+            else:
+                yield event
+        yield {"videos": videos}
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def cleanup_postprocessed(future) -> None:
+    """Done-callback removing the output of a post-processing job nobody will deliver."""
+    if not future.cancelled() and future.exception() is None:
+        cleanup_files(future.result())
+
+
+def start_supervisor() -> ComfyUISupervisor:
+    """Launch ComfyUI under supervision with a VRAM profile for this GPU, and warm it up."""
+    warmup_fn = None
+    if COMFYUI_WARMUP:
+        warmup_fn = functools.partial(warm_up, ComfyUIRunner(
+            server_address=COMFYUI_SERVER,
+            workflow_path=WORKFLOW_PATH,
+            rewrites=GRAPH_REWRITES,
+            transport=COMFYUI_TRANSPORT
+        ))
+
+    port = int(COMFYUI_SERVER.rsplit(":", 1)[1]) if ":" in COMFYUI_SERVER else 8188
+    profile = resolve_profile()
+    return ComfyUISupervisor(
+        comfyui_command(port=port, extra_args=profile.args()),
+        server_address=COMFYUI_SERVER,
+        cwd=COMFYUI_DIR,
+        log_path="/tmp/comfyui.log",
+        startup_timeout=COMFYUI_STARTUP_TIMEOUT,
+        warmup_fn=warmup_fn
+    ).start()
+
+
+def job_outcome(result: dict) -> str:
+    """Metrics label for a job's final result, e.g. "success" or "comfyui_execution_error"."""
+    if "error" not in result:
+        return "success"
+    return result["error"].split(":", 1)[0].strip().lower().replace(" ", "_").replace("-", "_")
+
+
+async def handler(job):
+    """
+    RunPod async generator handler: runs the job and reports it to metrics.
+
+    RunPod runs concurrent jobs as tasks on one event loop, so everything
+    that blocks happens on worker threads (see src/aio.py) and jobs wait
+    for the dispatch gate without holding up each other's event streams.
+    Status events time the job's stages; the final result determines the
+    outcome label and the bytes returned. Jobs requesting an allowed
+    'profile' mode run under the profiler.
+
+    RunPod only fails a generator job when the handler raises; an error
+    result is therefore not yielded but raised as JobFailed, after a final
+    "failed" status event.
+
+    Args:
+        job: RunPod job object containing input parameters
+
+    Yields:
+        Events and the successful result from run_job
+
+    Raises:
+        JobFailed: If run_job finished with an error result
+    """
+    JOBS_IN_FLIGHT.inc()
+    stages = StageTimer()
+    result = {"error": "Unexpected error: job aborted"}
+    streamed_bytes = 0
+    events = run_job(job)
+    profile_mode = requested_mode(job.get('input'))
+    if profile_mode:
+        events = profile_job(events, profile_mode, job.get('id') or generate_job_id())
+    try:
+        async for event in events:
+            if event.get("type") == "status":
+                stages.enter(event["stage"])
+            elif event.get("type") == "video_chunk":
+                streamed_bytes += len(event["data"])
+            elif "type" not in event:
+                result = event
+                if "error" in result:
+                    continue
+            yield event
+    finally:
+        stages.finish()
+        JOBS.inc(outcome=job_outcome(result))
+        videos = result.get("videos") or [result]
+        BYTES_OUT.inc(streamed_bytes + sum(len(video.get("video_base64") or "") for video in videos))
+        JOBS_IN_FLIGHT.dec()
+
+    if "error" in result:
+        yield status_event("failed")
+        raise JobFailed(result["error"])
+
+
+async def run_job(job):
+    """
+    Run one video generation job.
+
+    Yields progress events ({"type": ...}) while the job runs: status
+    changes, the node being executed, sampler step i/N and, when
+    'stream_previews' is set, low-resolution latent preview frames. The
+    last item yielded is the result.
+
+    Args:
+        job: RunPod job object containing input parameters
+
+    Yields:
+        Progress events, then a dictionary with video_base64 and metadata,
+        or error information
     """
     job_input = job['input']
     job_id = generate_job_id()
+    # deadline_ms counts from here: RunPod's job payload carries no enqueue
+    # time, so time spent in the endpoint queue is not included
+    received_at = time.monotonic()
 
     # File paths
     input_image_path = f"/tmp/input_{job_id}.png"
@@ -39,33 +401,59 @@ def handler(job):
     try:
         # ===== Step 1: Validate Input =====
         print("Validating input parameters...")
+        yield status_event("validating")
         try:
             params = validate_input(job_input)
         except ValidationError as e:
-            return {"error": f"Validation error: {str(e)}"}
+            yield {"error": f"Validation error: {str(e)}"}
+            return
+        if params['stream_output'] and RETURN_AGGREGATE_STREAM:
+            # Aggregation would keep every chunk in worker memory, defeating stream_output
+            yield {"error": "Validation error: 'stream_output' requires a worker deployed with RETURN_AGGREGATE_STREAM=0"}
+            return
+        _concurrency.job_started(job_id, params)
 
         # ===== Step 2: Prepare Input Image =====
         print("Preparing input image...")
+        yield status_event("preparing_image")
         try:
             if params['image_url']:
                 print(f"Downloading image from URL: {params['image_url']}")
-                download_image_from_url(params['image_url'], input_image_path)
+                await run_blocking(download_image_from_url, params['image_url'], input_image_path)
             else:
                 print("Decoding base64 image...")
-                decode_base64_image(params['image_base64'], input_image_path)
+                await run_blocking(decode_base64_image, params['image_base64'], input_image_path)
 
             # Validate image file
-            validate_image_file(input_image_path, max_size_mb=10)
+            await run_blocking(validate_image_file, input_image_path, max_size_mb=10)
+
+            if params['resize_mode'] != 'none':
+                # Orient and fit the image on the CPU so ComfyUI loads a small, exactly sized input
+                prepared_image_path = await asyncio.wrap_future(submit_preprocess(
+                    input_image_path,
+                    f"/tmp/input_{job_id}_prepared",
+                    params['width'],
+                    params['height'],
+                    params['resize_mode']
+                ))
+                cleanup_files(input_image_path)
+                input_image_path = prepared_image_path
 
         except Exception as e:
             cleanup_files(input_image_path)
-            return {"error": f"Image processing error: {str(e)}"}
+            yield {"error": f"Image processing error: {str(e)}"}
+            return
 
         # ===== Step 3: Run ComfyUI Workflow =====
         print("Initializing ComfyUI runner...")
         runner = ComfyUIRunner(
-            server_address=os.getenv("COMFYUI_SERVER", "127.0.0.1:8188"),
-            workflow_path="/app/workflows/wan22_14B_i2v_lightning.json"
+            server_address=COMFYUI_SERVER,
+            workflow_path=WORKFLOW_PATH,
+            poll_interval=COMFYUI_POLL_INTERVAL,
+            rewrites=GRAPH_REWRITES,
+            supervisor=_supervisor,
+            transport=COMFYUI_TRANSPORT,
+            front=params['priority'] == URGENT_PRIORITY
         )
 
         print("Executing workflow...")
@@ -73,47 +461,223 @@ def handler(job):
         print(f"  Dimensions: {params['width']}x{params['height']}")
         print(f"  Frames: {params['frames']} @ {params['fps']} fps")
         print(f"  CFG: {params['cfg']}, Steps: {params['steps']}")
+        if params['segments'] > 1:
+            print(f"  Segments: {params['segments']}")
+
+        features = cache_features(params, await run_blocking(file_sha256, input_image_path))
+        deadline = received_at + params['deadline_ms'] / 1000 if params['deadline_ms'] else None
+        slot_args = dict(
+            priority=params['priority'],
+            deadline=deadline,
+            cost_seconds=_concurrency.cost_model.predict(params)
+        )
+        yield status_event("waiting_for_gpu")
 
+        # Multi-prompt fan-out: one upload, all variants queued back-to-back
+        if len(params['prompts']) > 1:
+            print(f"  Variants: {len(params['prompts'])}")
+            try:
+                slot = _dispatch_gate.slot(features, **slot_args)
+                async for event in run_prompt_variants(runner, params, input_image_path, output_video_path, slot):
+                    if "type" in event:
+                        yield event
+                    else:
+                        videos = event["videos"]
+                step_cache = runner.pop_step_cache_stats(output_video_path)
+            except ComfyUIError as e:
+                cleanup_files(input_image_path)
+                yield {"error": f"ComfyUI execution error: {str(e)}"}
+                return
+            except FFmpegError as e:
+                cleanup_files(input_image_path)
+                yield {"error": f"Post-processing error: {str(e)}"}
+                return
+            except DeadlineExceeded as e:
+                cleanup_files(input_image_path)
+                yield {"error": f"Deadline exceeded: {str(e)}"}
+                return
+
+            cleanup_files(input_image_path)
+            print("Video generation completed successfully!")
+            metadata = {
+                "width": params['width'],
+                "height": params['height'],
+                "frames": params['frames'],
+                "fps": params['fps'],
+                "cfg": params['cfg'],
+                "steps": params['steps'],
+                "generated_frames": params['frames'],
+                "delivered_fps": params['target_fps'] or params['fps'],
+                "output_profile": params['output_profile'] or "default",
+                "mime_type": output_mime_type(params['output_profile'])
+            }
+            if step_cache:
+                metadata["step_cache"] = step_cache
+            yield {
+                "videos": videos,
+                "metadata": metadata
+            }
+            return
+
+        workflow_params = dict(
+            prompt=params['prompt'],
+            negative_prompt=params['negative_prompt'],
+            input_image_path=input_image_path,
+            output_video_path=output_video_path,
+            width=params['width'],
+            height=params['height'],
+            frames=params['frames'],
+            fps=params['fps'],
+            cfg=params['cfg'],
+            steps=params['steps'],
+            seed=params['seeds'][0] if params['seeds'] else None,
+            step_cache_threshold=params['step_cache_threshold']
+        )
+
+        # Urgent and deadline jobs skip the batching window and go through the gate
+        batched = (
+            params['segments'] == 1 and BATCH_WINDOW_MS > 0
+            and params['priority'] != URGENT_PRIORITY and deadline is None
+        )
         try:
-            actual_output_path = runner.run_workflow(
-                prompt=params['prompt'],
-                negative_prompt=params['negative_prompt'],
-                input_image_path=input_image_path,
-                output_video_path=output_video_path,
-                width=params['width'],
-                height=params['height'],
-                frames=params['frames'],
-                fps=params['fps'],
-                cfg=params['cfg'],
-                steps=params['steps']
-            )
+            if params['segments'] > 1:
+                # Long-video mode: chain segments, muxing each while the next samples
+                async with _dispatch_gate.slot(features, **slot_args):
+                    yield status_event("generating")
+                    gpu_start = time.perf_counter()
+                    chain = ThreadedGenerator(SegmentChainer(runner).run(
+                        segments=params['segments'],
+                        previews=params['stream_previews'],
+                        **workflow_params
+                    ))
+                    async for event in chain:
+                        yield event
+                    actual_output_path = chain.value
+            elif batched:
+                # The batch takes the gate once for all of its jobs; the job is
+                # "generating" from then on, not from when it joined the batch
+                started = asyncio.Event()
+                batch = asyncio.create_task(get_batch_scheduler(runner).submit(
+                    features,
+                    priority=params['priority'],
+                    cost_seconds=slot_args['cost_seconds'],
+                    started=started,
+                    **workflow_params
+                ))
+                try:
+                    admitted = asyncio.create_task(started.wait())
+                    await asyncio.wait([batch, admitted], return_when=asyncio.FIRST_COMPLETED)
+                    admitted.cancel()
+                    if started.is_set():
+                        yield status_event("generating")
+                    actual_output_path = await batch
+                finally:
+                    # An abandoned job leaves its batch; the other jobs still run
+                    batch.cancel()
+            else:
+                async with _dispatch_gate.slot(features, **slot_args):
+                    yield status_event("generating")
+                    gpu_start = time.perf_counter()
+                    # Remote outputs that need no post-processing stream from /view into the encoder
+                    run = ThreadedGenerator(runner.stream_workflow(
+                        previews=params['stream_previews'],
+                        download=bool(params['target_fps'] or params['output_profile']),
+                        **workflow_params
+                    ))
+                    async for event in run:
+                        yield event
+                    actual_output_path = run.value
         except ComfyUIError as e:
             cleanup_files(input_image_path)
-            return {"error": f"ComfyUI execution error: {str(e)}"}
+            yield {"error": f"ComfyUI execution error: {str(e)}"}
+            return
+        except FFmpegError as e:
+            cleanup_files(input_image_path)
+            yield {"error": f"Segment muxing error: {str(e)}"}
+            return
+        except DeadlineExceeded as e:
+            cleanup_files(input_image_path)
+            yield {"error": f"Deadline exceeded: {str(e)}"}
+            return
+        # Batched prompts complete on the shared scheduler's runner; their GPU time
+        # is shared by the batch and says nothing about a single job's cost
+        if batched:
+            step_cache = _batch_scheduler.runner.pop_step_cache_stats(output_video_path)
+        else:
+            _concurrency.observe_gpu_time(params, time.perf_counter() - gpu_start)
+            step_cache = runner.pop_step_cache_stats(output_video_path)
 
-        # ===== Step 4: Encode Output Video =====
+        # ===== Step 4: CPU Post-processing (GPU is already free for the next job) =====
+        generated_frames = params['segments'] * params['frames']
+        delivered_frames = generated_frames
+        generated_output_path = actual_output_path
+        if params['target_fps'] or params['output_profile']:
+            if params['target_fps']:
+                print(f"Interpolating output video to {params['target_fps']} fps...")
+                yield status_event("interpolating")
+            if params['output_profile']:
+                print(f"Re-encoding output video with profile {params['output_profile']}...")
+                yield status_event("transcoding")
+            try:
+                # Awaited without a thread: the pool bounds concurrent ffmpeg processes
+                actual_output_path = await asyncio.wrap_future(submit_postprocess(
+                    generated_output_path,
+                    f"{output_video_path}_post",
+                    target_fps=params['target_fps'],
+                    profile=params['output_profile']
+                ))
+            except FFmpegError as e:
+                cleanup_files(input_image_path, generated_output_path)
+                yield {"error": f"Post-processing error: {str(e)}"}
+                return
+            if params['target_fps']:
+                delivered_frames = await run_blocking(count_frames, actual_output_path) or round(
+                    generated_frames * params['target_fps'] / params['fps']
+                )
+
+        # ===== Step 5: Encode Output Video =====
         print(f"Encoding output video: {actual_output_path}")
+        yield status_event("encoding_output")
         try:
-            video_base64 = encode_video_to_base64(actual_output_path)
+            if params['stream_output']:
+                # Bounded memory: chunks leave the worker as they are encoded
+                chunks = ThreadedGenerator(stream_video(actual_output_path, params['output_chunk_size']))
+                async for event in chunks:
+                    yield event
+                delivery = chunks.value
+            else:
+                delivery = {"video_base64": await run_blocking(encode_video_to_base64, actual_output_path)}
         except Exception as e:
-            cleanup_files(input_image_path, actual_output_path)
-            return {"error": f"Video encoding error: {str(e)}"}
+            cleanup_files(input_image_path, generated_output_path, actual_output_path)
+            yield {"error": f"Video encoding error: {str(e)}"}
+            return
 
-        # ===== Step 5: Cleanup and Return =====
+        # ===== Step 6: Cleanup and Return =====
         print("Cleaning up temporary files...")
-        cleanup_files(input_image_path, actual_output_path)
+        cleanup_files(input_image_path, generated_output_path, actual_output_path)
 
         print("Video generation completed successfully!")
-        return {
-            "video_base64": video_base64,
-            "metadata": {
-                "width": params['width'],
-                "height": params['height'],
-                "frames": params['frames'],
-                "fps": params['fps'],
-                "cfg": params['cfg'],
-                "steps": params['steps']
-            }
+        metadata = {
+            "width": params['width'],
+            "height": params['height'],
+            "frames": params['frames'],
+            "fps": params['fps'],
+            "cfg": params['cfg'],
+            "steps": params['steps'],
+            "generated_frames": generated_frames,
+            "delivered_frames": delivered_frames,
+            "delivered_fps": params['target_fps'] or params['fps'],
+            "output_profile": params['output_profile'] or "default",
+            "mime_type": output_mime_type(params['output_profile'])
+        }
+        if params['segments'] > 1:
+            metadata["segments"] = params['segments']
+            metadata["total_frames"] = params['segments'] * params['frames']
+        if step_cache:
+            metadata["step_cache"] = step_cache
+        yield {
+            **delivery,
+            "metadata": metadata
         }
 
     except Exception as e:
@@ -123,14 +687,39 @@ def handler(job):
 
         cleanup_files(input_image_path, output_video_path)
 
-        return {
+        yield {
             "error": f"Unexpected error: {str(e)}",
             "traceback": traceback.format_exc()
         }
+    finally:
+        _concurrency.job_finished(job_id)
 
 
 if __name__ == "__main__":
     print("Starting Wan2.2 I2V Lightning RunPod Worker...")
-    print(f"ComfyUI Server: {os.getenv('COMFYUI_SERVER', '127.0.0.1:8188')}")
+    print(f"ComfyUI Server: {COMFYUI_SERVER}")
+
+    if SUPERVISE_COMFYUI:
+        try:
+            _supervisor = start_supervisor()
+        except (ComfyUIError, ValueError) as e:
+            print(f"ERROR: {e}")
+            print("ComfyUI logs: /tmp/comfyui.log")
+            sys.exit(1)
+
+    queue_runner = ComfyUIRunner(server_address=COMFYUI_SERVER, transport=COMFYUI_TRANSPORT)
+    COMFYUI_QUEUE_DEPTH.set_function(queue_runner.get_queue_depth)
+    _concurrency.queue_depth_fn = queue_runner.get_queue_depth
+    _concurrency.start_sampling(CONCURRENCY_SAMPLE_S)
+    if METRICS_PORT:
+        start_http_server(METRICS_PORT)
+        print(f"Metrics: http://0.0.0.0:{METRICS_PORT}/metrics")
+    if METRICS_TEXTFILE:
+        start_textfile_exporter(METRICS_TEXTFILE, METRICS_TEXTFILE_INTERVAL)
+        print(f"Metrics textfile: {METRICS_TEXTFILE}")
 
-    runpod.serverless.start(handler)
+    runpod.serverless.start({
+        "handler": handler,
+        "concurrency_modifier": _concurrency,
+        "return_aggregate_stream": RETURN_AGGREGATE_STREAM
+    })
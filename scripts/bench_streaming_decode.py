@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Peak-RSS benchmark: full VAE decode vs. StreamingVAEDecodeSave.
+
+Runs each mode in a fresh child process with a randomly initialized Wan 2.1
+VAE from ComfyUI (narrowed with --dim so it runs on CPU) and reports the
+child's peak resident set size and wall time. Requires torch, ffmpeg and a
+ComfyUI checkout (COMFYUI_DIR, default /ComfyUI); no GPU or model weights.
+
+Usage:
+    python scripts/bench_streaming_decode.py [--width 1024 --height 1024 --frames 121 --dim 32]
+"""
+
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(1, os.getenv("COMFYUI_DIR", "/ComfyUI"))
+
+
+class BenchVAE:
+    """The parts of comfy.sd.VAE that VAEDecode and StreamingVAEDecodeSave use, on CPU."""
+
+    def __init__(self, dim: int):
+        import torch
+        from comfy.ldm.wan.vae import WanVAE
+
+        self.first_stage_model = WanVAE(dim=dim, z_dim=16).eval()
+        self.vae_dtype = torch.float32
+        self.device = self.output_device = torch.device("cpu")
+
+    def process_output(self, image):
+        return image.add(1.0).div(2.0).clamp(0.0, 1.0)
+
+    def decode(self, latent):
+        import torch
+        with torch.no_grad():
+            return self.process_output(self.first_stage_model.decode(latent)).movedim(1, -1)
+
+
+def run_mode(mode: str, width: int, height: int, frames: int, chunk_size: int, dim: int) -> None:
+    """Decode and encode one clip in the current process."""
+    import torch
+    from custom_nodes.wan_worker_nodes.streaming_decode import FrameEncoder, decode_to_encoder, to_uint8_frames
+
+    vae = BenchVAE(dim)
+    latent = torch.randn(1, 16, (frames - 1) // 4 + 1, height // 8, width // 8)
+    output_path = os.path.join(tempfile.mkdtemp(), f"{mode}.mp4")
+    encoder = FrameEncoder(output_path, fps=16)
+
+    if mode == "full":
+        # Stock path: VAEDecode holds every frame as float32, SaveVideo converts per frame
+        images = vae.decode(latent).reshape(-1, height, width, 3)
+        for frame in images:
+            encoder.write(to_uint8_frames(frame.unsqueeze(0)))
+    else:
+        decode_to_encoder(vae, latent, encoder, chunk_size=chunk_size)
+    encoder.close()
+    os.remove(output_path)
+
+
+def measure(mode: str, args) -> None:
+    """Run one mode in a child process and print its peak RSS."""
+    cmd = [sys.executable, __file__, "--mode", mode, "--width", str(args.width), "--height", str(args.height),
+           "--frames", str(args.frames), "--chunk-size", str(args.chunk_size), "--dim", str(args.dim)]
+    start = time.time()
+    subprocess.run(cmd, check=True)
+    elapsed = time.time() - start
+    # ru_maxrss covers the largest waited-for child; run modes in increasing-memory order
+    peak_mb = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    print(f"{mode:>10}: peak RSS {peak_mb:8.1f} MB, {elapsed:6.1f} s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=["full", "streaming"], help="Run a single mode (internal)")
+    parser.add_argument("--width", type=int, default=1024)
+    parser.add_argument("--height", type=int, default=1024)
+    parser.add_argument("--frames", type=int, default=121)
+    parser.add_argument("--chunk-size", type=int, default=4, help="Latent frames per streamed chunk")
+    parser.add_argument("--dim", type=int, default=32, help="VAE base width (96 in the released VAE)")
+    args = parser.parse_args()
+
+    if args.mode:
+        run_mode(args.mode, args.width, args.height, args.frames, args.chunk_size, args.dim)
+        return
+
+    print(f"Decoding {args.frames} frames at {args.width}x{args.height}")
+    measure("streaming", args)
+    measure("full", args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,452 @@
+#!/usr/bin/env python3
+"""
+Offline LoRA pre-merge: fuse the Lightning LoRAs into the Wan UNets.
+
+The stock workflow loads each 14B fp8 UNet (nodes 144/145) and patches it
+with a lightx2v 4-step LoRA (LoraLoaderModelOnly, nodes 148/149) on every
+cold start. This tool applies each LoRA once, at the strength configured
+in the workflow, and writes a merged UNet file per expert, a manifest, and
+a workflow variant whose UNETLoaders read the merged files directly.
+
+The merge follows ComfyUI's LoRA math (up @ down scaled by alpha / rank,
+plus full "diff" / "diff_b" patches). Scaled fp8 weights are dequantized
+with their scale_weight, merged in float32 and quantized back with the
+same scale; the scale only grows when a merged value would overflow fp8.
+Tensors are streamed one at a time, so memory stays at about one layer
+regardless of model size. Requires torch; runs on CPU.
+
+Usage:
+    python scripts/merge_lora.py [--models-dir /ComfyUI/models] \\
+        [--workflow workflows/wan22_14B_i2v_lightning.json] \\
+        [--workflow-out workflows/wan22_14B_i2v_lightning_merged.json]
+"""
+
+import argparse
+import copy
+import hashlib
+import json
+import os
+import struct
+import sys
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+
+# Suffix of merged UNet files: <base name>_<suffix>.safetensors
+MERGED_SUFFIX = "lightx2v_4steps_merged"
+
+# Manifest written next to the merged files
+MANIFEST_NAME = "lora_merge_manifest.json"
+
+# Prefixes LoRA and base keys may carry in front of the transformer's module names
+KEY_PREFIXES = ("model.diffusion_model.", "diffusion_model.")
+
+# safetensors dtype codes
+DTYPES = {
+    "F64": "float64", "F32": "float32", "F16": "float16", "BF16": "bfloat16",
+    "F8_E4M3": "float8_e4m3fn", "F8_E5M2": "float8_e5m2",
+    "I64": "int64", "I32": "int32", "I16": "int16", "I8": "int8", "U8": "uint8", "BOOL": "bool",
+}
+
+
+def strip_prefix(key: str) -> str:
+    """Module path of a key without its diffusion_model prefix."""
+    for prefix in KEY_PREFIXES:
+        if key.startswith(prefix):
+            return key[len(prefix):]
+    return key
+
+
+class SafetensorsFile:
+    """Read-only access to a safetensors file's header and raw tensor bytes."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            (header_size,) = struct.unpack("<Q", f.read(8))
+            header = json.loads(f.read(header_size))
+        self.data_start = 8 + header_size
+        self.metadata: Dict[str, str] = header.pop("__metadata__", None) or {}
+        # Tensors in file order
+        self.tensors: Dict[str, Dict[str, Any]] = dict(
+            sorted(header.items(), key=lambda item: item[1]["data_offsets"][0])
+        )
+
+    def read_bytes(self, f, name: str) -> bytearray:
+        """Raw bytes of one tensor from an open handle of this file."""
+        start, end = self.tensors[name]["data_offsets"]
+        f.seek(self.data_start + start)
+        data = bytearray(end - start)
+        f.readinto(data)
+        return data
+
+    def read(self, f, name: str):
+        """One tensor from an open handle of this file."""
+        info = self.tensors[name]
+        return bytes_to_tensor(self.read_bytes(f, name), info["dtype"], info["shape"])
+
+
+def bytes_to_tensor(data: bytearray, dtype: str, shape: List[int]):
+    """Tensor viewing raw little-endian safetensors bytes."""
+    import torch
+    if not data:
+        return torch.empty(shape, dtype=getattr(torch, DTYPES[dtype]))
+    return torch.frombuffer(data, dtype=getattr(torch, DTYPES[dtype])).reshape(shape)
+
+
+def tensor_to_bytes(tensor) -> bytearray:
+    """Raw bytes of a tensor, without going through numpy (which lacks fp8/bf16)."""
+    import torch
+    source = tensor.contiguous().reshape(-1).view(torch.uint8)
+    data = bytearray(source.numel())
+    if data:
+        torch.frombuffer(data, dtype=torch.uint8).copy_(source)
+    return data
+
+
+def save_tensors(path: str, tensors: Dict[str, Any], metadata: Optional[Dict[str, str]] = None) -> None:
+    """Write tensors as a safetensors file (used for small files such as test fixtures)."""
+    codes = {name: code for code, name in DTYPES.items()}
+    header: Dict[str, Any] = {"__metadata__": metadata} if metadata else {}
+    blobs = []
+    offset = 0
+    for name, tensor in tensors.items():
+        data = tensor_to_bytes(tensor)
+        header[name] = {
+            "dtype": codes[str(tensor.dtype).replace("torch.", "")],
+            "shape": list(tensor.shape),
+            "data_offsets": [offset, offset + len(data)],
+        }
+        blobs.append(data)
+        offset += len(data)
+    header_bytes = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    header_bytes += b" " * (-len(header_bytes) % 8)
+    with open(path, "wb") as f:
+        f.write(struct.pack("<Q", len(header_bytes)))
+        f.write(header_bytes)
+        for data in blobs:
+            f.write(data)
+
+
+def load_lora(path: str) -> Dict[str, Any]:
+    """All tensors of a (small) LoRA file."""
+    lora = SafetensorsFile(path)
+    with open(path, "rb") as f:
+        return {name: lora.read(f, name) for name in lora.tensors}
+
+
+def lora_patches(lora: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    """
+    Group LoRA tensors by the module they patch.
+
+    Args:
+        lora: LoRA tensors by key
+
+    Returns:
+        Module path -> {"up", "down", "alpha", "diff", "diff_b"} (present parts only)
+
+    Raises:
+        ValueError: On LoRA variants this tool does not merge (e.g. LoCon mid weights)
+    """
+    suffixes = (
+        (".lora_up.weight", "up"), (".lora_down.weight", "down"),
+        (".lora_B.weight", "up"), (".lora_A.weight", "down"),
+        (".alpha", "alpha"), (".diff_b", "diff_b"), (".diff", "diff"),
+    )
+    patches: Dict[str, Dict[str, Any]] = {}
+    for key, tensor in lora.items():
+        for suffix, part in suffixes:
+            if key.endswith(suffix):
+                module = strip_prefix(key[:-len(suffix)])
+                patches.setdefault(module, {})[part] = tensor
+                break
+        else:
+            raise ValueError(f"Unsupported LoRA key: {key}")
+    for module, patch in patches.items():
+        if ("up" in patch) != ("down" in patch):
+            raise ValueError(f"LoRA module {module} has only one of lora_up/lora_down")
+    return patches
+
+
+def weight_delta(patch: Dict[str, Any], shape: Tuple[int, ...], strength: float):
+    """Float32 change a module's LoRA makes to its weight (ComfyUI's formula)."""
+    import torch
+    delta = torch.zeros(shape, dtype=torch.float32)
+    if "up" in patch:
+        up = patch["up"].float().flatten(start_dim=1)
+        down = patch["down"].float().flatten(start_dim=1)
+        alpha = patch["alpha"].item() / down.shape[0] if "alpha" in patch else 1.0
+        delta += (strength * alpha) * torch.mm(up, down).reshape(shape)
+    if "diff" in patch:
+        delta += strength * patch["diff"].float().reshape(shape)
+    return delta
+
+
+def cast_weight(weight, dtype):
+    """Cast a float32 weight back to its stored dtype (fp8 saturates instead of overflowing to NaN)."""
+    import torch
+    if dtype in (torch.float8_e4m3fn, torch.float8_e5m2):
+        limit = torch.finfo(dtype).max
+        weight = weight.clamp(-limit, limit)
+    return weight.to(dtype)
+
+
+def quantize_fp8(weight, scale, dtype):
+    """
+    Quantize a float32 weight to scaled fp8.
+
+    Keeps the existing scale unless the weight would overflow the fp8 range,
+    in which case the scale grows just enough to hold it.
+
+    Returns:
+        Tuple of (fp8 weight, float32 scale)
+    """
+    import torch
+    scale = scale.float()
+    needed = weight.abs().max() / torch.finfo(dtype).max
+    if needed > scale.max():
+        scale = torch.maximum(scale, needed)
+    return cast_weight(weight / scale, dtype), scale
+
+
+def merge_file(
+    base_path: str,
+    lora_path: str,
+    strength: float,
+    output_path: str
+) -> Dict[str, Any]:
+    """
+    Write base_path with lora_path fused in, streaming one tensor at a time.
+
+    Args:
+        base_path: UNet safetensors (fp8 scaled or floating point)
+        lora_path: LoRA safetensors
+        strength: LoRA strength (strength_model of LoraLoaderModelOnly)
+        output_path: Merged safetensors to write
+
+    LoRA modules with no matching weight (or bias) in the base model are
+    skipped with a warning, as ComfyUI's LoRA loader does ("lora key not
+    loaded"), and counted in the statistics.
+
+    Returns:
+        Merge statistics for the manifest
+    """
+    import torch
+
+    base = SafetensorsFile(base_path)
+    patches = lora_patches(load_lora(lora_path))
+    modules = {strip_prefix(name): name for name in base.tensors}
+
+    # Map every patch onto base tensor names before writing anything
+    targets: Dict[str, Tuple[str, Dict[str, Any]]] = {}
+    skipped = set()
+    for module, patch in patches.items():
+        if "up" in patch or "diff" in patch:
+            weight_name = modules.get(f"{module}.weight")
+            if weight_name is None:
+                print(f"Warning: LoRA module {module} has no weight in {os.path.basename(base_path)}, skipped")
+                skipped.add(module)
+            else:
+                targets[weight_name] = ("weight", patch)
+        if "diff_b" in patch:
+            bias_name = modules.get(f"{module}.bias")
+            if bias_name is None:
+                print(f"Warning: LoRA module {module} has no bias in {os.path.basename(base_path)}, skipped")
+                skipped.add(module)
+            else:
+                targets[bias_name] = ("bias", patch)
+
+    # Scale tensors that change with their weight are written with it
+    scale_of = {}
+    for name, (kind, _) in targets.items():
+        scale_name = name[:-len(".weight")] + ".scale_weight" if kind == "weight" else None
+        if scale_name in base.tensors and base.tensors[name]["dtype"].startswith("F8"):
+            scale_of[name] = scale_name
+
+    metadata = dict(base.metadata)
+    metadata["lora_merge"] = json.dumps({
+        "lora": os.path.basename(lora_path), "strength": strength, "base": os.path.basename(base_path)
+    })
+    header = {"__metadata__": metadata, **base.tensors}
+    header_bytes = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    header_bytes += b" " * (-len(header_bytes) % 8)
+
+    grown_scales = 0
+    data_start = 8 + len(header_bytes)
+    tmp_path = f"{output_path}.tmp"
+    with open(base_path, "rb") as source, open(tmp_path, "wb") as out:
+        out.write(struct.pack("<Q", len(header_bytes)))
+        out.write(header_bytes)
+
+        def write(name: str, data: bytearray) -> None:
+            # Sizes are unchanged, so every tensor keeps its offset
+            out.seek(data_start + base.tensors[name]["data_offsets"][0])
+            out.write(data)
+
+        merged_scales = set(scale_of.values())
+        for name in base.tensors:
+            if name in merged_scales:
+                continue
+            if name not in targets:
+                write(name, base.read_bytes(source, name))
+                continue
+            kind, patch = targets[name]
+            tensor = base.read(source, name)
+            if kind == "bias":
+                merged = tensor.float() + strength * patch["diff_b"].float().reshape(tensor.shape)
+                write(name, tensor_to_bytes(cast_weight(merged, tensor.dtype)))
+            elif name in scale_of:
+                scale = base.read(source, scale_of[name])
+                weight = tensor.float() * scale.float() + weight_delta(patch, tuple(tensor.shape), strength)
+                quantized, new_scale = quantize_fp8(weight, scale, tensor.dtype)
+                grown_scales += int(not torch.equal(new_scale, scale.float()))
+                write(name, tensor_to_bytes(quantized))
+                write(scale_of[name], tensor_to_bytes(new_scale.to(scale.dtype)))
+            else:
+                merged = tensor.float() + weight_delta(patch, tuple(tensor.shape), strength)
+                write(name, tensor_to_bytes(cast_weight(merged, tensor.dtype)))
+    os.replace(tmp_path, output_path)
+
+    return {
+        "patched_tensors": len(targets),
+        "lora_modules": len(patches),
+        "skipped_lora_modules": len(skipped),
+        "grown_fp8_scales": grown_scales,
+    }
+
+
+def lora_merges(workflow: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    LoraLoaderModelOnly nodes applied directly to a UNETLoader.
+
+    Returns:
+        One dict per LoRA node: lora_node, unet_node, unet_name, lora_name, strength
+    """
+    merges = []
+    for node_id, node in workflow.items():
+        if node.get("class_type") != "LoraLoaderModelOnly":
+            continue
+        source_id = node["inputs"]["model"][0]
+        source = workflow.get(source_id, {})
+        if source.get("class_type") != "UNETLoader":
+            continue
+        merges.append({
+            "lora_node": node_id,
+            "unet_node": source_id,
+            "unet_name": source["inputs"]["unet_name"],
+            "lora_name": node["inputs"]["lora_name"],
+            "strength": float(node["inputs"]["strength_model"]),
+        })
+    return merges
+
+
+def merged_name(unet_name: str, suffix: str = MERGED_SUFFIX) -> str:
+    """File name of the merged variant of a UNet."""
+    stem, extension = os.path.splitext(unet_name)
+    return f"{stem}_{suffix}{extension}"
+
+
+def merged_workflow(workflow: Dict[str, Any], suffix: str = MERGED_SUFFIX) -> Dict[str, Any]:
+    """
+    Workflow variant loading merged UNets instead of applying LoRAs.
+
+    Each merged LoraLoaderModelOnly node is removed, its UNETLoader reads the
+    merged file, and links to the LoRA node are pointed at the UNETLoader.
+    """
+    result = copy.deepcopy(workflow)
+    for merge in lora_merges(workflow):
+        result[merge["unet_node"]]["inputs"]["unet_name"] = merged_name(merge["unet_name"], suffix)
+        del result[merge["lora_node"]]
+        for node in result.values():
+            for name, value in node["inputs"].items():
+                if isinstance(value, list) and len(value) == 2 and value[0] == merge["lora_node"]:
+                    node["inputs"][name] = [merge["unet_node"], value[1]]
+    return result
+
+
+def file_sha256(path: str) -> str:
+    """sha256 of a file, read in 1 MiB blocks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def merge_workflow_loras(
+    workflow_path: str,
+    models_dir: str,
+    output_dir: Optional[str] = None,
+    workflow_out: Optional[str] = None,
+    suffix: str = MERGED_SUFFIX
+) -> Dict[str, Any]:
+    """
+    Merge every LoRA of a workflow into its UNet and write the manifest.
+
+    Args:
+        workflow_path: API-format workflow with UNETLoader -> LoraLoaderModelOnly chains
+        models_dir: ComfyUI models directory (diffusion_models/ and loras/)
+        output_dir: Destination of merged UNets (defaults to models_dir/diffusion_models)
+        workflow_out: Path of the merged workflow variant (not written if None)
+        suffix: Merged file name suffix
+
+    Returns:
+        The manifest
+    """
+    with open(workflow_path, "r", encoding="utf-8") as f:
+        workflow = json.load(f)
+    output_dir = output_dir or os.path.join(models_dir, "diffusion_models")
+    os.makedirs(output_dir, exist_ok=True)
+
+    entries = []
+    for merge in lora_merges(workflow):
+        base_path = os.path.join(models_dir, "diffusion_models", merge["unet_name"])
+        lora_path = os.path.join(models_dir, "loras", merge["lora_name"])
+        output_name = merged_name(merge["unet_name"], suffix)
+        print(f"Merging {merge['lora_name']} (strength {merge['strength']:g}) into {merge['unet_name']}...")
+        start = time.time()
+        stats = merge_file(base_path, lora_path, merge["strength"], os.path.join(output_dir, output_name))
+        print(f"  -> {output_name}: {stats['patched_tensors']} tensors patched, "
+              f"{stats['skipped_lora_modules']} LoRA modules skipped, "
+              f"{stats['grown_fp8_scales']} fp8 scales grown, {time.time() - start:.1f} s")
+        entries.append({
+            "merged": output_name,
+            "base": merge["unet_name"],
+            "base_bytes": os.path.getsize(base_path),
+            "lora": merge["lora_name"],
+            "lora_sha256": file_sha256(lora_path),
+            "strength": merge["strength"],
+            "merged_sha256": file_sha256(os.path.join(output_dir, output_name)),
+            **stats,
+        })
+
+    manifest = {"workflow": os.path.basename(workflow_path), "models": entries}
+    with open(os.path.join(output_dir, MANIFEST_NAME), "w") as f:
+        json.dump(manifest, f, indent=2)
+    if workflow_out:
+        with open(workflow_out, "w", encoding="utf-8") as f:
+            json.dump(merged_workflow(workflow, suffix), f, indent=2, ensure_ascii=False)
+            f.write("\n")
+        print(f"Merged workflow: {workflow_out}")
+    return manifest
+
+
+def main():
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workflow", default=os.path.join(root, "workflows", "wan22_14B_i2v_lightning.json"))
+    parser.add_argument("--models-dir", default="/ComfyUI/models")
+    parser.add_argument("--output-dir", help="Merged UNet directory (default: <models-dir>/diffusion_models)")
+    parser.add_argument("--workflow-out", help="Write the merged workflow variant here")
+    parser.add_argument("--suffix", default=MERGED_SUFFIX)
+    args = parser.parse_args()
+
+    try:
+        merge_workflow_loras(args.workflow, args.models_dir, args.output_dir, args.workflow_out, args.suffix)
+    except (OSError, ValueError) as e:
+        print(f"ERROR: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Running the worker's blocking code from RunPod's event loop.
+
+RunPod 1.7 runs every job as a task on one asyncio event loop and steps
+async generator handlers there. The ComfyUI client, file I/O and ffmpeg
+all block, so the handler hands them to worker threads through these
+helpers; the loop stays free to stream other jobs' events and to run the
+dispatch gate while a job waits on ComfyUI.
+"""
+
+import asyncio
+import threading
+from typing import Any, Callable, Generator, Tuple
+
+from src.profiling import call_profiled
+
+
+async def run_blocking(fn: Callable[..., Any], *args, **kwargs) -> Any:
+    """Run a blocking call on a worker thread (under the job's profiler, if any)."""
+    return await asyncio.to_thread(call_profiled, fn, *args, **kwargs)
+
+
+class ThreadedGenerator:
+    """
+    Async iterator over a blocking generator, stepped on worker threads.
+
+    Items are the generator's yields; after iteration, ``value`` holds its
+    return value (what ``yield from`` would have evaluated to).
+    """
+
+    def __init__(self, generator: Generator):
+        self.generator = generator
+        self.value = None
+        self._lock = threading.Lock()
+
+    def __aiter__(self) -> "ThreadedGenerator":
+        return self
+
+    async def __anext__(self) -> Any:
+        done, item = await run_blocking(self._step)
+        if done:
+            raise StopAsyncIteration
+        return item
+
+    def close(self) -> None:
+        """
+        Close the generator, running its finally blocks, without waiting.
+
+        For consumers that stop early (e.g. a cancelled job): the close runs
+        on a worker thread once any step still in flight has returned.
+        """
+        asyncio.get_running_loop().run_in_executor(None, self._close)
+
+    def _step(self) -> Tuple[bool, Any]:
+        with self._lock:
+            try:
+                return False, next(self.generator)
+            except StopIteration as stop:
+                self.value = stop.value
+                return True, None
+
+    def _close(self) -> None:
+        with self._lock:
+            self.generator.close()
@@ -0,0 +1,275 @@
+"""
+Cross-job micro-batching for ComfyUI workflow execution.
+
+Jobs with the same shape (width, height, frames, fps, cfg, steps) that
+arrive within a short window are merged into one ComfyUI prompt. Model
+loader nodes are shared by every item; each job keeps its own
+encode -> sample -> decode -> save chain, and outputs are split back to
+the originating jobs by SaveVideo node ID.
+
+Jobs wait for their batch on RunPod's event loop. A closed batch goes
+through the dispatch gate like any other job, at the most urgent
+priority among its items, and its ComfyUI calls run on a worker thread.
+The window and dispatch run in their own task, so a cancelled job only
+leaves its batch: the remaining jobs still run.
+"""
+
+import asyncio
+import contextlib
+import copy
+from typing import Dict, Any, List, Optional, Tuple
+
+from src.aio import run_blocking
+from src.comfy_runner import ComfyUIRunner
+from src.dispatch import PRIORITIES, DispatchGate
+from src.utils import cleanup_files
+
+
+# Nodes that do not depend on per-job inputs and can be shared by all items:
+# VAE (143), UNets (144/145), text encoder (146), LoRAs (148/149) and
+# ModelSamplingSD3 (147/150).
+SHARED_NODE_IDS = ("143", "144", "145", "146", "147", "148", "149", "150")
+
+# SaveVideo node in the base workflow
+OUTPUT_NODE_ID = "108"
+
+
+def batch_key(params: Dict[str, Any]) -> Tuple:
+    """
+    Compute the compatibility key for a job.
+
+    Jobs with equal keys produce identically shaped latents and sampler
+    settings, so they can share one prompt.
+
+    Args:
+        params: Validated job parameters
+
+    Returns:
+        Hashable batch key
+    """
+    return (
+        params['width'],
+        params['height'],
+        params['frames'],
+        params['fps'],
+        params['cfg'],
+        params['steps']
+    )
+
+
+def merge_workflows(
+    workflows: List[Dict[str, Any]],
+    shared_node_ids: Tuple[str, ...] = SHARED_NODE_IDS
+) -> Tuple[Dict[str, Any], List[str]]:
+    """
+    Merge per-job workflows into a single ComfyUI prompt graph.
+
+    Shared nodes are taken from the first workflow. Every other node is
+    copied once per job with its ID prefixed by ``b<index>_`` and its links
+    rewritten to point at the same job's copies.
+
+    Args:
+        workflows: Parameter-injected workflows (API format), one per job
+        shared_node_ids: Node IDs shared by all jobs
+
+    Returns:
+        Tuple of (merged workflow, per-job SaveVideo node IDs)
+    """
+    merged: Dict[str, Any] = {}
+    output_node_ids = []
+
+    for index, workflow in enumerate(workflows):
+        prefix = f"b{index}_"
+
+        for node_id, node in workflow.items():
+            if node_id in shared_node_ids:
+                merged.setdefault(node_id, copy.deepcopy(node))
+                continue
+
+            node = copy.deepcopy(node)
+            for name, value in node['inputs'].items():
+                # Links are [source_node_id, output_index]
+                if isinstance(value, list) and len(value) == 2 and isinstance(value[0], str):
+                    if value[0] not in shared_node_ids:
+                        node['inputs'][name] = [prefix + value[0], value[1]]
+            merged[prefix + node_id] = node
+
+        output_node_ids.append(prefix + OUTPUT_NODE_ID)
+
+    return merged, output_node_ids
+
+
+class _BatchItem:
+    """One job waiting in a batch group."""
+
+    def __init__(self, params: Dict[str, Any], priority: str, cost_seconds: float, started: Optional[asyncio.Event]):
+        self.params = params
+        self.priority = priority
+        self.cost_seconds = cost_seconds
+        self.started = started
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+
+
+class _BatchGroup:
+    """Jobs collected under one batch key during a window."""
+
+    def __init__(self, features: Dict[str, Any]):
+        self.features = features
+        self.items: List[_BatchItem] = []
+        self.full = asyncio.Event()
+
+
+class BatchScheduler:
+    """Holds compatible jobs for a short window and runs them as one prompt."""
+
+    def __init__(
+        self,
+        runner: ComfyUIRunner,
+        window_seconds: float = 0.25,
+        max_batch_size: int = 4,
+        timeout: int = 600,
+        gate: Optional[DispatchGate] = None
+    ):
+        """
+        Initialize batch scheduler.
+
+        Args:
+            runner: ComfyUI runner used to execute merged prompts
+            window_seconds: How long the first job of a group waits for others
+            max_batch_size: Maximum number of jobs merged into one prompt
+            timeout: Per-job execution timeout in seconds (scaled by batch size)
+            gate: Dispatch gate every batch must hold while it runs (None runs ungated)
+        """
+        self.runner = runner
+        self.window_seconds = window_seconds
+        self.max_batch_size = max_batch_size
+        self.timeout = timeout
+        self.gate = gate
+        self._groups: Dict[Tuple, _BatchGroup] = {}
+        self._dispatches = set()  # strong references to running dispatch tasks
+
+    async def submit(
+        self,
+        features: Optional[Dict[str, Any]] = None,
+        priority: str = "normal",
+        cost_seconds: float = 0.0,
+        started: Optional[asyncio.Event] = None,
+        **params
+    ) -> str:
+        """
+        Run a job, possibly merged with other compatible jobs.
+
+        Accepts the same keyword arguments as ``ComfyUIRunner.run_workflow``
+        and returns once this job's output is available. The first job of a
+        group starts a task that waits out the window, then runs the closed
+        group through the gate with the group's most urgent priority and
+        summed cost. Cancelling a job drops it from a batch that has not
+        started yet; the other jobs of its batch still run.
+
+        Args:
+            features: Cache features of the job (see dispatch.cache_features);
+                the first job's features stand for the whole batch
+            priority: Priority class of the job
+            cost_seconds: Predicted GPU seconds of the job
+            started: Event set once the job's batch holds the gate and runs
+
+        Returns:
+            Path to generated video file
+
+        Raises:
+            ComfyUIError: If execution fails
+        """
+        item = _BatchItem(params, priority, cost_seconds, started)
+        key = batch_key(params)
+
+        group = self._groups.get(key)
+        is_leader = group is None
+        if is_leader:
+            group = _BatchGroup(features or {})
+            self._groups[key] = group
+        group.items.append(item)
+        if len(group.items) >= self.max_batch_size:
+            # Close the group so later arrivals start a new one
+            self._groups.pop(key, None)
+            group.full.set()
+
+        if is_leader:
+            # Not tied to the leader's job, so cancelling it leaves the rest of the batch running
+            task = asyncio.create_task(self._close_and_dispatch(key, group))
+            self._dispatches.add(task)
+            task.add_done_callback(self._dispatches.discard)
+
+        # A cancelled job cancels its future, which removes it from the batch
+        return await item.future
+
+    async def _close_and_dispatch(self, key: Tuple, group: _BatchGroup) -> None:
+        """Wait out a group's window, close it and dispatch it."""
+        try:
+            await asyncio.wait_for(group.full.wait(), self.window_seconds)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            if self._groups.get(key) is group:
+                del self._groups[key]
+        await self._dispatch(group)
+
+    async def _dispatch(self, group: _BatchGroup) -> None:
+        """Run a closed group under the gate and resolve each job's future."""
+        items = [item for item in group.items if not item.future.done()]
+        if not items:
+            return
+        slot = contextlib.nullcontext()
+        if self.gate is not None:
+            slot = self.gate.slot(
+                group.features,
+                priority=min((item.priority for item in items), key=PRIORITIES.index),
+                cost_seconds=sum(item.cost_seconds for item in items)
+            )
+        try:
+            async with slot:
+                # Jobs cancelled while the batch waited for the gate are left out
+                items = [item for item in items if not item.future.done()]
+                if not items:
+                    return
+                for item in items:
+                    if item.started is not None:
+                        item.started.set()
+                paths = await run_blocking(self._run_batch, [item.params for item in items])
+        except Exception as e:
+            for item in items:
+                if not item.future.done():
+                    item.future.set_exception(e)
+            return
+        for item, path in zip(items, paths):
+            if item.future.done():
+                # Cancelled while the batch ran: nobody will deliver this output
+                cleanup_files(path)
+            else:
+                item.future.set_result(path)
+
+    def _run_batch(self, items: List[Dict[str, Any]]) -> List[str]:
+        """Execute a closed group (blocking) and return each job's output path."""
+        if len(items) == 1:
+            return [self.runner.run_workflow(**items[0])]
+
+        print(f"Running batch of {len(items)} jobs in one prompt")
+        base_workflow = self.runner.load_workflow()
+        workflows = []
+        for params in items:
+            uploaded_filename = self.runner.upload_image(params['input_image_path'])
+            workflows.append(self.runner.inject_parameters(
+                workflow=base_workflow,
+                **dict(params, input_image_path=uploaded_filename)
+            ))
+
+        merged, output_node_ids = merge_workflows(workflows)
+        prompt_id = self.runner.queue_prompt(merged)
+        print(f"Queued batched prompt: {prompt_id}")
+
+        try:
+            history = self.runner.wait_for_completion(prompt_id, timeout=self.timeout * len(items))
+        except Exception:
+            # A timed-out prompt would keep the GPU busy after its jobs failed
+            self.runner.cancel_prompts([prompt_id])
+            raise
+        return [self.runner.get_output_path(history, node_id=node_id) for node_id in output_node_ids]
@@ -2,14 +2,20 @@
 ComfyUI workflow runner for Wan2.2 I2V Lightning.
 """
 
+import base64
+import hashlib
 import json
 import os
+import struct
 import time
 import uuid
 import urllib.request
 import urllib.parse
 import shutil
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, List, Iterator, Set, Tuple
+
+from src.graph_rewrites import apply_rewrites, use_step_cache
+from src.metrics import CACHE_REQUESTS, COMFYUI_PROMPT_SECONDS, STEP_CACHE_STEPS
 
 
 class ComfyUIError(Exception):
@@ -17,13 +23,226 @@ class ComfyUIError(Exception):
     pass
 
 
+# Human-readable stage names for workflow nodes, used in progress events
+STAGE_NAMES = {
+    "137": "load_image",
+    "93": "text_encode",
+    "89": "text_encode",
+    "98": "image_encode",
+    "86": "sampling_high_noise",
+    "85": "sampling_low_noise",
+    "87": "vae_decode",
+    "94": "create_video",
+    "108": "save_video",
+}
+
+# How input images and output videos move between the worker and ComfyUI:
+# "local" shares ComfyUI's input/output directories, "http" uses /upload/image and /view
+TRANSPORTS = ("local", "http")
+
+# Binary WebSocket event type and image formats for latent previews
+PREVIEW_IMAGE_EVENT = 1
+PREVIEW_FORMATS = {1: "jpeg", 2: "png"}
+
+
+def parse_event(message: Any, prompt_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Convert a ComfyUI WebSocket message into a worker progress event.
+
+    Args:
+        message: Text (JSON) or binary WebSocket payload
+        prompt_id: Prompt being tracked; messages for other prompts are ignored
+
+    Returns:
+        Event dict, or None if the message is not relevant. Event types:
+        "executing", "progress", "cached", "preview", "done" and "error".
+    """
+    if isinstance(message, bytes):
+        if len(message) < 8:
+            return None
+        event_type, image_format = struct.unpack(">II", message[:8])
+        if event_type != PREVIEW_IMAGE_EVENT:
+            return None
+        return {
+            "type": "preview",
+            "format": PREVIEW_FORMATS.get(image_format, "jpeg"),
+            "image_base64": base64.b64encode(message[8:]).decode('utf-8')
+        }
+
+    try:
+        payload = json.loads(message)
+    except (TypeError, ValueError):
+        return None
+
+    msg_type = payload.get('type')
+    data = payload.get('data') or {}
+    if data.get('prompt_id') != prompt_id:
+        return None
+
+    if msg_type == 'executing':
+        node = data.get('node')
+        if node is None:
+            return {"type": "done"}
+        return {"type": "executing", "node": node, "stage": STAGE_NAMES.get(node, node)}
+
+    if msg_type == 'progress':
+        node = data.get('node')
+        return {
+            "type": "progress",
+            "node": node,
+            "stage": STAGE_NAMES.get(node, node),
+            "step": data.get('value'),
+            "total": data.get('max')
+        }
+
+    if msg_type == 'execution_cached':
+        return {"type": "cached", "nodes": data.get('nodes', [])}
+
+    if msg_type == 'execution_success':
+        return {"type": "done"}
+
+    if msg_type in ('execution_error', 'execution_interrupted'):
+        return {
+            "type": "error",
+            "node": data.get('node_id'),
+            "message": data.get('exception_message', msg_type)
+        }
+
+    return None
+
+
+def file_sha256(path: str) -> str:
+    """Compute the SHA-256 hex digest of a file."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def cached_node_ids(history: Dict[str, Any]) -> Set[str]:
+    """IDs of the nodes a finished prompt took from ComfyUI's node cache."""
+    cached = set()
+    for message in history.get('status', {}).get('messages', []):
+        if isinstance(message, (list, tuple)) and len(message) == 2 and message[0] == 'execution_cached':
+            cached.update(str(node) for node in message[1].get('nodes', []))
+    return cached
+
+
+def count_cached_nodes(history: Dict[str, Any]) -> Tuple[int, int]:
+    """
+    Count nodes served from ComfyUI's node cache for a finished prompt.
+
+    Args:
+        history: Execution history of the prompt
+
+    Returns:
+        (cached nodes, total nodes in the prompt)
+    """
+    cached = cached_node_ids(history)
+
+    prompt = history.get('prompt') or []
+    total = len(prompt[2]) if len(prompt) > 2 and isinstance(prompt[2], dict) else len(cached)
+    return len(cached), max(total, len(cached))
+
+
+def encode_multipart(fields: Dict[str, str], files: Dict[str, Tuple[str, bytes, str]]) -> Tuple[bytes, str]:
+    """
+    Encode a multipart/form-data request body.
+
+    Args:
+        fields: Plain form fields
+        files: Field name -> (filename, content, content type)
+
+    Returns:
+        Tuple of (body, Content-Type header value)
+    """
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode('utf-8')
+        )
+    for name, (filename, content, content_type) in files.items():
+        header = (
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+            f'Content-Type: {content_type}\r\n\r\n'
+        )
+        parts.append(header.encode('utf-8') + content + b'\r\n')
+    parts.append(f'--{boundary}--\r\n'.encode('utf-8'))
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+def tensor_cache_lookups(history: Dict[str, Any]) -> List[Dict[str, str]]:
+    """
+    Text-conditioning and start-latent cache lookups made by a finished prompt.
+
+    The cached nodes report each lookup as a "tensor_cache" UI output. Nodes
+    ComfyUI served from its node cache repeat their earlier output without
+    a new lookup, so they are skipped.
+    """
+    cached = cached_node_ids(history)
+    lookups = []
+    for node_id, node_output in history.get('outputs', {}).items():
+        if isinstance(node_output, dict) and node_id not in cached:
+            lookups.extend(node_output.get('tensor_cache', []))
+    return lookups
+
+
+def step_cache_entries(history: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Per-expert WanStepCacheStats reports in a finished prompt's outputs (any node ID)."""
+    entries = []
+    for node_output in history.get('outputs', {}).values():
+        if isinstance(node_output, dict):
+            entries.extend(node_output.get('step_cache', []))
+    return entries
+
+
+def summarize_step_cache(entries: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """
+    Combine step-cache reports of a job's prompts into job-level statistics.
+
+    Args:
+        entries: Reports from step_cache_entries
+
+    Returns:
+        Dict with threshold, steps, skipped, skip_rate and per-expert
+        counts, or None if the job ran without the step cache
+    """
+    if not entries:
+        return None
+    by_model: Dict[str, Dict[str, int]] = {}
+    for entry in entries:
+        counts = by_model.setdefault(entry['model'], {"steps": 0, "skipped": 0})
+        counts['steps'] += entry['steps']
+        counts['skipped'] += entry['skipped']
+    steps = sum(counts['steps'] for counts in by_model.values())
+    skipped = sum(counts['skipped'] for counts in by_model.values())
+    return {
+        "threshold": entries[0]['threshold'],
+        "steps": steps,
+        "skipped": skipped,
+        "skip_rate": round(skipped / steps, 4) if steps else 0.0,
+        "by_model": by_model,
+    }
+
+
 class ComfyUIRunner:
     """Manages ComfyUI workflow execution via API."""
 
     def __init__(
         self,
         server_address: str = "127.0.0.1:8188",
-        workflow_path: str = "/app/workflows/wan22_14B_i2v_lightning.json"
+        workflow_path: str = "/app/workflows/wan22_14B_i2v_lightning.json",
+        input_dir: str = "/ComfyUI/input",
+        output_dir: str = "/ComfyUI/output",
+        poll_interval: float = 2.0,
+        rewrites: Optional[List[str]] = None,
+        supervisor=None,
+        transport: str = "local",
+        download_dir: str = "/tmp",
+        chunk_size: int = 1024 * 1024,
+        front: bool = False
     ):
         """
         Initialize ComfyUI runner.
@@ -31,18 +250,51 @@ class ComfyUIRunner:
         Args:
             server_address: ComfyUI server address (host:port)
             workflow_path: Path to workflow JSON file
+            input_dir: ComfyUI input directory
+            output_dir: ComfyUI output directory
+            poll_interval: Seconds between history polls
+            rewrites: Graph rewrite names applied on load (see graph_rewrites)
+            supervisor: ComfyUISupervisor owning the ComfyUI process; when set,
+                prompts wait for ComfyUI to be ready and fail as soon as it crashes
+            transport: "local" to use input_dir/output_dir directly (same filesystem
+                as ComfyUI), "http" to upload via /upload/image and fetch via /view
+            download_dir: Where outputs fetched over HTTP are written
+            chunk_size: Read size when streaming outputs over HTTP
+            front: Queue prompts at the front of ComfyUI's queue (urgent jobs)
+
+        Raises:
+            ValueError: If transport is unknown
         """
+        if transport not in TRANSPORTS:
+            raise ValueError(f"Unknown ComfyUI transport '{transport}', expected one of: {', '.join(TRANSPORTS)}")
         self.server_address = server_address
         self.workflow_path = workflow_path
+        self.input_dir = input_dir
+        self.output_dir = output_dir
+        self.poll_interval = poll_interval
+        self.rewrites = rewrites or []
         self.client_id = str(uuid.uuid4())
+        self.supervisor = supervisor
+        self.transport = transport
+        self.download_dir = download_dir
+        self.chunk_size = chunk_size
+        self.front = front
+        self._queued_at: Dict[str, float] = {}
+        self._generations: Dict[str, int] = {}
+        self._step_cache: Dict[str, List[Dict[str, Any]]] = {}
 
     def load_workflow(self) -> Dict[str, Any]:
-        """Load workflow JSON from disk."""
+        """Load workflow JSON from disk and apply configured graph rewrites."""
         if not os.path.exists(self.workflow_path):
             raise ComfyUIError(f"Workflow file not found: {self.workflow_path}")
 
         with open(self.workflow_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
+            workflow = json.load(f)
+
+        try:
+            return apply_rewrites(workflow, self.rewrites)
+        except (KeyError, ValueError) as e:
+            raise ComfyUIError(f"Failed to rewrite workflow: {e}")
 
     def inject_parameters(
         self,
@@ -56,7 +308,9 @@ class ComfyUIRunner:
         frames: int,
         fps: int,
         cfg: float,
-        steps: int
+        steps: int,
+        seed: Optional[int] = None,
+        step_cache_threshold: float = 0.0
     ) -> Dict[str, Any]:
         """
         Inject dynamic parameters into workflow (API format).
@@ -73,6 +327,8 @@ class ComfyUIRunner:
             fps: Frames per second
             cfg: CFG scale
             steps: Sampling steps
+            seed: Noise seed (None keeps the workflow default)
+            step_cache_threshold: WanStepCache skip threshold (0 leaves the experts unwrapped)
 
         Returns:
             Modified workflow dict in API format
@@ -98,10 +354,12 @@ class ComfyUIRunner:
             workflow["98"]["inputs"]["height"] = height
             workflow["98"]["inputs"]["length"] = frames
 
-        # Node 86: KSamplerAdvanced (High Noise) - Steps & CFG
+        # Node 86: KSamplerAdvanced (High Noise) - Steps, CFG & noise seed
         if "86" in workflow:
             workflow["86"]["inputs"]["steps"] = steps
             workflow["86"]["inputs"]["cfg"] = cfg
+            if seed is not None:
+                workflow["86"]["inputs"]["noise_seed"] = seed
 
         # Node 85: KSamplerAdvanced (Low Noise) - Steps & CFG
         if "85" in workflow:
@@ -112,10 +370,16 @@ class ComfyUIRunner:
         if "94" in workflow:
             workflow["94"]["inputs"]["fps"] = fps
 
-        # Node 108: SaveVideo - Output filename prefix
+        # Node 108: SaveVideo - Output filename prefix (and FPS when decode/save are fused)
+        output_filename = os.path.splitext(os.path.basename(output_video_path))[0]
         if "108" in workflow:
-            output_filename = os.path.splitext(os.path.basename(output_video_path))[0]
             workflow["108"]["inputs"]["filename_prefix"] = output_filename
+            if "fps" in workflow["108"]["inputs"]:
+                workflow["108"]["inputs"]["fps"] = fps
+
+        # Nodes 151-153: Step-output cache on both experts, statistics labelled by output name
+        if step_cache_threshold > 0:
+            workflow = use_step_cache(workflow, step_cache_threshold, label=output_filename)
 
         return workflow
 
@@ -132,10 +396,16 @@ class ComfyUIRunner:
         Raises:
             ComfyUIError: If queueing fails
         """
+        if self.supervisor is not None:
+            self.supervisor.wait_ready(timeout=self.supervisor.startup_timeout)
+            generation = self.supervisor.generation
+
         payload = {
             "prompt": workflow,
             "client_id": self.client_id
         }
+        if self.front:
+            payload["front"] = True
 
         data = json.dumps(payload).encode('utf-8')
         req = urllib.request.Request(
@@ -147,10 +417,108 @@ class ComfyUIRunner:
         try:
             response = urllib.request.urlopen(req)
             result = json.loads(response.read())
-            return result['prompt_id']
+            prompt_id = result['prompt_id']
         except Exception as e:
             raise ComfyUIError(f"Failed to queue prompt: {e}")
 
+        self._queued_at[prompt_id] = time.perf_counter()
+        if self.supervisor is not None:
+            self._generations[prompt_id] = generation
+        return prompt_id
+
+    def check_health(self, prompt_id: str) -> None:
+        """
+        Fail fast if ComfyUI crashed after the prompt was queued.
+
+        Raises:
+            ComfyUIError: If the supervisor saw ComfyUI die since queueing
+        """
+        if self.supervisor is not None and prompt_id in self._generations:
+            self.supervisor.check(self._generations[prompt_id])
+
+    def get_queue_depth(self) -> int:
+        """
+        Number of prompts running or pending in ComfyUI.
+
+        Raises:
+            ComfyUIError: If the queue cannot be read
+        """
+        try:
+            response = urllib.request.urlopen(f"http://{self.server_address}/queue", timeout=5)
+            queue = json.loads(response.read())
+            return len(queue.get('queue_running', [])) + len(queue.get('queue_pending', []))
+        except Exception as e:
+            raise ComfyUIError(f"Failed to read queue: {e}")
+
+    def cancel_prompts(self, prompt_ids: List[str]) -> None:
+        """
+        Remove a failed or abandoned job's prompts from ComfyUI (best effort).
+
+        Pending prompts are deleted from the queue; if one of them is already
+        running it is interrupted. ComfyUI versions that ignore the prompt_id
+        of /interrupt are only asked to interrupt after /queue shows the
+        prompt running, so another job's prompt is never stopped.
+
+        Args:
+            prompt_ids: Prompts that have not completed
+        """
+        if not prompt_ids:
+            return
+        try:
+            self._post_json("/queue", {"delete": list(prompt_ids)})
+            response = urllib.request.urlopen(f"http://{self.server_address}/queue", timeout=5)
+            running = {entry[1] for entry in json.loads(response.read()).get('queue_running', [])}
+            for prompt_id in running.intersection(prompt_ids):
+                self._post_json("/interrupt", {"prompt_id": prompt_id})
+                print(f"Interrupted prompt: {prompt_id}")
+        except Exception as e:
+            print(f"Warning: Failed to cancel prompts {', '.join(prompt_ids)}: {e}")
+
+    def _post_json(self, path: str, payload: Dict[str, Any]) -> None:
+        """POST a JSON body to a ComfyUI endpoint."""
+        req = urllib.request.Request(
+            f"http://{self.server_address}{path}",
+            data=json.dumps(payload).encode('utf-8'),
+            headers={'Content-Type': 'application/json'}
+        )
+        urllib.request.urlopen(req, timeout=5).close()
+
+    def record_completion(self, prompt_id: str, history: Dict[str, Any]) -> None:
+        """Report prompt latency and node- and tensor-cache reuse of a finished prompt to metrics."""
+        queued_at = self._queued_at.pop(prompt_id, None)
+        if queued_at is not None:
+            COMFYUI_PROMPT_SECONDS.observe(time.perf_counter() - queued_at)
+        cached, total = count_cached_nodes(history)
+        CACHE_REQUESTS.inc(cached, cache="comfyui_node", result="hit")
+        CACHE_REQUESTS.inc(total - cached, cache="comfyui_node", result="miss")
+        for lookup in tensor_cache_lookups(history):
+            CACHE_REQUESTS.inc(cache=lookup['cache'], result=lookup['result'])
+
+        for entry in step_cache_entries(history):
+            STEP_CACHE_STEPS.inc(entry['skipped'], result="skipped")
+            STEP_CACHE_STEPS.inc(entry['steps'] - entry['skipped'], result="computed")
+            self._step_cache.setdefault(entry.get('label', ''), []).append(entry)
+
+    def pop_step_cache_stats(self, output_video_path: str) -> Optional[Dict[str, Any]]:
+        """
+        Collect the step-cache statistics of one job's prompts.
+
+        Prompts are matched by the output filename the job passed to
+        inject_parameters, including variant and segment suffixes.
+
+        Args:
+            output_video_path: Output path (prefix) the job generated with
+
+        Returns:
+            Job-level statistics (see summarize_step_cache), or None
+        """
+        prefix = os.path.splitext(os.path.basename(output_video_path))[0]
+        entries = []
+        for label in list(self._step_cache):
+            if label == prefix or label.startswith(prefix + "_"):
+                entries.extend(self._step_cache.pop(label))
+        return summarize_step_cache(entries)
+
     def get_history(self, prompt_id: str) -> Optional[Dict[str, Any]]:
         """
         Get execution history for a prompt.
@@ -193,6 +561,8 @@ class ComfyUIRunner:
             if history is not None:
                 # Check if execution completed
                 if 'outputs' in history:
+                    self._generations.pop(prompt_id, None)
+                    self.record_completion(prompt_id, history)
                     return history
 
                 # Check for errors
@@ -200,70 +570,125 @@ class ComfyUIRunner:
                     error_msg = history['status'].get('messages', ['Unknown error'])
                     raise ComfyUIError(f"Execution failed: {error_msg}")
 
-            time.sleep(2)
+            self.check_health(prompt_id)
+            time.sleep(self.poll_interval)
 
         raise ComfyUIError(f"Execution timed out after {timeout} seconds")
 
-    def get_output_path(self, history: Dict[str, Any]) -> str:
+    def get_output_ref(self, history: Dict[str, Any], node_id: str = '108') -> Dict[str, str]:
         """
-        Extract output video path from execution history.
+        Find the file a SaveVideo node wrote, as ComfyUI reports it.
 
         Args:
             history: Execution history
+            node_id: ID of the SaveVideo node whose output to return
 
         Returns:
-            Path to generated video
+            Dict with filename, subfolder and type
 
         Raises:
             ComfyUIError: If output not found
         """
-        # Node 108 (SaveVideo) produces the output
         outputs = history.get('outputs', {})
 
-        # Debug: Print what we got
-        print(f"DEBUG: History outputs keys: {list(outputs.keys())}")
-        if '108' in outputs:
-            print(f"DEBUG: Node 108 output: {json.dumps(outputs['108'], indent=2)}")
-
-        # Look for SaveVideo output (Node 108)
-        if '108' in outputs:
-            node_output = outputs['108']
-
-            # SaveVideo might use 'gifs', 'videos', or 'images' key
-            for key in ['videos', 'gifs', 'images']:
-                if key in node_output and len(node_output[key]) > 0:
-                    video_info = node_output[key][0]
-                    filename = video_info['filename']
-                    subfolder = video_info.get('subfolder', '')
-
-                    print(f"DEBUG: Found video in '{key}' - filename: {filename}, subfolder: {subfolder}")
-
-                    # Construct full path - ComfyUI output directory
-                    comfyui_output_dir = "/ComfyUI/output"
-                    if subfolder:
-                        output_path = os.path.join(comfyui_output_dir, subfolder, filename)
-                    else:
-                        output_path = os.path.join(comfyui_output_dir, filename)
-
-                    print(f"DEBUG: Checking path: {output_path}")
-                    if os.path.exists(output_path):
-                        print(f"DEBUG: Found video at: {output_path}")
-                        return output_path
-                    else:
-                        print(f"DEBUG: Path does not exist: {output_path}")
-                        # List what's actually in the output directory
-                        if os.path.exists(comfyui_output_dir):
-                            print(f"DEBUG: Contents of {comfyui_output_dir}:")
-                            for root, dirs, files in os.walk(comfyui_output_dir):
-                                for f in files:
-                                    print(f"  - {os.path.join(root, f)}")
+        # SaveVideo might use 'gifs', 'videos', or 'images' key
+        node_output = outputs.get(node_id, {})
+        for key in ['videos', 'gifs', 'images']:
+            if key in node_output and len(node_output[key]) > 0:
+                video_info = node_output[key][0]
+                return {
+                    'filename': video_info['filename'],
+                    'subfolder': video_info.get('subfolder', ''),
+                    'type': video_info.get('type', 'output')
+                }
 
         raise ComfyUIError(f"Output video not found in execution history. Outputs: {json.dumps(outputs, indent=2)}")
 
+    def view_url(self, ref: Dict[str, str]) -> str:
+        """URL of a ComfyUI file on the /view endpoint."""
+        return f"http://{self.server_address}/view?{urllib.parse.urlencode(ref)}"
+
+    def iter_output(self, ref: Dict[str, str]) -> Iterator[bytes]:
+        """
+        Stream a ComfyUI file from /view in chunk_size pieces.
+
+        Args:
+            ref: File reference from get_output_ref
+
+        Yields:
+            Chunks of file content
+
+        Raises:
+            ComfyUIError: If the download fails
+        """
+        try:
+            with urllib.request.urlopen(self.view_url(ref), timeout=60) as response:
+                for chunk in iter(lambda: response.read(self.chunk_size), b''):
+                    yield chunk
+        except Exception as e:
+            raise ComfyUIError(f"Failed to download {ref['filename']}: {e}")
+
+    def download_output(self, ref: Dict[str, str]) -> str:
+        """
+        Stream a ComfyUI file from /view to download_dir.
+
+        Args:
+            ref: File reference from get_output_ref
+
+        Returns:
+            Local path of the downloaded file
+
+        Raises:
+            ComfyUIError: If the download fails
+        """
+        os.makedirs(self.download_dir, exist_ok=True)
+        output_path = os.path.join(self.download_dir, ref['filename'])
+        tmp_path = f"{output_path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                for chunk in self.iter_output(ref):
+                    f.write(chunk)
+            os.replace(tmp_path, output_path)
+        except OSError as e:
+            raise ComfyUIError(f"Failed to write {output_path}: {e}")
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return output_path
+
+    def get_output_path(self, history: Dict[str, Any], node_id: str = '108', download: bool = True) -> str:
+        """
+        Extract output video path from execution history.
+
+        Args:
+            history: Execution history
+            node_id: ID of the SaveVideo node whose output to return
+            download: With the http transport, fetch the file to download_dir;
+                if False, return its /view URL for the caller to stream
+
+        Returns:
+            Path to generated video (or its /view URL)
+
+        Raises:
+            ComfyUIError: If output not found
+        """
+        ref = self.get_output_ref(history, node_id)
+        if self.transport == "http":
+            return self.download_output(ref) if download else self.view_url(ref)
+
+        output_path = os.path.join(self.output_dir, ref['subfolder'], ref['filename'])
+        if not os.path.exists(output_path):
+            raise ComfyUIError(f"Output video not found at {output_path}")
+        return output_path
+
     def upload_image(self, image_path: str) -> str:
         """
         Upload image to ComfyUI input directory.
 
+        The file is named after its content hash, so the same image always
+        maps to the same LoadImage input and ComfyUI's node cache can reuse
+        LoadImage and everything downstream of it across jobs.
+
         Args:
             image_path: Path to local image file
 
@@ -273,24 +698,86 @@ class ComfyUIRunner:
         Raises:
             ComfyUIError: If upload fails
         """
-        # ComfyUI expects images in /ComfyUI/input/
-        comfyui_input_dir = "/ComfyUI/input"
+        if self.transport == "http":
+            return self._upload_image_http(image_path)
+
+        # ComfyUI expects images in its input directory
+        comfyui_input_dir = self.input_dir
 
         # Create input directory if it doesn't exist
         os.makedirs(comfyui_input_dir, exist_ok=True)
 
-        # Get just the filename
-        filename = os.path.basename(image_path)
-        dest_path = os.path.join(comfyui_input_dir, filename)
-
-        # Copy image to ComfyUI input directory
+        # Copy image to ComfyUI input directory under its content hash
         try:
-            shutil.copy2(image_path, dest_path)
+            filename = file_sha256(image_path)[:20] + os.path.splitext(image_path)[1]
+            dest_path = os.path.join(comfyui_input_dir, filename)
+
+            if os.path.exists(dest_path):
+                CACHE_REQUESTS.inc(cache="input_image", result="hit")
+            else:
+                CACHE_REQUESTS.inc(cache="input_image", result="miss")
+                tmp_path = f"{dest_path}.{uuid.uuid4().hex}.tmp"
+                shutil.copy2(image_path, tmp_path)
+                os.replace(tmp_path, dest_path)
             print(f"Uploaded image to ComfyUI: {dest_path}")
             return filename
         except Exception as e:
             raise ComfyUIError(f"Failed to upload image: {e}")
 
+    def _upload_image_http(self, image_path: str) -> str:
+        """Upload through /upload/image unless ComfyUI already has the content-hash filename."""
+        filename = file_sha256(image_path)[:20] + os.path.splitext(image_path)[1]
+        try:
+            head = urllib.request.Request(self.view_url({'filename': filename, 'subfolder': '', 'type': 'input'}), method='HEAD')
+            urllib.request.urlopen(head, timeout=10).close()
+            CACHE_REQUESTS.inc(cache="input_image", result="hit")
+            return filename
+        except Exception:
+            CACHE_REQUESTS.inc(cache="input_image", result="miss")
+
+        try:
+            with open(image_path, 'rb') as f:
+                content = f.read()
+            body, content_type = encode_multipart(
+                {'type': 'input', 'overwrite': 'true'},
+                {'image': (filename, content, 'application/octet-stream')}
+            )
+            req = urllib.request.Request(
+                f"http://{self.server_address}/upload/image",
+                data=body,
+                headers={'Content-Type': content_type}
+            )
+            with urllib.request.urlopen(req, timeout=60) as response:
+                result = json.loads(response.read())
+            print(f"Uploaded image to ComfyUI over HTTP: {result['name']}")
+            return result['name']
+        except Exception as e:
+            raise ComfyUIError(f"Failed to upload image: {e}")
+
+    def prepare_workflow(self, input_image_path: str, **params) -> Dict[str, Any]:
+        """
+        Upload the input image and build the parameter-injected workflow.
+
+        Args:
+            input_image_path: Path to local input image
+            **params: Remaining inject_parameters arguments
+
+        Returns:
+            Workflow dict ready to queue
+
+        Raises:
+            ComfyUIError: If upload or workflow loading fails
+        """
+        # Upload image to ComfyUI input directory
+        uploaded_filename = self.upload_image(input_image_path)
+
+        # Load and modify workflow, using just the uploaded filename for the image
+        return self.inject_parameters(
+            workflow=self.load_workflow(),
+            input_image_path=uploaded_filename,
+            **params
+        )
+
     def run_workflow(
         self,
         prompt: str,
@@ -302,7 +789,9 @@ class ComfyUIRunner:
         frames: int = 33,
         fps: int = 16,
         cfg: float = 1.0,
-        steps: int = 4
+        steps: int = 4,
+        seed: Optional[int] = None,
+        step_cache_threshold: float = 0.0
     ) -> str:
         """
         Execute complete workflow and return output video path.
@@ -318,6 +807,8 @@ class ComfyUIRunner:
             fps: Frames per second
             cfg: CFG scale
             steps: Sampling steps
+            seed: Noise seed (None keeps the workflow default)
+            step_cache_threshold: WanStepCache skip threshold (0 disables)
 
         Returns:
             Path to generated video file
@@ -325,25 +816,19 @@ class ComfyUIRunner:
         Raises:
             ComfyUIError: If execution fails
         """
-        # Upload image to ComfyUI input directory
-        uploaded_filename = self.upload_image(input_image_path)
-
-        # Load and modify workflow
-        workflow = self.load_workflow()
-
-        # Update input_image_path to use the uploaded filename
-        workflow = self.inject_parameters(
-            workflow=workflow,
+        workflow = self.prepare_workflow(
             prompt=prompt,
             negative_prompt=negative_prompt,
-            input_image_path=uploaded_filename,  # Use just the filename
+            input_image_path=input_image_path,
             output_video_path=output_video_path,
             width=width,
             height=height,
             frames=frames,
             fps=fps,
             cfg=cfg,
-            steps=steps
+            steps=steps,
+            seed=seed,
+            step_cache_threshold=step_cache_threshold
         )
 
         # Queue prompt
@@ -359,3 +844,253 @@ class ComfyUIRunner:
         print(f"Output video: {output_path}")
 
         return output_path
+
+    def connect_events(self, timeout: float = 5.0):
+        """
+        Open a WebSocket to ComfyUI for this runner's client ID.
+
+        Returns:
+            Connected websocket, or None if WebSockets are unavailable
+        """
+        try:
+            import websocket
+        except ImportError:
+            print("Warning: websocket-client not installed, progress streaming disabled")
+            return None
+
+        try:
+            ws = websocket.WebSocket()
+            ws.connect(f"ws://{self.server_address}/ws?clientId={self.client_id}", timeout=timeout)
+            return ws
+        except Exception as e:
+            print(f"Warning: Failed to connect to ComfyUI WebSocket: {e}")
+            return None
+
+    def iter_progress(
+        self,
+        ws,
+        prompt_id: str,
+        timeout: int = 600,
+        previews: bool = False
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Yield progress events for a prompt until it finishes.
+
+        Progress is best-effort: if the connection drops, iteration stops
+        early and the caller falls back to polling history
+        (wait_for_completion) for the result.
+
+        Args:
+            ws: Connected websocket (see connect_events)
+            prompt_id: Prompt ID
+            timeout: Maximum wait time in seconds
+            previews: Whether to yield latent preview frames
+
+        Yields:
+            Progress event dicts (see parse_event)
+
+        Raises:
+            ComfyUIError: If execution fails or times out
+        """
+        from websocket import WebSocketConnectionClosedException, WebSocketTimeoutException
+
+        start_time = time.time()
+        ws.settimeout(self.poll_interval)
+
+        while time.time() - start_time < timeout:
+            try:
+                message = ws.recv()
+            except WebSocketTimeoutException:
+                # No message within poll interval: the prompt may have finished
+                # before we connected, so fall back to history
+                history = self.get_history(prompt_id)
+                if history is not None and 'outputs' in history:
+                    return
+                self.check_health(prompt_id)
+                continue
+            except (WebSocketConnectionClosedException, OSError) as e:
+                print(f"Warning: ComfyUI WebSocket lost ({e}), polling history instead")
+                return
+
+            event = parse_event(message, prompt_id)
+            if event is None:
+                continue
+            if event['type'] == 'done':
+                return
+            if event['type'] == 'error':
+                raise ComfyUIError(f"Execution failed at node {event['node']}: {event['message']}")
+            if event['type'] == 'preview' and not previews:
+                continue
+            yield event
+
+        raise ComfyUIError(f"Execution timed out after {timeout} seconds")
+
+    def stream_workflow(
+        self,
+        prompt: str,
+        negative_prompt: str,
+        input_image_path: str,
+        output_video_path: str,
+        width: int = 512,
+        height: int = 512,
+        frames: int = 33,
+        fps: int = 16,
+        cfg: float = 1.0,
+        steps: int = 4,
+        seed: Optional[int] = None,
+        step_cache_threshold: float = 0.0,
+        previews: bool = False,
+        download: bool = True
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Execute complete workflow, yielding progress events as it runs.
+
+        Use with ``yield from``; the generator's return value is the output
+        video path. Falls back to plain polling when no WebSocket connection
+        can be made or the connection drops.
+
+        Args:
+            prompt: Positive prompt
+            negative_prompt: Negative prompt
+            input_image_path: Path to input image
+            output_video_path: Desired output path
+            width: Video width
+            height: Video height
+            frames: Number of frames
+            fps: Frames per second
+            cfg: CFG scale
+            steps: Sampling steps
+            seed: Noise seed (None keeps the workflow default)
+            step_cache_threshold: WanStepCache skip threshold (0 disables)
+            previews: Whether to yield latent preview frames
+            download: With the http transport, whether to fetch the output to
+                disk (False returns its /view URL; see get_output_path)
+
+        Yields:
+            Progress event dicts
+
+        Returns:
+            Path to generated video file (or its /view URL)
+
+        Raises:
+            ComfyUIError: If execution fails
+        """
+        workflow = self.prepare_workflow(
+            prompt=prompt,
+            negative_prompt=negative_prompt,
+            input_image_path=input_image_path,
+            output_video_path=output_video_path,
+            width=width,
+            height=height,
+            frames=frames,
+            fps=fps,
+            cfg=cfg,
+            steps=steps,
+            seed=seed,
+            step_cache_threshold=step_cache_threshold
+        )
+
+        # Connect before queueing so no early messages are missed
+        ws = self.connect_events()
+        try:
+            prompt_id = self.queue_prompt(workflow)
+            print(f"Queued prompt: {prompt_id}")
+            yield {"type": "queued", "prompt_id": prompt_id}
+
+            if ws is not None:
+                yield from self.iter_progress(ws, prompt_id, previews=previews)
+        finally:
+            if ws is not None:
+                ws.close()
+
+        history = self.wait_for_completion(prompt_id)
+        print(f"Execution completed: {prompt_id}")
+
+        output_path = self.get_output_path(history, download=download)
+        print(f"Output video: {output_path}")
+        return output_path
+
+    def iter_variants(
+        self,
+        prompts: List[str],
+        seeds: Optional[List[int]],
+        negative_prompt: str,
+        input_image_path: str,
+        output_video_path: str,
+        width: int = 512,
+        height: int = 512,
+        frames: int = 33,
+        fps: int = 16,
+        cfg: float = 1.0,
+        steps: int = 4,
+        step_cache_threshold: float = 0.0
+    ) -> Iterator[Tuple[int, str]]:
+        """
+        Execute one workflow per prompt variant against a single input image.
+
+        The image is uploaded once and every variant is queued up front, so
+        ComfyUI runs them back-to-back and keeps LoadImage, loaders and the
+        negative text encode cached between prompts. Variants with identical
+        prompts are queued adjacently so their text encodes are reused too.
+        Outputs are yielded as each prompt finishes, letting the caller
+        process earlier videos while later ones are still sampling. If a
+        variant fails or the caller stops iterating, the variants still
+        queued are cancelled (see cancel_prompts).
+
+        Args:
+            prompts: Positive prompt per variant
+            seeds: Noise seed per variant (None keeps the workflow default)
+            negative_prompt: Negative prompt shared by all variants
+            input_image_path: Path to input image
+            output_video_path: Output path prefix; variant index is appended
+            width: Video width
+            height: Video height
+            frames: Number of frames
+            fps: Frames per second
+            cfg: CFG scale
+            steps: Sampling steps
+            step_cache_threshold: WanStepCache skip threshold (0 disables)
+
+        Yields:
+            Tuples of (variant index, path to generated video) in completion order
+
+        Raises:
+            ComfyUIError: If execution fails
+        """
+        uploaded_filename = self.upload_image(input_image_path)
+        workflow = self.load_workflow()
+
+        # Stable sort keeps duplicate prompts adjacent in the ComfyUI queue
+        order = sorted(range(len(prompts)), key=lambda i: prompts[i])
+
+        queued = []
+        try:
+            for index in order:
+                variant = self.inject_parameters(
+                    workflow=workflow,
+                    prompt=prompts[index],
+                    negative_prompt=negative_prompt,
+                    input_image_path=uploaded_filename,
+                    output_video_path=f"{output_video_path}_{index}",
+                    width=width,
+                    height=height,
+                    frames=frames,
+                    fps=fps,
+                    cfg=cfg,
+                    steps=steps,
+                    seed=seeds[index] if seeds else None,
+                    step_cache_threshold=step_cache_threshold
+                )
+                prompt_id = self.queue_prompt(variant)
+                print(f"Queued prompt variant {index}: {prompt_id}")
+                queued.append((index, prompt_id))
+
+            while queued:
+                index, prompt_id = queued[0]
+                history = self.wait_for_completion(prompt_id)
+                print(f"Execution completed: {prompt_id}")
+                queued.pop(0)
+                yield index, self.get_output_path(history)
+        finally:
+            # Otherwise the remaining variants keep sampling for a job that has already failed
+            self.cancel_prompts([prompt_id for _, prompt_id in queued])
@@ -0,0 +1,209 @@
+"""
+Load-aware concurrency control for the RunPod worker.
+
+RunPod calls the worker's concurrency_modifier to decide how many jobs it
+may hold at once. Holding more than one lets downloads, validation and
+CPU post-processing of one job overlap another job's GPU time, but every
+extra job held here waits on this GPU instead of running on another worker
+and costs host memory. The controller keeps the predicted GPU backlog of
+in-flight jobs (from the cost model) between a low and a high watermark:
+
+- below the low watermark, with every slot in use and ComfyUI's queue
+  shallow, the GPU may go idle soon, so intake is raised by one;
+- above the high watermark, or when host memory runs short, it is lowered
+  by one.
+
+Between the watermarks the level is held, and changes are spaced by a
+minimum dwell time, so the limit does not oscillate. Memory pressure
+lowers the limit immediately.
+
+RunPod calls the modifier synchronously on its event loop, so ComfyUI's
+queue depth (an HTTP request) is sampled on a background thread
+(start_sampling) and decisions read the last sample.
+"""
+
+import threading
+import time
+from typing import Callable, Dict, Any, NamedTuple, Optional
+
+from src.cost_model import CostModel
+from src.metrics import CONCURRENCY_LIMIT
+
+
+def read_mem_available_mb(meminfo_path: str = "/proc/meminfo") -> Optional[float]:
+    """Host MemAvailable in MB, or None if it cannot be read."""
+    try:
+        with open(meminfo_path, "r") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+class LoadSignals(NamedTuple):
+    """Live inputs to a concurrency decision."""
+
+    queue_depth: Optional[int]       # prompts running or pending in ComfyUI (None if unknown)
+    backlog_seconds: float           # predicted GPU seconds of in-flight jobs
+    free_memory_mb: Optional[float]  # host MemAvailable (None if unknown)
+    in_flight: int                   # jobs currently held
+
+
+class ConcurrencyController:
+    """Chooses the worker's concurrency level from live load signals, with hysteresis."""
+
+    def __init__(
+        self,
+        min_concurrency: int = 1,
+        max_concurrency: int = 1,
+        low_backlog_seconds: float = 60.0,
+        high_backlog_seconds: float = 180.0,
+        hold_seconds: float = 30.0,
+        job_memory_mb: float = 3072.0,
+        min_free_memory_mb: float = 4096.0,
+        cost_model: Optional[CostModel] = None,
+        queue_depth_fn: Optional[Callable[[], int]] = None,
+        memory_fn: Callable[[], Optional[float]] = read_mem_available_mb,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        """
+        Initialize concurrency controller.
+
+        Args:
+            min_concurrency: Lowest level ever returned
+            max_concurrency: Highest level ever returned
+            low_backlog_seconds: Predicted in-flight GPU seconds below which intake may be raised
+            high_backlog_seconds: Predicted in-flight GPU seconds above which intake is lowered
+            hold_seconds: Minimum time between two level changes
+            job_memory_mb: Host memory one more job is expected to need
+            min_free_memory_mb: Free host memory below which intake is lowered at once
+            cost_model: Predicts job GPU seconds (shared with other components)
+            queue_depth_fn: Returns ComfyUI queue depth; may raise when unavailable.
+                Only called by sample_queue_depth, never from a decision
+            memory_fn: Returns free host memory in MB, or None
+            clock: Monotonic time source
+        """
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max(min_concurrency, max_concurrency)
+        self.low_backlog_seconds = low_backlog_seconds
+        self.high_backlog_seconds = max(low_backlog_seconds, high_backlog_seconds)
+        self.hold_seconds = hold_seconds
+        self.job_memory_mb = job_memory_mb
+        self.min_free_memory_mb = min_free_memory_mb
+        self.cost_model = cost_model or CostModel()
+        self.queue_depth_fn = queue_depth_fn
+        self.memory_fn = memory_fn
+        self.clock = clock
+
+        self.level = min_concurrency
+        CONCURRENCY_LIMIT.set(self.level)
+        self._last_change = None
+        self._in_flight: Dict[str, float] = {}
+        self._queue_depth: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def job_started(self, job_id: str, params: Dict[str, Any]) -> None:
+        """Register an in-flight job with its predicted GPU seconds."""
+        with self._lock:
+            self._in_flight[job_id] = self.cost_model.predict(params)
+
+    def job_finished(self, job_id: str) -> None:
+        """Forget an in-flight job (no-op if it was never registered)."""
+        with self._lock:
+            self._in_flight.pop(job_id, None)
+
+    def observe_gpu_time(self, params: Dict[str, Any], gpu_seconds: float) -> None:
+        """Recalibrate the cost model from a job's measured GPU time."""
+        self.cost_model.observe(params, gpu_seconds)
+
+    def sample_queue_depth(self) -> Optional[int]:
+        """Read ComfyUI's queue depth (blocking) and cache it for decisions; None if unavailable."""
+        queue_depth = None
+        if self.queue_depth_fn is not None:
+            try:
+                queue_depth = self.queue_depth_fn()
+            except Exception:
+                queue_depth = None
+        with self._lock:
+            self._queue_depth = queue_depth
+        return queue_depth
+
+    def start_sampling(self, interval: float = 5.0) -> threading.Thread:
+        """Sample the queue depth every interval seconds from a daemon thread."""
+        def loop():
+            while True:
+                self.sample_queue_depth()
+                time.sleep(interval)
+
+        thread = threading.Thread(target=loop, daemon=True, name="concurrency-sampler")
+        thread.start()
+        return thread
+
+    def signals(self) -> LoadSignals:
+        """Current load signals, with the last sampled queue depth (never blocks on ComfyUI)."""
+        with self._lock:
+            queue_depth = self._queue_depth
+            backlog = sum(self._in_flight.values())
+            in_flight = len(self._in_flight)
+
+        return LoadSignals(
+            queue_depth=queue_depth,
+            backlog_seconds=backlog,
+            free_memory_mb=self.memory_fn(),
+            in_flight=in_flight
+        )
+
+    def desired_change(self, signals: LoadSignals) -> int:
+        """
+        Direction the level should move given the signals: -1, 0 or +1.
+
+        Memory pressure or a backlog above the high watermark lowers intake.
+        Intake is raised only when the backlog is below the low watermark,
+        the ComfyUI queue is not already holding a pending prompt, the worker
+        is using its current level, and memory has room for one more job.
+        """
+        memory = signals.free_memory_mb
+        if memory is not None and memory < self.min_free_memory_mb:
+            return -1
+        if signals.backlog_seconds > self.high_backlog_seconds:
+            return -1
+
+        if signals.backlog_seconds >= self.low_backlog_seconds:
+            return 0
+        if signals.queue_depth is None or signals.queue_depth > 1:
+            return 0
+        if signals.in_flight < self.level:
+            return 0
+        if memory is not None and memory - self.job_memory_mb < self.min_free_memory_mb:
+            return 0
+        return 1
+
+    def update(self, signals: LoadSignals) -> int:
+        """
+        Apply one control step and return the new level.
+
+        Changes are spaced by at least hold_seconds, except that memory
+        pressure lowers the level immediately.
+        """
+        change = self.desired_change(signals)
+        now = self.clock()
+        target = min(self.max_concurrency, max(self.min_concurrency, self.level + change))
+        if target == self.level:
+            return self.level
+
+        memory_pressure = signals.free_memory_mb is not None and signals.free_memory_mb < self.min_free_memory_mb
+        dwelling = self._last_change is not None and now - self._last_change < self.hold_seconds
+        if dwelling and not (change < 0 and memory_pressure):
+            return self.level
+
+        print(f"Concurrency {self.level} -> {target} ({signals})")
+        self.level = target
+        self._last_change = now
+        CONCURRENCY_LIMIT.set(self.level)
+        return self.level
+
+    def __call__(self, current_concurrency: int) -> int:
+        """RunPod concurrency_modifier: decide from the current signals and return the level."""
+        return self.update(self.signals())
@@ -0,0 +1,71 @@
+"""
+GPU cost model for jobs.
+
+A job's GPU time scales roughly with the number of latent elements it
+samples: width x height x frames x steps, times the number of segments and
+prompt variants. Cost is expressed in units of the default job (512x512,
+33 frames, 4 steps) and converted to seconds with a per-unit rate that is
+recalibrated from observed GPU times by an exponentially weighted average.
+"""
+
+import threading
+from typing import Dict, Any
+
+
+# The default job (512x512, 33 frames, 4 steps) is one cost unit
+REFERENCE_WORK = 512 * 512 * 33 * 4
+
+
+def job_units(params: Dict[str, Any]) -> float:
+    """
+    GPU work of a job in units of the default job.
+
+    Args:
+        params: Validated job parameters
+
+    Returns:
+        Relative cost (1.0 for a default single-prompt job)
+    """
+    work = params['width'] * params['height'] * params['frames'] * params['steps']
+    repeats = params.get('segments', 1) * max(1, len(params.get('prompts') or [None]))
+    return work * repeats / REFERENCE_WORK
+
+
+class CostModel:
+    """Predicts job GPU seconds, recalibrated from observed jobs."""
+
+    def __init__(self, seconds_per_unit: float = 35.0, alpha: float = 0.2):
+        """
+        Initialize cost model.
+
+        Args:
+            seconds_per_unit: Initial GPU seconds of the default job
+            alpha: EWMA weight of each new observation
+        """
+        self.seconds_per_unit = seconds_per_unit
+        self.alpha = alpha
+        self.observations = 0
+        self._lock = threading.Lock()
+
+    def predict(self, params: Dict[str, Any]) -> float:
+        """Predicted GPU seconds for a job."""
+        return job_units(params) * self.seconds_per_unit
+
+    def observe(self, params: Dict[str, Any], gpu_seconds: float) -> None:
+        """
+        Update the per-unit rate from a finished job.
+
+        Args:
+            params: Validated job parameters
+            gpu_seconds: Time the job held the GPU
+        """
+        units = job_units(params)
+        if units <= 0 or gpu_seconds <= 0:
+            return
+        with self._lock:
+            rate = gpu_seconds / units
+            if self.observations == 0:
+                self.seconds_per_unit = rate
+            else:
+                self.seconds_per_unit += self.alpha * (rate - self.seconds_per_unit)
+            self.observations += 1
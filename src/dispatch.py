@@ -0,0 +1,226 @@
+"""
+Dispatch gate ordering concurrent jobs into ComfyUI.
+
+Only one job at a time is admitted to ComfyUI. When several jobs are
+waiting, the gate admits them by priority class first (interactive,
+normal, batch). Within a class, jobs with a deadline run earliest
+deadline first; the rest are ordered by cache affinity: the job sharing
+the most cacheable inputs (image, prompts, shape) with the job that just
+ran goes next, so ComfyUI's node cache can reuse LoadImage, text-encode
+and downstream results. A fairness bound caps how many times a waiting
+job can be passed over by another job of its class, including by jobs
+with deadlines, so a steady trickle of deadline jobs cannot starve the
+rest.
+
+An interactive job does not wait behind a running job of a lower class:
+it is admitted alongside it and queues its prompts at the front of
+ComfyUI's queue, so it runs right after the prompt currently executing.
+Jobs whose deadline can no longer be met given their predicted cost are
+dropped instead of occupying the GPU for a result nobody will use.
+
+The gate lives on RunPod's event loop: jobs wait for it with
+`async with gate.slot(...)`, so a waiting job suspends its task instead of
+blocking the loop the running job streams its events through.
+"""
+
+import asyncio
+import itertools
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Dict, Any, List, Optional
+
+
+# Priority classes, most urgent first
+PRIORITIES = ("interactive", "normal", "batch")
+
+# Class whose jobs bypass a running lower-class job and use ComfyUI's queue front
+URGENT_PRIORITY = "interactive"
+
+
+class DeadlineExceeded(Exception):
+    """A job can no longer finish before its deadline."""
+    pass
+
+
+def cache_features(params: Dict[str, Any], image_hash: str) -> Dict[str, Any]:
+    """
+    Extract the job inputs that determine ComfyUI node-cache reuse.
+
+    Args:
+        params: Validated job parameters
+        image_hash: Content hash of the input image
+
+    Returns:
+        Feature dict compared between consecutive jobs
+    """
+    return {
+        'image': image_hash,
+        'prompt': params['prompt'],
+        'negative_prompt': params['negative_prompt'],
+        'shape': (params['width'], params['height'], params['frames']),
+    }
+
+
+def affinity(features: Dict[str, Any], previous: Optional[Dict[str, Any]]) -> int:
+    """Number of cacheable features shared with the previously run job."""
+    if not previous:
+        return 0
+    return sum(1 for name, value in features.items() if previous.get(name) == value)
+
+
+class _Waiter:
+    """A job waiting for the gate."""
+
+    def __init__(
+        self,
+        seq: int,
+        features: Dict[str, Any],
+        priority: str = "normal",
+        deadline: Optional[float] = None,
+        cost_seconds: float = 0.0
+    ):
+        self.seq = seq
+        self.features = features
+        self.priority = priority
+        self.rank = PRIORITIES.index(priority)
+        self.deadline = deadline
+        self.cost_seconds = cost_seconds
+        self.skips = 0
+        self.admitted = asyncio.Event()
+
+    @property
+    def latest_start(self) -> Optional[float]:
+        """Last moment the job can start and still meet its deadline."""
+        return None if self.deadline is None else self.deadline - self.cost_seconds
+
+
+class DispatchGate:
+    """Admits jobs by priority class and deadline, preferring cache-affine jobs with bounded unfairness."""
+
+    def __init__(self, window: int = 4, max_skips: int = 3, clock: Callable[[], float] = time.monotonic):
+        """
+        Initialize dispatch gate.
+
+        Args:
+            window: Number of oldest waiting jobs considered for reordering
+            max_skips: Times a job may be passed over before it must run next
+            clock: Monotonic time source deadlines are expressed in
+        """
+        self.window = window
+        self.max_skips = max_skips
+        self.clock = clock
+        self._waiters: List[_Waiter] = []
+        self._holders: List[str] = []
+        self._last_features: Optional[Dict[str, Any]] = None
+        self._seq = itertools.count()
+
+    @asynccontextmanager
+    async def slot(
+        self,
+        features: Dict[str, Any],
+        priority: str = "normal",
+        deadline: Optional[float] = None,
+        cost_seconds: float = 0.0
+    ) -> AsyncIterator[None]:
+        """
+        Hold the gate for the duration of a ComfyUI run.
+
+        Must be entered on the event loop that all of the gate's jobs run on.
+
+        Args:
+            features: Cache features of the job (see cache_features)
+            priority: Priority class (one of PRIORITIES)
+            deadline: Time (on clock) by which the job must finish, or None
+            cost_seconds: Predicted GPU seconds of the job
+
+        Raises:
+            DeadlineExceeded: If the deadline cannot be met, either on
+                arrival or while waiting; the job is not admitted
+        """
+        waiter = _Waiter(next(self._seq), features, priority, deadline, cost_seconds)
+        self._check_deadline(waiter)
+        self._waiters.append(waiter)
+        self._admit_next()
+
+        try:
+            await self._wait(waiter)
+        except BaseException:
+            # Deadline passed or the job was cancelled while waiting
+            if waiter.admitted.is_set():
+                self._release(features, priority)
+            else:
+                self._waiters.remove(waiter)
+            raise
+        try:
+            yield
+        finally:
+            self._release(features, priority)
+
+    def _release(self, features: Dict[str, Any], priority: str) -> None:
+        self._last_features = features
+        self._holders.remove(priority)
+        self._admit_next()
+
+    def _check_deadline(self, waiter: _Waiter) -> None:
+        latest_start = waiter.latest_start
+        if latest_start is not None and self.clock() > latest_start:
+            raise DeadlineExceeded(
+                f"predicted {waiter.cost_seconds:.0f}s of GPU time no longer fits before the deadline"
+            )
+
+    async def _wait(self, waiter: _Waiter) -> None:
+        """Wait until admitted, giving up once the job could no longer meet its deadline."""
+        while not waiter.admitted.is_set():
+            latest_start = waiter.latest_start
+            if latest_start is None:
+                await waiter.admitted.wait()
+                return
+            try:
+                await asyncio.wait_for(waiter.admitted.wait(), max(0.0, latest_start - self.clock()))
+            except asyncio.TimeoutError:
+                if not waiter.admitted.is_set():
+                    self._check_deadline(waiter)
+
+    def select(self, waiters: List[_Waiter]) -> _Waiter:
+        """
+        Choose the next job among waiters (ordered by arrival).
+
+        Only the most urgent class present is considered. Within it, a job
+        that has reached max_skips runs first, then the job with the
+        earliest deadline; otherwise the job with the highest affinity
+        within the window wins, oldest first on ties.
+        """
+        top = min(w.rank for w in waiters)
+        waiters = [w for w in waiters if w.rank == top]
+
+        starving = [w for w in waiters if w.skips >= self.max_skips]
+        if starving:
+            return starving[0]
+
+        with_deadline = [w for w in waiters if w.deadline is not None]
+        if with_deadline:
+            return min(with_deadline, key=lambda w: (w.deadline, w.seq))
+
+        candidates = waiters[:self.window]
+        return max(candidates, key=lambda w: (affinity(w.features, self._last_features), -w.seq))
+
+    def _admit_next(self) -> None:
+        """Admit waiters while the gate has room."""
+        while self._waiters:
+            if not self._holders:
+                candidates = self._waiters
+            elif URGENT_PRIORITY not in self._holders:
+                # An urgent job may run alongside a lower-class holder
+                candidates = [w for w in self._waiters if w.priority == URGENT_PRIORITY]
+            else:
+                candidates = []
+            if not candidates:
+                return
+
+            chosen = self.select(candidates)
+            for waiter in self._waiters:
+                if waiter.seq < chosen.seq and waiter.rank == chosen.rank:
+                    waiter.skips += 1
+            self._waiters.remove(chosen)
+            self._holders.append(chosen.priority)
+            chosen.admitted.set()
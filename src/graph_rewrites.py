@@ -0,0 +1,133 @@
+"""
+Optional rewrites of the base workflow graph.
+
+Each rewrite swaps stock nodes for the worker's custom nodes
+(custom_nodes/wan_worker_nodes). Rewrites are selected by name through
+the GRAPH_REWRITES environment variable and applied when the workflow is
+loaded, so the workflow JSON itself stays the stock ComfyUI template.
+"""
+
+from typing import Dict, Any, Callable, Iterable
+
+
+def use_cached_text_encode(workflow: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Route prompt encoding (nodes 89/93) through CachedCLIPTextEncode.
+
+    The encoder file name from CLIPLoader (node 146) becomes part of the
+    cache key, so swapping text encoders never serves stale conditioning.
+    """
+    clip_name = workflow["146"]["inputs"]["clip_name"]
+    for node_id in ("89", "93"):
+        node = workflow.get(node_id)
+        if node and node["class_type"] == "CLIPTextEncode":
+            node["class_type"] = "CachedCLIPTextEncode"
+            node["inputs"]["clip_name"] = clip_name
+    return workflow
+
+
+def use_cached_start_image(workflow: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Serve the start-image VAE encode in WanImageToVideo (node 98) from a cache.
+
+    The VAE file name from VAELoader (node 143) becomes part of the cache key.
+    """
+    node = workflow.get("98")
+    if node and node["class_type"] == "WanImageToVideo":
+        node["class_type"] = "CachedWanImageToVideo"
+        node["inputs"]["vae_name"] = workflow["143"]["inputs"]["vae_name"]
+    return workflow
+
+
+def use_streaming_decode(workflow: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Replace VAEDecode -> CreateVideo -> SaveVideo (87/94/108) with StreamingVAEDecodeSave.
+
+    The new node keeps id 108 so output lookup is unchanged; it decodes the
+    latent in temporal chunks and pipes uint8 frames into ffmpeg instead of
+    materializing every frame as one float tensor.
+    """
+    decode, create, save = workflow.get("87"), workflow.get("94"), workflow.get("108")
+    if not (decode and create and save and save["class_type"] == "SaveVideo"):
+        return workflow
+
+    workflow["108"] = {
+        "inputs": {
+            "samples": decode["inputs"]["samples"],
+            "vae": decode["inputs"]["vae"],
+            "fps": create["inputs"]["fps"],
+            "filename_prefix": save["inputs"]["filename_prefix"],
+            "chunk_size": 4,
+            "crf": 19,
+            "queue_size": 2,
+        },
+        "class_type": "StreamingVAEDecodeSave",
+        "_meta": {"title": "VAE Decode + Save Video (Streaming)"},
+    }
+    del workflow["87"], workflow["94"]
+    return workflow
+
+
+def use_step_cache(workflow: Dict[str, Any], threshold: float, label: str = "") -> Dict[str, Any]:
+    """
+    Wrap both experts' models (ModelSamplingSD3 nodes 147/150) in WanStepCache.
+
+    Unlike the REWRITES above this is applied per job, since the threshold is
+    a job input. Node 151 wraps the high-noise model (sampler 86), node 152
+    the low-noise model (sampler 85), and node 153 (WanStepCacheStats)
+    reports the skip statistics of both once the low-noise sampler is done.
+
+    Args:
+        workflow: Workflow dict (API format), modified in place
+        threshold: WanStepCache skip threshold
+        label: Identifies the job's statistics in the prompt history
+
+    Returns:
+        The rewritten workflow
+    """
+    high, low = workflow.get("86"), workflow.get("85")
+    if not (high and low and "150" in workflow and "147" in workflow):
+        return workflow
+
+    for node_id, source in (("151", "150"), ("152", "147")):
+        workflow[node_id] = {
+            "inputs": {"model": [source, 0], "threshold": threshold, "label": label},
+            "class_type": "WanStepCache",
+            "_meta": {"title": "Wan Step Cache"},
+        }
+    high["inputs"]["model"] = ["151", 0]
+    low["inputs"]["model"] = ["152", 0]
+    workflow["153"] = {
+        "inputs": {"samples": ["85", 0], "model_high": ["151", 0], "model_low": ["152", 0], "label": label},
+        "class_type": "WanStepCacheStats",
+        "_meta": {"title": "Wan Step Cache Stats"},
+    }
+    return workflow
+
+
+REWRITES: Dict[str, Callable[[Dict[str, Any]], Dict[str, Any]]] = {
+    "text_cache": use_cached_text_encode,
+    "latent_cache": use_cached_start_image,
+    "streaming_decode": use_streaming_decode,
+}
+
+
+def apply_rewrites(workflow: Dict[str, Any], names: Iterable[str]) -> Dict[str, Any]:
+    """
+    Apply named rewrites to a workflow in order.
+
+    Args:
+        workflow: Workflow dict (API format), modified in place
+        names: Rewrite names (keys of REWRITES)
+
+    Returns:
+        The rewritten workflow
+
+    Raises:
+        ValueError: If a rewrite name is unknown
+    """
+    for name in names:
+        if name not in REWRITES:
+            raise ValueError(f"Unknown graph rewrite: {name}")
+        workflow = REWRITES[name](workflow)
+    return workflow
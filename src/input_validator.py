@@ -4,6 +4,26 @@ Input validation for RunPod job parameters.
 
 from typing import Dict, Any, Optional
 
+from src.dispatch import PRIORITIES
+from src.postprocess import OUTPUT_PROFILES
+from src.profiling import PROFILE_MODES, profiling_allowed
+from src.utils import RESIZE_MODES
+
+
+# Maximum number of prompt variants fanned out from one input image
+MAX_PROMPT_VARIANTS = 8
+
+# Maximum number of chained segments in long-video mode
+MAX_SEGMENTS = 8
+
+# Longest accepted job deadline (1 hour)
+MAX_DEADLINE_MS = 3600 * 1000
+
+# Base64 characters per streamed output chunk (multiples of 4 decode independently)
+DEFAULT_OUTPUT_CHUNK_SIZE = 1024 * 1024
+MIN_OUTPUT_CHUNK_SIZE = 64 * 1024
+MAX_OUTPUT_CHUNK_SIZE = 8 * 1024 * 1024
+
 
 # Default Chinese negative prompt (optimized for Wan2.2 model)
 DEFAULT_NEGATIVE_PROMPT = (
@@ -34,13 +54,39 @@ def validate_input(job_input: Dict[str, Any]) -> Dict[str, Any]:
     """
     validated = {}
 
-    # === Required: Prompt ===
-    prompt = job_input.get('prompt', '').strip()
-    if not prompt:
-        raise ValidationError("'prompt' is required and cannot be empty")
-    if len(prompt) > 1000:
-        raise ValidationError("'prompt' exceeds maximum length of 1000 characters")
-    validated['prompt'] = prompt
+    # === Required: Prompt (single prompt or list of prompt variants) ===
+    prompts = job_input.get('prompts')
+    if prompts is not None:
+        if not isinstance(prompts, list) or not prompts:
+            raise ValidationError("'prompts' must be a non-empty list of strings")
+        if len(prompts) > MAX_PROMPT_VARIANTS:
+            raise ValidationError(f"'prompts' accepts at most {MAX_PROMPT_VARIANTS} entries")
+        if job_input.get('prompt'):
+            raise ValidationError("Provide only one of 'prompt' or 'prompts', not both")
+    else:
+        prompts = [job_input.get('prompt', '')]
+
+    for index, prompt in enumerate(prompts):
+        name = f"prompts[{index}]" if 'prompts' in job_input else 'prompt'
+        if not isinstance(prompt, str) or not prompt.strip():
+            raise ValidationError(f"'{name}' is required and cannot be empty")
+        if len(prompt.strip()) > 1000:
+            raise ValidationError(f"'{name}' exceeds maximum length of 1000 characters")
+    validated['prompts'] = [prompt.strip() for prompt in prompts]
+    validated['prompt'] = validated['prompts'][0]
+
+    # === Optional: Seeds (one per prompt) ===
+    seeds = job_input.get('seeds')
+    if seeds is not None:
+        if not isinstance(seeds, list) or len(seeds) != len(validated['prompts']):
+            raise ValidationError("'seeds' must be a list with one seed per prompt")
+        try:
+            seeds = [int(seed) for seed in seeds]
+        except (TypeError, ValueError):
+            raise ValidationError("'seeds' must contain valid integers")
+        if any(seed < 0 or seed >= 2 ** 64 for seed in seeds):
+            raise ValidationError("'seeds' must be between 0 and 2^64 - 1")
+    validated['seeds'] = seeds
 
     # === Required: Image (either base64 or URL) ===
     image_base64 = job_input.get('image_base64')
@@ -95,6 +141,12 @@ def validate_input(job_input: Dict[str, Any]) -> Dict[str, Any]:
         raise ValidationError("'height' must be a valid integer")
     validated['height'] = height
 
+    # === Optional: How the input image is fitted to width x height ===
+    resize_mode = job_input.get('resize_mode', 'crop')
+    if resize_mode not in RESIZE_MODES:
+        raise ValidationError(f"'resize_mode' must be one of: {', '.join(RESIZE_MODES)}")
+    validated['resize_mode'] = resize_mode
+
     # === Optional: Frames ===
     frames = job_input.get('frames', 33)
     try:
@@ -127,4 +179,94 @@ def validate_input(job_input: Dict[str, Any]) -> Dict[str, Any]:
         raise ValidationError("'steps' must be a valid integer")
     validated['steps'] = steps
 
+    # === Optional: Target FPS (CPU frame interpolation) ===
+    target_fps = job_input.get('target_fps')
+    if target_fps is not None:
+        try:
+            target_fps = int(target_fps)
+            if target_fps <= fps or target_fps > 60:
+                raise ValidationError("'target_fps' must be greater than 'fps' and at most 60")
+        except (TypeError, ValueError):
+            raise ValidationError("'target_fps' must be a valid integer")
+    validated['target_fps'] = target_fps
+
+    # === Optional: Output encoding profile ===
+    output_profile = job_input.get('output_profile', 'default')
+    if output_profile != 'default' and output_profile not in OUTPUT_PROFILES:
+        choices = ', '.join(['default'] + list(OUTPUT_PROFILES))
+        raise ValidationError(f"'output_profile' must be one of: {choices}")
+    validated['output_profile'] = None if output_profile == 'default' else output_profile
+
+    # === Optional: Step-output cache threshold (0 disables) ===
+    step_cache_threshold = job_input.get('step_cache_threshold', 0.0)
+    try:
+        step_cache_threshold = float(step_cache_threshold)
+        if step_cache_threshold < 0.0 or step_cache_threshold > 1.0:
+            raise ValidationError("'step_cache_threshold' must be between 0.0 and 1.0")
+    except (TypeError, ValueError):
+        raise ValidationError("'step_cache_threshold' must be a valid number")
+    validated['step_cache_threshold'] = step_cache_threshold
+
+    # === Optional: Priority class and deadline ===
+    priority = job_input.get('priority', 'normal')
+    if priority not in PRIORITIES:
+        raise ValidationError(f"'priority' must be one of: {', '.join(PRIORITIES)}")
+    validated['priority'] = priority
+
+    deadline_ms = job_input.get('deadline_ms')
+    if deadline_ms is not None:
+        try:
+            deadline_ms = int(deadline_ms)
+            if deadline_ms < 1 or deadline_ms > MAX_DEADLINE_MS:
+                raise ValidationError(f"'deadline_ms' must be between 1 and {MAX_DEADLINE_MS}")
+        except (TypeError, ValueError):
+            raise ValidationError("'deadline_ms' must be a valid integer")
+    validated['deadline_ms'] = deadline_ms
+
+    # === Optional: Segments (long-video mode) ===
+    segments = job_input.get('segments', 1)
+    try:
+        segments = int(segments)
+        if segments < 1 or segments > MAX_SEGMENTS:
+            raise ValidationError(f"'segments' must be between 1 and {MAX_SEGMENTS}")
+    except (TypeError, ValueError):
+        raise ValidationError("'segments' must be a valid integer")
+    if segments > 1 and len(validated['prompts']) > 1:
+        raise ValidationError("'segments' cannot be combined with multiple 'prompts'")
+    validated['segments'] = segments
+
+    # === Optional: Stream latent preview frames ===
+    stream_previews = job_input.get('stream_previews', False)
+    if not isinstance(stream_previews, bool):
+        raise ValidationError("'stream_previews' must be a boolean")
+    validated['stream_previews'] = stream_previews
+
+    # === Optional: Stream the output video as base64 chunks ===
+    stream_output = job_input.get('stream_output', False)
+    if not isinstance(stream_output, bool):
+        raise ValidationError("'stream_output' must be a boolean")
+    validated['stream_output'] = stream_output
+
+    output_chunk_size = job_input.get('output_chunk_size', DEFAULT_OUTPUT_CHUNK_SIZE)
+    try:
+        output_chunk_size = int(output_chunk_size)
+        if output_chunk_size < MIN_OUTPUT_CHUNK_SIZE or output_chunk_size > MAX_OUTPUT_CHUNK_SIZE:
+            raise ValidationError(
+                f"'output_chunk_size' must be between {MIN_OUTPUT_CHUNK_SIZE} and {MAX_OUTPUT_CHUNK_SIZE}"
+            )
+        if output_chunk_size % 4:
+            raise ValidationError("'output_chunk_size' must be a multiple of 4")
+    except (TypeError, ValueError):
+        raise ValidationError("'output_chunk_size' must be a valid integer")
+    validated['output_chunk_size'] = output_chunk_size
+
+    # === Optional: Profile this job (modes enabled by PROFILE_ALLOWLIST) ===
+    profile = job_input.get('profile')
+    if profile is not None:
+        if profile not in PROFILE_MODES:
+            raise ValidationError(f"'profile' must be one of: {', '.join(PROFILE_MODES)}")
+        if not profiling_allowed(profile):
+            raise ValidationError(f"Profiling mode '{profile}' is not enabled on this worker")
+    validated['profile'] = profile
+
     return validated
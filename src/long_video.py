@@ -0,0 +1,123 @@
+"""
+Long-video mode: chain Wan2.2 segments into one clip.
+
+A single Wan2.2 pass is capped at 121 frames. Longer clips are built by
+feeding each segment's last frame back as the next segment's start image.
+While segment k+1 samples on the GPU, segment k is stream-copied to
+MPEG-TS on a worker thread, so the final concatenation is a cheap copy
+and encoding overhead stays off the critical path.
+
+Segment boundaries repeat one frame (the next segment starts on the
+previous segment's last frame): dropping it would require re-encoding.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Any, Iterator, List, Optional
+
+from src.comfy_runner import ComfyUIRunner
+from src.media import extract_last_frame, remux_to_mpegts, concat_mpegts
+from src.utils import cleanup_files
+
+
+def tag_events(stream: Iterator[Dict[str, Any]], **tags):
+    """Re-yield events from a generator with extra fields, returning its result."""
+    while True:
+        try:
+            event = next(stream)
+        except StopIteration as stop:
+            return stop.value
+        yield {**event, **tags}
+
+
+class SegmentChainer:
+    """Runs consecutive segments and stitches them into one video."""
+
+    def __init__(
+        self,
+        runner: ComfyUIRunner,
+        extract_last_frame_fn: Callable[[str, str], str] = extract_last_frame,
+        remux_fn: Callable[[str, str], str] = remux_to_mpegts,
+        concat_fn: Callable[[List[str], str], str] = concat_mpegts
+    ):
+        """
+        Initialize segment chainer.
+
+        Args:
+            runner: ComfyUI runner executing each segment
+            extract_last_frame_fn: Writes a video's last frame to an image path
+            remux_fn: Converts a segment to a concatenable intermediate
+            concat_fn: Joins intermediates into the final video
+        """
+        self.runner = runner
+        self.extract_last_frame_fn = extract_last_frame_fn
+        self.remux_fn = remux_fn
+        self.concat_fn = concat_fn
+
+    def run(
+        self,
+        segments: int,
+        input_image_path: str,
+        output_video_path: str,
+        seed: Optional[int] = None,
+        previews: bool = False,
+        **params
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Generate and concatenate segments, yielding progress events.
+
+        Use with ``yield from``; the generator's return value is the path of
+        the concatenated video.
+
+        Args:
+            segments: Number of segments to chain
+            input_image_path: Start image of the first segment
+            output_video_path: Output path prefix
+            seed: Base noise seed; segment i uses seed + i (None keeps default)
+            previews: Whether to yield latent preview frames
+            **params: Remaining stream_workflow arguments (prompt, width, ...)
+
+        Yields:
+            Progress events tagged with the segment index
+
+        Returns:
+            Path to the concatenated video
+
+        Raises:
+            ComfyUIError: If a segment fails to generate
+            FFmpegError: If frame extraction or muxing fails
+        """
+        start_image = input_image_path
+        intermediates = []
+        remux_futures = []
+        executor = ThreadPoolExecutor(max_workers=1)
+
+        try:
+            for index in range(segments):
+                segment_path = yield from tag_events(
+                    self.runner.stream_workflow(
+                        input_image_path=start_image,
+                        output_video_path=f"{output_video_path}_seg{index}",
+                        seed=seed + index if seed is not None else None,
+                        previews=previews,
+                        **params
+                    ),
+                    segment=index
+                )
+                intermediates.append(segment_path)
+
+                if index < segments - 1:
+                    start_image = self.extract_last_frame_fn(segment_path, f"{output_video_path}_seg{index}_last.png")
+                    intermediates.append(start_image)
+
+                # Mux this segment while the next one samples
+                ts_path = f"{output_video_path}_seg{index}.ts"
+                intermediates.append(ts_path)
+                remux_futures.append(executor.submit(self.remux_fn, segment_path, ts_path))
+
+                yield {"type": "segment_complete", "segment": index, "total": segments}
+
+            parts = [future.result() for future in remux_futures]
+            return self.concat_fn(parts, f"{output_video_path}_long.mp4")
+        finally:
+            executor.shutdown(wait=True)
+            cleanup_files(*intermediates)
@@ -0,0 +1,152 @@
+"""
+ffmpeg helpers for post-processing generated videos.
+"""
+
+import os
+import subprocess
+from typing import List, Optional
+
+
+class FFmpegError(Exception):
+    """Custom exception for ffmpeg failures."""
+    pass
+
+
+def run_ffmpeg(args: List[str], timeout: int = 300) -> None:
+    """
+    Run ffmpeg with the given arguments.
+
+    Args:
+        args: Arguments after the ffmpeg executable
+        timeout: Maximum run time in seconds
+
+    Raises:
+        FFmpegError: If ffmpeg is missing, fails or times out
+    """
+    cmd = ["ffmpeg", "-hide_banner", "-loglevel", "error", "-y"] + args
+    try:
+        result = subprocess.run(cmd, capture_output=True, timeout=timeout)
+    except FileNotFoundError:
+        raise FFmpegError("ffmpeg not found")
+    except subprocess.TimeoutExpired:
+        raise FFmpegError(f"ffmpeg timed out after {timeout} seconds")
+
+    if result.returncode != 0:
+        stderr = result.stderr.decode('utf-8', errors='replace').strip()
+        raise FFmpegError(f"ffmpeg failed ({result.returncode}): {stderr[-500:]}")
+
+
+def extract_last_frame(video_path: str, image_path: str) -> str:
+    """
+    Write the last frame of a video as a PNG image.
+
+    Args:
+        video_path: Source video
+        image_path: Destination PNG path
+
+    Returns:
+        image_path
+    """
+    # Seek close to the end and keep overwriting the image: the last write wins
+    run_ffmpeg(["-sseof", "-1", "-i", video_path, "-update", "1", "-f", "image2", image_path])
+    if not os.path.exists(image_path):
+        raise FFmpegError(f"No frame extracted from {video_path}")
+    return image_path
+
+
+def remux_to_mpegts(video_path: str, ts_path: str) -> str:
+    """
+    Stream-copy an MP4 segment into MPEG-TS so segments can be concatenated.
+
+    Args:
+        video_path: Source MP4 (H.264)
+        ts_path: Destination .ts path
+
+    Returns:
+        ts_path
+    """
+    run_ffmpeg(["-i", video_path, "-c", "copy", "-bsf:v", "h264_mp4toannexb", "-f", "mpegts", ts_path])
+    return ts_path
+
+
+def concat_mpegts(ts_paths: List[str], output_path: str) -> str:
+    """
+    Concatenate MPEG-TS segments into one MP4 without re-encoding.
+
+    Args:
+        ts_paths: Segments in playback order
+        output_path: Destination MP4 path
+
+    Returns:
+        output_path
+    """
+    run_ffmpeg([
+        "-i", "concat:" + "|".join(ts_paths),
+        "-c", "copy", "-movflags", "+faststart", output_path
+    ])
+    return output_path
+
+
+def count_frames(video_path: str) -> Optional[int]:
+    """
+    Count video frames with ffprobe.
+
+    Args:
+        video_path: Video file
+
+    Returns:
+        Number of frames, or None if ffprobe is unavailable or fails
+    """
+    cmd = [
+        "ffprobe", "-v", "error", "-select_streams", "v:0", "-count_packets",
+        "-show_entries", "stream=nb_read_packets", "-of", "csv=p=0", video_path
+    ]
+    try:
+        result = subprocess.run(cmd, capture_output=True, timeout=60)
+        return int(result.stdout.decode('utf-8').strip().split(',')[0])
+    except (FileNotFoundError, subprocess.TimeoutExpired, ValueError, IndexError):
+        return None
+
+
+def minterpolate_filter(target_fps: int, mode: str = "mci") -> str:
+    """
+    Build an ffmpeg minterpolate filter raising the frame rate on CPU.
+
+    Args:
+        target_fps: Output frame rate
+        mode: minterpolate mi_mode ("mci" motion-compensated, "blend" cheap crossfade)
+
+    Returns:
+        Filter string for -vf
+    """
+    vf = f"minterpolate=fps={target_fps}:mi_mode={mode}"
+    if mode == "mci":
+        vf += ":mc_mode=aobmc:me_mode=bidir:vsbmc=1"
+    return vf
+
+
+def transcode_video(
+    video_path: str,
+    output_path: str,
+    filters: List[str],
+    codec_args: List[str],
+    timeout: int = 900
+) -> str:
+    """
+    Re-encode a video in a single ffmpeg pass.
+
+    Args:
+        video_path: Source video
+        output_path: Destination path (extension selects the container)
+        filters: Video filters applied in order (may be empty)
+        codec_args: Encoder arguments
+        timeout: Maximum run time in seconds
+
+    Returns:
+        output_path
+    """
+    args = ["-i", video_path]
+    if filters:
+        args += ["-vf", ",".join(filters)]
+    run_ffmpeg(args + ["-an"] + codec_args + [output_path], timeout=timeout)
+    return output_path
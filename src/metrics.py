@@ -0,0 +1,322 @@
+"""
+In-process metrics in the Prometheus text exposition format.
+
+The handler, the ComfyUI runner and the image ingest code report into the
+module-level registry. It is exposed either over HTTP (METRICS_PORT) or by
+periodically writing a textfile for node_exporter's textfile collector
+(METRICS_TEXTFILE). Both are off by default.
+"""
+
+import bisect
+import math
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+
+# Default latency buckets in seconds, from sub-second stages to long generations
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+def _format_value(value: float) -> str:
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, v in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class _Metric:
+    """Base class: a named metric family with fixed label names."""
+
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        """Return (suffix, formatted labels, value) samples."""
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        for suffix, labels, value in self.samples():
+            lines.append(f"{self.name}{suffix}{labels} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """Monotonically increasing count."""
+
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        if amount < 0:
+            raise ValueError("Counters can only increase")
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        with self._lock:
+            return [("", _format_labels(self.labelnames, key), value) for key, value in sorted(self._values.items())]
+
+
+class Gauge(_Metric):
+    """Value that can go up and down, or be computed at scrape time."""
+
+    type_name = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        """Compute the (unlabelled) value at scrape time; exceptions report NaN."""
+        self._function = function
+
+    def value(self, **labels) -> float:
+        if self._function is not None:
+            try:
+                return float(self._function())
+            except Exception:
+                return float("nan")
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        if self._function is not None:
+            return [("", "", self.value())]
+        with self._lock:
+            return [("", _format_labels(self.labelnames, key), value) for key, value in sorted(self._values.items())]
+
+
+class Histogram(_Metric):
+    """Distribution of observations in cumulative buckets."""
+
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # key -> (per-bucket counts incl. +Inf, sum)
+        self._values: Dict[Tuple[str, ...], Tuple[List[int], float]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        """Observe the duration of the enclosed block."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels) -> int:
+        with self._lock:
+            entry = self._values.get(self._key(labels))
+            return sum(entry[0]) if entry else 0
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        samples = []
+        with self._lock:
+            for key, (counts, total) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += count
+                    le = "+Inf" if math.isinf(bound) else _format_value(bound)
+                    samples.append(("_bucket", _format_labels(self.labelnames, key, ("le", le)), cumulative))
+                samples.append(("_sum", _format_labels(self.labelnames, key), total))
+                samples.append(("_count", _format_labels(self.labelnames, key), cumulative))
+        return samples
+
+
+class Registry:
+    """Collection of metrics rendered together."""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric already registered: {metric.name}")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        """Render all metrics in the Prometheus text exposition format."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+JOBS = REGISTRY.counter("wan_jobs_total", "Jobs finished, by outcome", ("outcome",))
+JOBS_IN_FLIGHT = REGISTRY.gauge("wan_jobs_in_flight", "Jobs currently being handled")
+CONCURRENCY_LIMIT = REGISTRY.gauge("wan_concurrency_limit", "Jobs the worker currently accepts concurrently")
+STAGE_SECONDS = REGISTRY.histogram("wan_stage_seconds", "Time spent in each job stage", ("stage",))
+COMFYUI_PROMPT_SECONDS = REGISTRY.histogram("wan_comfyui_prompt_seconds", "Time from queueing a prompt to its completion")
+COMFYUI_RESTARTS = REGISTRY.counter("wan_comfyui_restarts_total", "ComfyUI crashes or hangs that triggered a restart")
+COMFYUI_QUEUE_DEPTH = REGISTRY.gauge("wan_comfyui_queue_depth", "Prompts running or pending in ComfyUI")
+CACHE_REQUESTS = REGISTRY.counter("wan_cache_requests_total", "Cache lookups, by cache and result", ("cache", "result"))
+BYTES_IN = REGISTRY.counter("wan_bytes_in_total", "Input image bytes received, by source", ("source",))
+BYTES_OUT = REGISTRY.counter("wan_bytes_out_total", "Base64 video bytes returned")
+STEP_CACHE_STEPS = REGISTRY.counter(
+    "wan_step_cache_steps_total", "Expert model calls under the step cache, by result", ("result",)
+)
+
+
+class StageTimer:
+    """Times consecutive job stages: entering a stage ends the previous one."""
+
+    def __init__(self, histogram: Histogram = STAGE_SECONDS):
+        self.histogram = histogram
+        self._stage: Optional[str] = None
+        self._start = 0.0
+
+    def enter(self, stage: str) -> None:
+        self.finish()
+        self._stage = stage
+        self._start = time.perf_counter()
+
+    def finish(self) -> None:
+        if self._stage is not None:
+            self.histogram.observe(time.perf_counter() - self._start, stage=self._stage)
+            self._stage = None
+
+
+def cache_hit_ratio(cache: str) -> float:
+    """Hit ratio of a cache tracked in CACHE_REQUESTS (NaN before any lookup)."""
+    hits = CACHE_REQUESTS.value(cache=cache, result="hit")
+    total = hits + CACHE_REQUESTS.value(cache=cache, result="miss")
+    return hits / total if total else float("nan")
+
+
+def start_http_server(port: int, host: str = "0.0.0.0", registry: Registry = REGISTRY) -> ThreadingHTTPServer:
+    """
+    Serve /metrics from a daemon thread.
+
+    Args:
+        port: Listen port (0 picks a free port)
+        host: Bind address
+        registry: Registry to expose
+
+    Returns:
+        The running server (server_address holds the bound port)
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/metrics", "/"):
+                self.send_error(404)
+                return
+            body = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True, name="metrics-http").start()
+    return server
+
+
+def write_textfile(path: str, registry: Registry = REGISTRY) -> None:
+    """Atomically write the registry to a .prom file for a textfile collector."""
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(registry.render())
+    os.replace(tmp_path, path)
+
+
+def start_textfile_exporter(path: str, interval: float = 15.0, registry: Registry = REGISTRY) -> threading.Thread:
+    """Rewrite the textfile every interval seconds from a daemon thread."""
+    def loop():
+        while True:
+            try:
+                write_textfile(path, registry)
+            except OSError as e:
+                print(f"Warning: Failed to write metrics textfile: {e}")
+            time.sleep(interval)
+
+    thread = threading.Thread(target=loop, daemon=True, name="metrics-textfile")
+    thread.start()
+    return thread
@@ -0,0 +1,127 @@
+"""
+CPU post-processing stage for generated videos.
+
+Post-processing (frame interpolation, output re-encoding) runs as one
+ffmpeg subprocess per video on a bounded pool, after the job has released
+ComfyUI, so the GPU can start the next job while this one is still being
+finished on CPU.
+"""
+
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional
+
+from src.media import minterpolate_filter, transcode_video
+
+
+# Concurrent ffmpeg post-processing subprocesses per worker
+POSTPROCESS_WORKERS = int(os.getenv("POSTPROCESS_WORKERS", "2"))
+
+# minterpolate mode: "mci" (motion-compensated) or "blend" (cheaper crossfade)
+INTERPOLATION_MODE = os.getenv("INTERPOLATION_MODE", "mci")
+
+# Output encoding profiles: container extension, MIME type, extra filters and encoder args
+OUTPUT_PROFILES = {
+    "h264-crf": {
+        "extension": "mp4",
+        "mime_type": "video/mp4",
+        "filters": [],
+        "codec_args": ["-c:v", "libx264", "-crf", "23", "-preset", "medium",
+                       "-pix_fmt", "yuv420p", "-movflags", "+faststart"],
+    },
+    "h265": {
+        "extension": "mp4",
+        "mime_type": "video/mp4",
+        "filters": [],
+        "codec_args": ["-c:v", "libx265", "-crf", "28", "-preset", "medium", "-tag:v", "hvc1",
+                       "-pix_fmt", "yuv420p", "-movflags", "+faststart"],
+    },
+    "webm-vp9": {
+        "extension": "webm",
+        "mime_type": "video/webm",
+        "filters": [],
+        "codec_args": ["-c:v", "libvpx-vp9", "-crf", "33", "-b:v", "0", "-row-mt", "1",
+                       "-deadline", "good", "-cpu-used", "4", "-pix_fmt", "yuv420p"],
+    },
+    "preview": {
+        "extension": "mp4",
+        "mime_type": "video/mp4",
+        "filters": ["scale=-2:'min(ih,320)'"],
+        "codec_args": ["-c:v", "libx264", "-crf", "32", "-maxrate", "300k", "-bufsize", "600k",
+                       "-preset", "veryfast", "-pix_fmt", "yuv420p", "-movflags", "+faststart"],
+    },
+}
+
+# Encoder used when only interpolating (near-lossless H.264)
+DEFAULT_CODEC_ARGS = ["-c:v", "libx264", "-crf", "18", "-preset", "veryfast",
+                      "-pix_fmt", "yuv420p", "-movflags", "+faststart"]
+
+_pool = None
+
+
+def get_postprocess_pool() -> ThreadPoolExecutor:
+    """Return the process-wide post-processing pool, creating it on first use."""
+    global _pool
+    if _pool is None:
+        _pool = ThreadPoolExecutor(max_workers=POSTPROCESS_WORKERS, thread_name_prefix="postprocess")
+    return _pool
+
+
+def output_mime_type(profile: Optional[str]) -> str:
+    """MIME type of videos delivered with the given profile (None is SaveVideo's MP4)."""
+    if profile is None:
+        return "video/mp4"
+    return OUTPUT_PROFILES[profile]["mime_type"]
+
+
+def postprocess_video(
+    video_path: str,
+    output_base: str,
+    target_fps: Optional[int] = None,
+    profile: Optional[str] = None
+) -> str:
+    """
+    Apply the requested post-processing steps to a video in one ffmpeg pass.
+
+    Args:
+        video_path: Video produced by ComfyUI
+        output_base: Destination path without extension
+        target_fps: Interpolate to this frame rate (None skips interpolation)
+        profile: Output profile name from OUTPUT_PROFILES (None keeps SaveVideo's encoding)
+
+    Returns:
+        Path to the processed video (video_path if nothing was applied)
+
+    Raises:
+        ValueError: If the profile is unknown
+        FFmpegError: If ffmpeg fails
+    """
+    if target_fps is None and profile is None:
+        return video_path
+    if profile is not None and profile not in OUTPUT_PROFILES:
+        raise ValueError(f"Unknown output profile: {profile}")
+
+    filters = []
+    if target_fps is not None:
+        filters.append(minterpolate_filter(target_fps, mode=INTERPOLATION_MODE))
+
+    if profile is None:
+        return transcode_video(video_path, f"{output_base}.mp4", filters, DEFAULT_CODEC_ARGS)
+
+    settings = OUTPUT_PROFILES[profile]
+    return transcode_video(
+        video_path,
+        f"{output_base}.{settings['extension']}",
+        filters + settings['filters'],
+        settings['codec_args']
+    )
+
+
+def submit_postprocess(
+    video_path: str,
+    output_base: str,
+    target_fps: Optional[int] = None,
+    profile: Optional[str] = None
+) -> Future:
+    """Queue postprocess_video on the bounded pool."""
+    return get_postprocess_pool().submit(postprocess_video, video_path, output_base, target_fps, profile)
@@ -0,0 +1,209 @@
+"""
+On-demand profiling of single jobs.
+
+A job sent with "profile" runs under cProfile ("cpu"), tracemalloc
+("memory") or both ("full"). The job's blocking work (ingest, the
+ComfyUIRunner calls, output encoding) runs on worker threads through
+src.aio.run_blocking, which enables the job's profiler around each call,
+so the CPU profile covers that work and nothing the event loop does for
+other jobs. Work on the pre- and post-processing pools and time spent
+waiting for the dispatch gate count towards wall_seconds only.
+
+Profiling is off unless PROFILE_ALLOWLIST names the requested mode, and
+jobs that do not ask for it are not wrapped at all. cProfile and
+tracemalloc are process-wide hooks, so only one job is profiled at a
+time. A concurrent request runs unprofiled, and its summary says so.
+"""
+
+import cProfile
+import contextvars
+import io
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from typing import Any, AsyncIterable, AsyncIterator, Callable, Dict, List, Optional
+
+
+# Profiling modes: cProfile, tracemalloc, or both
+PROFILE_MODES = ("cpu", "memory", "full")
+
+# Modes jobs may request, comma-separated (empty disables profiling)
+PROFILE_ALLOWLIST = tuple(mode.strip() for mode in os.getenv("PROFILE_ALLOWLIST", "").split(",") if mode.strip())
+
+# Directory receiving the .prof (pstats) and .txt reports
+PROFILE_DIR = os.getenv("PROFILE_DIR", "/tmp/profiles")
+
+# Entries per ranking in the summary returned with the job
+PROFILE_TOP = int(os.getenv("PROFILE_TOP", "15"))
+
+_session = threading.Lock()
+# cProfile of the job running in this context (None when it is not profiled)
+_profiler: contextvars.ContextVar = contextvars.ContextVar("profiler", default=None)
+
+
+def profiling_allowed(mode: str) -> bool:
+    """Whether jobs may request the given profiling mode on this worker."""
+    return mode in PROFILE_ALLOWLIST
+
+
+def requested_mode(job_input: Any) -> Optional[str]:
+    """Profiling mode a job asks for, or None if it asks for none or an unavailable one."""
+    mode = job_input.get("profile") if isinstance(job_input, dict) else None
+    return mode if mode in PROFILE_MODES and profiling_allowed(mode) else None
+
+
+def call_profiled(fn: Callable[..., Any], *args, **kwargs) -> Any:
+    """Call fn, with the current job's profiler enabled in this thread if it has one."""
+    profiler = _profiler.get()
+    if profiler is None:
+        return fn(*args, **kwargs)
+    profiler.enable()
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        profiler.disable()
+
+
+def top_functions(profiler: cProfile.Profile, limit: int) -> List[Dict[str, Any]]:
+    """Functions with the most cumulative time."""
+    rows = sorted(pstats.Stats(profiler).stats.items(), key=lambda item: item[1][3], reverse=True)
+    return [
+        {
+            "function": f"{os.path.basename(filename)}:{line}({name})",
+            "calls": calls,
+            "total_s": round(total, 4),
+            "cumulative_s": round(cumulative, 4),
+        }
+        for (filename, line, name), (_, calls, total, cumulative, _) in rows[:limit]
+    ]
+
+
+def top_allocations(snapshot: tracemalloc.Snapshot, limit: int) -> List[Dict[str, Any]]:
+    """Source lines holding the most traced memory in a snapshot."""
+    snapshot = snapshot.filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+    ))
+    return [
+        {
+            "location": f"{os.path.basename(stat.traceback[0].filename)}:{stat.traceback[0].lineno}",
+            "size_kb": round(stat.size / 1024, 1),
+            "count": stat.count,
+        }
+        for stat in snapshot.statistics("lineno")[:limit]
+    ]
+
+
+def write_report(
+    path_base: str,
+    profiler: Optional[cProfile.Profile],
+    snapshot: Optional[tracemalloc.Snapshot]
+) -> Dict[str, str]:
+    """
+    Write the full profile of a job to disk.
+
+    Args:
+        path_base: Report path without extension
+        profiler: cProfile data (None in memory mode)
+        snapshot: tracemalloc snapshot (None in cpu mode)
+
+    Returns:
+        Paths of the written files ("pstats" for `python -m pstats`, "report" as text)
+    """
+    os.makedirs(os.path.dirname(path_base) or ".", exist_ok=True)
+    paths = {}
+    text = io.StringIO()
+    if profiler is not None:
+        paths["pstats"] = f"{path_base}.prof"
+        profiler.dump_stats(paths["pstats"])
+        stats = pstats.Stats(profiler, stream=text)
+        stats.sort_stats("cumulative").print_stats(50)
+    if snapshot is not None:
+        text.write("Top allocations (at the largest traced size between events):\n")
+        for stat in snapshot.statistics("lineno")[:50]:
+            text.write(f"{stat}\n")
+    paths["report"] = f"{path_base}.txt"
+    with open(paths["report"], "w") as f:
+        f.write(text.getvalue())
+    return paths
+
+
+async def profile_job(
+    events: AsyncIterable[Dict[str, Any]],
+    mode: str,
+    label: str,
+    output_dir: Optional[str] = None,
+    top: Optional[int] = None
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Run a job's event stream under the profiler.
+
+    Progress events pass through unchanged; the final result (the item
+    without "type") is yielded last with a "profile" summary added.
+
+    Args:
+        events: Events and result of the job (run_job's async generator)
+        mode: "cpu", "memory" or "full"
+        label: Report file name (the job ID)
+        output_dir: Report directory (defaults to PROFILE_DIR)
+        top: Entries per ranking in the summary (defaults to PROFILE_TOP)
+
+    Yields:
+        The job's events, then its result with "profile" added
+    """
+    if not _session.acquire(blocking=False):
+        print(f"Profiling skipped for {label}: another job is being profiled")
+        summary = {"mode": mode, "skipped": "another job is being profiled"}
+        async for item in events:
+            yield dict(item, profile=summary) if "type" not in item else item
+        return
+
+    top = top or PROFILE_TOP
+    profiler = cProfile.Profile() if mode in ("cpu", "full") else None
+    memory = mode in ("memory", "full")
+    started_tracing = memory and not tracemalloc.is_tracing()
+    token = _profiler.set(profiler)
+    result = None
+    try:
+        if started_tracing:
+            tracemalloc.start()
+        if memory:
+            tracemalloc.reset_peak()
+        snapshot = None
+        largest = -1
+        start = time.perf_counter()
+        print(f"Profiling job {label} ({mode})")
+
+        async for item in events:
+            if memory:
+                # Snapshot where the job held the most memory, not after it freed it
+                current = tracemalloc.get_traced_memory()[0]
+                if current > largest:
+                    largest = current
+                    snapshot = tracemalloc.take_snapshot()
+            if "type" in item:
+                yield item
+            else:
+                result = item
+
+        summary = {"mode": mode, "wall_seconds": round(time.perf_counter() - start, 3)}
+        if profiler is not None:
+            summary["top_functions"] = top_functions(profiler, top)
+        if memory:
+            summary["peak_memory_mb"] = round(tracemalloc.get_traced_memory()[1] / (1024 * 1024), 2)
+            summary["top_allocations"] = top_allocations(snapshot, top) if snapshot is not None else []
+        try:
+            summary.update(write_report(os.path.join(output_dir or PROFILE_DIR, label), profiler, snapshot))
+        except OSError as e:
+            print(f"Warning: Failed to write profile report: {e}")
+    finally:
+        _profiler.reset(token)
+        if started_tracing:
+            tracemalloc.stop()
+        _session.release()
+
+    print(f"Profiled job {label}: {summary.get('report', 'no report written')}")
+    if result is not None:
+        yield dict(result, profile=summary)
@@ -0,0 +1,284 @@
+"""
+ComfyUI process supervisor.
+
+The worker owns the ComfyUI process instead of leaving it in the
+background of entrypoint.sh. A monitor thread watches the process state
+and /system_stats; when ComfyUI exits or stops answering, in-flight jobs
+fail on their next health check instead of polling until their timeout,
+and ComfyUI is restarted with exponential backoff and warmed up again
+before new prompts are admitted.
+"""
+
+import os
+import subprocess
+import threading
+import time
+import urllib.request
+from typing import Callable, Dict, List, Optional
+
+from src.comfy_runner import ComfyUIRunner, ComfyUIError
+from src.metrics import COMFYUI_RESTARTS
+
+
+def comfyui_command(port: int = 8188, extra_args: Optional[List[str]] = None) -> List[str]:
+    """
+    Build the ComfyUI launch command from the environment.
+
+    Args:
+        port: Listen port
+        extra_args: Additional ComfyUI arguments
+
+    Returns:
+        Command line for subprocess
+    """
+    # LRU node cache keeps results for recently used images/prompts, not just the last prompt
+    cache_lru = os.getenv("COMFYUI_CACHE_LRU", "8")
+    # latent2rgb previews are cheap and feed the progress stream's preview frames
+    preview_method = os.getenv("COMFYUI_PREVIEW_METHOD", "latent2rgb")
+    command = [
+        "python", "main.py", "--listen", "0.0.0.0", "--port", str(port),
+        "--cache-lru", cache_lru, "--preview-method", preview_method
+    ]
+    command += os.getenv("COMFYUI_EXTRA_ARGS", "").split()
+    return command + (extra_args or [])
+
+
+def warm_up(runner: ComfyUIRunner, work_dir: str = "/tmp") -> None:
+    """
+    Run a minimal job so model weights are loaded before real jobs arrive.
+
+    Args:
+        runner: Runner without a supervisor attached (ComfyUI is not marked ready yet)
+        work_dir: Directory for the temporary input image
+
+    Raises:
+        ComfyUIError: If the warm-up prompt fails
+    """
+    from PIL import Image
+
+    image_path = os.path.join(work_dir, "warmup_input.png")
+    Image.new("RGB", (64, 64), color=(128, 128, 128)).save(image_path)
+    output_path = None
+    try:
+        output_path = runner.run_workflow(
+            prompt="warm-up",
+            negative_prompt="",
+            input_image_path=image_path,
+            output_video_path=os.path.join(work_dir, "warmup_output"),
+            width=64,
+            height=64,
+            frames=9,
+            steps=4
+        )
+    finally:
+        for path in (image_path, output_path):
+            if path and os.path.exists(path):
+                os.remove(path)
+
+
+class ComfyUISupervisor:
+    """Owns the ComfyUI process: starts, monitors, restarts and warms it up."""
+
+    def __init__(
+        self,
+        command: List[str],
+        server_address: str = "127.0.0.1:8188",
+        cwd: Optional[str] = None,
+        log_path: Optional[str] = None,
+        env: Optional[Dict[str, str]] = None,
+        startup_timeout: float = 120.0,
+        check_interval: float = 2.0,
+        stats_timeout: float = 10.0,
+        max_stats_failures: int = 3,
+        backoff_initial: float = 1.0,
+        backoff_max: float = 30.0,
+        warmup_fn: Optional[Callable[[], None]] = None
+    ):
+        """
+        Initialize supervisor.
+
+        Args:
+            command: ComfyUI command line
+            server_address: ComfyUI server address (host:port)
+            cwd: Working directory for ComfyUI
+            log_path: File receiving ComfyUI stdout/stderr (appended across restarts)
+            env: Environment for ComfyUI (defaults to the worker's)
+            startup_timeout: Seconds to wait for /system_stats after launch
+            check_interval: Seconds between liveness checks
+            stats_timeout: Timeout of one /system_stats request
+            max_stats_failures: Consecutive failed /system_stats checks that count as a hang
+            backoff_initial: Delay before the first restart attempt
+            backoff_max: Maximum delay between restart attempts
+            warmup_fn: Called after each (re)start before ComfyUI is marked ready
+        """
+        self.command = command
+        self.server_address = server_address
+        self.cwd = cwd
+        self.log_path = log_path
+        self.env = env
+        self.startup_timeout = startup_timeout
+        self.check_interval = check_interval
+        self.stats_timeout = stats_timeout
+        self.max_stats_failures = max_stats_failures
+        self.backoff_initial = backoff_initial
+        self.backoff_max = backoff_max
+        self.warmup_fn = warmup_fn
+
+        self.state = "stopped"
+        self.generation = 0
+        self.restarts = 0
+        self.last_error: Optional[str] = None
+        self._process: Optional[subprocess.Popen] = None
+        self._ready = threading.Event()
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def pid(self) -> Optional[int]:
+        """PID of the current ComfyUI process."""
+        return self._process.pid if self._process else None
+
+    def start(self) -> "ComfyUISupervisor":
+        """
+        Launch ComfyUI, wait until it serves requests, warm it up and start monitoring.
+
+        Raises:
+            ComfyUIError: If ComfyUI does not come up or warm-up fails
+        """
+        self.state = "starting"
+        self._launch_and_warm_up()
+        self._thread = threading.Thread(target=self._monitor, daemon=True, name="comfyui-supervisor")
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """Stop monitoring and terminate ComfyUI."""
+        self._stopping.set()
+        self._ready.clear()
+        self.state = "stopped"
+        if self._thread is not None:
+            self._thread.join(timeout=self.check_interval + self.stats_timeout)
+        self._kill()
+
+    def wait_ready(self, timeout: float) -> None:
+        """
+        Block until ComfyUI is running (e.g. while it restarts).
+
+        Raises:
+            ComfyUIError: If ComfyUI is not ready within timeout
+        """
+        if not self._ready.wait(timeout):
+            raise ComfyUIError(f"ComfyUI not available ({self.state}): {self.last_error or 'not started'}")
+
+    def check(self, generation: int) -> None:
+        """
+        Fail a prompt queued during an earlier ComfyUI lifetime.
+
+        Args:
+            generation: Value of self.generation when the prompt was queued
+
+        Raises:
+            ComfyUIError: If ComfyUI died since the prompt was queued
+        """
+        if generation != self.generation or self.state != "running":
+            raise ComfyUIError(f"ComfyUI crashed while the job was running: {self.last_error}")
+
+    def _launch(self) -> None:
+        log = open(self.log_path, "ab") if self.log_path else subprocess.DEVNULL
+        try:
+            self._process = subprocess.Popen(
+                self.command, cwd=self.cwd, env=self.env, stdout=log, stderr=subprocess.STDOUT
+            )
+        finally:
+            if self.log_path:
+                log.close()
+        print(f"Started ComfyUI (pid {self._process.pid}): {' '.join(self.command)}")
+
+    def _kill(self) -> None:
+        process = self._process
+        if process is None or process.poll() is not None:
+            return
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+    def _system_stats_ok(self) -> bool:
+        try:
+            urllib.request.urlopen(f"http://{self.server_address}/system_stats", timeout=self.stats_timeout).read()
+            return True
+        except Exception:
+            return False
+
+    def _wait_for_server(self) -> None:
+        deadline = time.time() + self.startup_timeout
+        while time.time() < deadline:
+            if self._process.poll() is not None:
+                raise ComfyUIError(f"ComfyUI exited during startup with code {self._process.returncode}")
+            if self._system_stats_ok():
+                return
+            time.sleep(0.5)
+        raise ComfyUIError(f"ComfyUI failed to start within {self.startup_timeout} seconds")
+
+    def _launch_and_warm_up(self) -> None:
+        try:
+            self._launch()
+            self._wait_for_server()
+            if self.warmup_fn is not None:
+                print("Warming up ComfyUI...")
+                self.warmup_fn()
+        except Exception as e:
+            self._kill()
+            raise ComfyUIError(f"ComfyUI startup failed: {e}")
+        self.state = "running"
+        self._ready.set()
+        print("✓ ComfyUI is ready")
+
+    def _probe(self, failures: int) -> Optional[str]:
+        """Return a failure reason, or None while ComfyUI is healthy."""
+        returncode = self._process.poll()
+        if returncode is not None:
+            return f"process exited with code {returncode}"
+        if failures >= self.max_stats_failures:
+            return f"/system_stats unresponsive for {failures} checks"
+        return None
+
+    def _monitor(self) -> None:
+        failures = 0
+        while not self._stopping.wait(self.check_interval):
+            if self._process.poll() is None:
+                failures = 0 if self._system_stats_ok() else failures + 1
+            reason = self._probe(failures)
+            if reason is None:
+                continue
+            if self._stopping.is_set():
+                return
+
+            # Fail in-flight jobs first: their next health check sees the new generation
+            with self._lock:
+                self._ready.clear()
+                self.state = "restarting"
+                self.last_error = reason
+                self.generation += 1
+            print(f"ComfyUI failed ({reason}), restarting...")
+            COMFYUI_RESTARTS.inc()
+            self._kill()
+            self._restart()
+            failures = 0
+
+    def _restart(self) -> None:
+        backoff = self.backoff_initial
+        while not self._stopping.is_set():
+            if self._stopping.wait(backoff):
+                return
+            self.restarts += 1
+            try:
+                self._launch_and_warm_up()
+                return
+            except ComfyUIError as e:
+                self.last_error = str(e)
+                print(f"ComfyUI restart failed: {e}")
+                backoff = min(backoff * 2, self.backoff_max)
@@ -7,8 +7,26 @@ import io
 import os
 import uuid
 import requests
-from PIL import Image
-from typing import Optional
+from concurrent.futures import Future, ThreadPoolExecutor
+from PIL import Image, ImageOps
+from typing import Iterable, Iterator, Optional, Tuple
+
+from src.metrics import BYTES_IN
+
+
+# Concurrent input-image preprocessing threads per worker (Pillow releases the GIL while decoding/resizing)
+PREPROCESS_WORKERS = int(os.getenv("PREPROCESS_WORKERS", "2"))
+
+# Container for preprocessed input images: "png" (lossless) or "webp" (smaller)
+PREPROCESS_FORMAT = os.getenv("PREPROCESS_FORMAT", "png")
+
+# How an input image is fitted to width x height: cover and center-crop, letterbox, or leave as uploaded
+RESIZE_MODES = ("crop", "pad", "none")
+
+# Downscale by an integer factor first when the source is this many times larger than the target
+RESIZE_REDUCING_GAP = 3.0
+
+_preprocess_pool: Optional[ThreadPoolExecutor] = None
 
 
 def generate_job_id() -> str:
@@ -30,6 +48,7 @@ def download_image_from_url(url: str, output_path: str) -> None:
     """
     response = requests.get(url, timeout=30)
     response.raise_for_status()
+    BYTES_IN.inc(len(response.content), source="url")
 
     with open(output_path, 'wb') as f:
         f.write(response.content)
@@ -53,6 +72,7 @@ def decode_base64_image(base64_string: str, output_path: str) -> None:
 
     # Decode base64
     image_data = base64.b64decode(base64_string)
+    BYTES_IN.inc(len(image_data), source="base64")
 
     # Validate it's a valid image
     try:
@@ -66,12 +86,37 @@ def decode_base64_image(base64_string: str, output_path: str) -> None:
         f.write(image_data)
 
 
+def encode_chunks_to_base64(chunks: Iterable[bytes]) -> str:
+    """
+    Base64-encode a stream of byte chunks without joining the raw bytes first.
+
+    Bytes are encoded in multiples of 3 so chunk boundaries never introduce
+    padding; the remainder is carried into the next chunk.
+
+    Args:
+        chunks: Byte chunks of any size
+
+    Returns:
+        Base64 string identical to encoding the concatenated chunks
+    """
+    encoded = []
+    carry = b''
+    for chunk in chunks:
+        data = carry + chunk
+        cut = len(data) - len(data) % 3
+        encoded.append(base64.b64encode(data[:cut]))
+        carry = data[cut:]
+    encoded.append(base64.b64encode(carry))
+    return b''.join(encoded).decode('utf-8')
+
+
 def encode_video_to_base64(video_path: str) -> str:
     """
     Encode a video file to base64 string.
 
     Args:
-        video_path: Path to video file
+        video_path: Path to video file, or an http(s) URL (e.g. ComfyUI /view)
+            streamed straight into the encoder
 
     Returns:
         Base64-encoded video string
@@ -79,7 +124,13 @@ def encode_video_to_base64(video_path: str) -> str:
     Raises:
         FileNotFoundError: If video file doesn't exist
         IOError: If file read fails
+        requests.RequestException: If the URL download fails
     """
+    if video_path.startswith(('http://', 'https://')):
+        with requests.get(video_path, stream=True, timeout=60) as response:
+            response.raise_for_status()
+            return encode_chunks_to_base64(response.iter_content(chunk_size=1024 * 1024))
+
     if not os.path.exists(video_path):
         raise FileNotFoundError(f"Video file not found: {video_path}")
 
@@ -89,6 +140,52 @@ def encode_video_to_base64(video_path: str) -> str:
     return base64.b64encode(video_bytes).decode('utf-8')
 
 
+def iter_base64_chunks(video_path: str, chunk_size: int = 1024 * 1024, digest=None) -> Iterator[str]:
+    """
+    Base64-encode a video incrementally with a fixed-size read buffer.
+
+    Every chunk except the last is exactly chunk_size characters, and the
+    chunks concatenate to the base64 of the whole file, so memory use is
+    bounded by the chunk size regardless of the video's length.
+
+    Args:
+        video_path: Path to video file, or an http(s) URL (e.g. ComfyUI /view)
+        chunk_size: Base64 characters per chunk (rounded down to a multiple of 4)
+        digest: Optional hashlib object updated with the raw bytes
+
+    Yields:
+        Base64 chunks in order
+
+    Raises:
+        FileNotFoundError: If video file doesn't exist
+        requests.RequestException: If the URL download fails
+    """
+    raw_size = max(3, chunk_size // 4 * 3)
+
+    def encode(source: Iterable[bytes]) -> Iterator[str]:
+        buffer = b''
+        for block in source:
+            if digest is not None:
+                digest.update(block)
+            buffer += block
+            while len(buffer) >= raw_size:
+                yield base64.b64encode(buffer[:raw_size]).decode('utf-8')
+                buffer = buffer[raw_size:]
+        if buffer:
+            yield base64.b64encode(buffer).decode('utf-8')
+
+    if video_path.startswith(('http://', 'https://')):
+        with requests.get(video_path, stream=True, timeout=60) as response:
+            response.raise_for_status()
+            yield from encode(response.iter_content(chunk_size=raw_size))
+        return
+
+    if not os.path.exists(video_path):
+        raise FileNotFoundError(f"Video file not found: {video_path}")
+    with open(video_path, 'rb') as f:
+        yield from encode(iter(lambda: f.read(raw_size), b''))
+
+
 def cleanup_files(*file_paths: str) -> None:
     """
     Remove temporary files.
@@ -130,3 +227,93 @@ def validate_image_file(image_path: str, max_size_mb: int = 10) -> None:
             img.verify()
     except Exception as e:
         raise ValueError(f"Invalid image file: {e}")
+
+
+def get_preprocess_pool() -> ThreadPoolExecutor:
+    """Return the process-wide image preprocessing pool, creating it on first use."""
+    global _preprocess_pool
+    if _preprocess_pool is None:
+        _preprocess_pool = ThreadPoolExecutor(max_workers=PREPROCESS_WORKERS, thread_name_prefix="preprocess")
+    return _preprocess_pool
+
+
+def fit_box(source_size: Tuple[int, int], target_size: Tuple[int, int]) -> Tuple[float, float, float, float]:
+    """
+    Centered region of the source with the target's aspect ratio.
+
+    Args:
+        source_size: Source (width, height)
+        target_size: Target (width, height)
+
+    Returns:
+        (left, upper, right, lower) box in source pixels
+    """
+    source_width, source_height = source_size
+    target_width, target_height = target_size
+    if source_width * target_height > target_width * source_height:
+        # Source is wider: trim the sides
+        crop_width = source_height * target_width / target_height
+        left = (source_width - crop_width) / 2
+        return (left, 0.0, left + crop_width, float(source_height))
+    crop_height = source_width * target_height / target_width
+    upper = (source_height - crop_height) / 2
+    return (0.0, upper, float(source_width), upper + crop_height)
+
+
+def preprocess_image(image_path: str, output_path: str, width: int, height: int, mode: str = "crop") -> str:
+    """
+    Orient, resize and re-encode an input image to exactly width x height.
+
+    JPEGs are decoded at a reduced DCT scale when much larger than the
+    target, so a 4000 px photo is never fully decoded.
+
+    Args:
+        image_path: Uploaded image
+        output_path: Destination path without extension
+        width: Target width
+        height: Target height
+        mode: "crop" (fill and center-crop) or "pad" (fit and letterbox in black)
+
+    Returns:
+        Path of the written image (output_path plus extension)
+
+    Raises:
+        ValueError: If mode or PREPROCESS_FORMAT is unknown, or the image cannot be decoded
+    """
+    if mode not in ("crop", "pad"):
+        raise ValueError(f"Unknown resize mode: {mode}")
+    if PREPROCESS_FORMAT not in ("png", "webp"):
+        raise ValueError(f"Unknown preprocess format: {PREPROCESS_FORMAT}")
+
+    try:
+        with Image.open(image_path) as img:
+            # EXIF orientation may swap the axes, so request a draft that covers both
+            longest = max(width, height)
+            img.draft("RGB", (longest, longest))
+            img = ImageOps.exif_transpose(img).convert("RGB")
+    except (OSError, SyntaxError) as e:
+        raise ValueError(f"Cannot decode image: {e}")
+
+    if mode == "crop":
+        result = img.resize(
+            (width, height), Image.BICUBIC, box=fit_box(img.size, (width, height)), reducing_gap=RESIZE_REDUCING_GAP
+        )
+    else:
+        scale = min(width / img.width, height / img.height)
+        size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+        resized = img.resize(size, Image.BICUBIC, reducing_gap=RESIZE_REDUCING_GAP)
+        result = Image.new("RGB", (width, height))
+        result.paste(resized, ((width - size[0]) // 2, (height - size[1]) // 2))
+
+    path = f"{output_path}.{PREPROCESS_FORMAT}"
+    if PREPROCESS_FORMAT == "webp":
+        result.save(path, "WEBP", quality=95, method=4)
+    else:
+        # Level 3 is a few times faster than the default with files only slightly larger
+        result.save(path, "PNG", compress_level=3)
+    return path
+
+
+def submit_preprocess(image_path: str, output_path: str, width: int, height: int, mode: str = "crop") -> Future:
+    """Queue preprocess_image on the bounded pool."""
+    return get_preprocess_pool().submit(preprocess_image, image_path, output_path, width, height, mode)
@@ -0,0 +1,171 @@
+"""
+ComfyUI memory profile selection.
+
+The same image runs on 24 GB, 48 GB and 80 GB GPUs. Wan2.2 I2V has two
+14B fp8 experts (~14 GB each) plus the umt5-xxl text encoder (~7 GB), so
+only large cards can keep both experts resident; smaller cards must swap
+them between GPU and host memory on every job. The profile is chosen at
+startup from detected GPU and host memory and turned into ComfyUI flags.
+"""
+
+import os
+import subprocess
+from typing import Callable, List, NamedTuple, Optional
+
+
+# Host memory needed to hold an offloaded expert and the text encoder without re-reading them from disk
+SWAP_HOST_RAM_GB = 40.0
+
+
+class VramProfile(NamedTuple):
+    """ComfyUI memory settings for a class of GPU."""
+
+    name: str
+    vram_flag: str                # --highvram, --normalvram or --lowvram
+    reserve_vram_gb: float        # --reserve-vram headroom left for other allocations
+    both_experts_resident: bool   # high- and low-noise UNets stay on the GPU between jobs
+
+    def args(self) -> List[str]:
+        """ComfyUI command-line arguments for this profile."""
+        args = [self.vram_flag, "--reserve-vram", str(self.reserve_vram_gb)]
+        if not self.both_experts_resident:
+            # Offload each expert to host memory once it has sampled, instead of evicting
+            # parts of it only when the other expert no longer fits
+            args.append("--disable-smart-memory")
+        return args
+
+
+PROFILES = {
+    # 80 GB: both experts, text encoder and VAE stay loaded; no per-job swaps
+    "high": VramProfile("high", "--highvram", 2.0, True),
+    # 48 GB: both experts fit; ComfyUI unloads only under memory pressure
+    "normal": VramProfile("normal", "--normalvram", 1.5, True),
+    # 24-40 GB: one expert at a time, the other waits in host memory
+    "low": VramProfile("low", "--normalvram", 1.0, False),
+    # Below 22 GB: weights are partially streamed from host memory
+    "minimal": VramProfile("minimal", "--lowvram", 0.5, False),
+}
+
+# Minimum GPU memory (GB) for each profile, largest first
+PROFILE_THRESHOLDS = (("high", 64.0), ("normal", 44.0), ("low", 22.0))
+
+
+def detect_gpu_memory_gb(
+    run: Callable[..., subprocess.CompletedProcess] = subprocess.run,
+    visible_devices: Optional[str] = None
+) -> Optional[float]:
+    """
+    Total memory of the first visible GPU, via nvidia-smi.
+
+    nvidia-smi ignores CUDA_VISIBLE_DEVICES, so the first device listed
+    there (an index or UUID) is queried explicitly.
+
+    Args:
+        run: subprocess.run-compatible callable (replaceable in tests)
+        visible_devices: CUDA_VISIBLE_DEVICES value (defaults to the environment)
+
+    Returns:
+        GPU memory in GB, or None if no GPU could be queried
+    """
+    if visible_devices is None:
+        visible_devices = os.getenv("CUDA_VISIBLE_DEVICES")
+    cmd = ["nvidia-smi", "--query-gpu=memory.total", "--format=csv,noheader,nounits"]
+    if visible_devices is not None:
+        device = visible_devices.split(",")[0].strip()
+        if not device:
+            return None
+        cmd += ["-i", device]
+    try:
+        result = run(cmd, capture_output=True, timeout=10)
+        if result.returncode != 0:
+            return None
+        first = result.stdout.decode("utf-8").strip().splitlines()[0]
+        return float(first) / 1024
+    except (OSError, subprocess.TimeoutExpired, ValueError, IndexError):
+        return None
+
+
+def detect_host_memory_gb(meminfo_path: str = "/proc/meminfo") -> Optional[float]:
+    """Total host memory in GB from /proc/meminfo, or None if unavailable."""
+    try:
+        with open(meminfo_path, "r") as f:
+            for line in f:
+                if line.startswith("MemTotal:"):
+                    return int(line.split()[1]) / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def select_profile(
+    gpu_memory_gb: Optional[float],
+    host_memory_gb: Optional[float] = None,
+    override: str = "auto"
+) -> VramProfile:
+    """
+    Choose a profile from GPU and host memory, unless overridden.
+
+    GPU memory sets the base profile. When host memory cannot hold an
+    offloaded expert, a card that fits both experts gets the high profile
+    so ComfyUI never offloads them to host memory.
+
+    Args:
+        gpu_memory_gb: Detected GPU memory (None if unknown)
+        host_memory_gb: Detected host memory (None if unknown)
+        override: Profile name, or "auto" to select by memory
+
+    Returns:
+        Selected profile
+
+    Raises:
+        ValueError: If override names an unknown profile
+    """
+    if override != "auto":
+        if override not in PROFILES:
+            raise ValueError(f"Unknown VRAM profile '{override}', expected auto or one of: {', '.join(PROFILES)}")
+        return PROFILES[override]
+
+    if gpu_memory_gb is None:
+        # Unknown GPU: assume the smallest supported card
+        return PROFILES["low"]
+    profile = PROFILES["minimal"]
+    for name, minimum in PROFILE_THRESHOLDS:
+        if gpu_memory_gb >= minimum:
+            profile = PROFILES[name]
+            break
+    if profile.name == "normal" and host_memory_gb is not None and host_memory_gb < SWAP_HOST_RAM_GB:
+        return PROFILES["high"]
+    return profile
+
+
+def resolve_profile(
+    override: Optional[str] = None,
+    gpu_memory_fn: Callable[[], Optional[float]] = detect_gpu_memory_gb,
+    host_memory_fn: Callable[[], Optional[float]] = detect_host_memory_gb
+) -> VramProfile:
+    """
+    Detect memory, select and log the profile.
+
+    Args:
+        override: Profile name or "auto" (defaults to COMFYUI_VRAM_PROFILE)
+        gpu_memory_fn: Returns GPU memory in GB
+        host_memory_fn: Returns host memory in GB
+
+    Returns:
+        Selected profile
+    """
+    if override is None:
+        override = os.getenv("COMFYUI_VRAM_PROFILE", "auto")
+    gpu_memory = gpu_memory_fn()
+    host_memory = host_memory_fn()
+    profile = select_profile(gpu_memory, host_memory, override)
+
+    gpu_text = f"{gpu_memory:.0f} GB" if gpu_memory is not None else "unknown"
+    host_text = f"{host_memory:.0f} GB" if host_memory is not None else "unknown"
+    source = "override" if override != "auto" else "auto"
+    print(f"VRAM profile: {profile.name} ({source}; GPU {gpu_text}, host {host_text}) -> "
+          f"{' '.join(profile.args())}, both experts resident: {profile.both_experts_resident}")
+    if not profile.both_experts_resident and host_memory is not None and host_memory < SWAP_HOST_RAM_GB:
+        print(f"Warning: {host_text} host memory cannot hold an offloaded expert; "
+              "expert swaps will re-read weights from disk")
+    return profile
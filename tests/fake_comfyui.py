@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""
+Minimal fake ComfyUI server for local tests.
+
+Implements just enough of the ComfyUI HTTP API (/prompt, /history, /queue,
+/system_stats, /upload/image, /view) for ComfyUIRunner to drive it without
+a GPU, over either transport. "Executing" a prompt writes a small
+placeholder file for every SaveVideo node into the output directory and
+records a matching history entry. With serial=True prompts run one at a
+time in queue order, as in ComfyUI, and POST /queue {"delete": [...]} and
+POST /interrupt remove pending prompts and stop the running one.
+
+Run as a script it serves as a separate process, e.g. for supervisor tests:
+POST /exit makes the process exit immediately with code 1, like a crash.
+
+    python tests/fake_comfyui.py --port 8188 --output-dir /tmp/out --execute-delay 2
+"""
+
+import argparse
+import email.parser
+import email.policy
+import json
+import os
+import threading
+import urllib.parse
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Any, List, Optional
+
+
+class FakeComfyUI:
+    """In-process fake ComfyUI server bound to an ephemeral port."""
+
+    def __init__(
+        self,
+        output_dir: str,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        execute_delay: float = 0.0,
+        input_dir: Optional[str] = None,
+        output_size: int = 0,
+        serial: bool = False
+    ):
+        """
+        Initialize fake server.
+
+        Args:
+            output_dir: Directory where fake SaveVideo outputs are written
+            host: Bind address
+            port: Bind port (0 picks a free port)
+            execute_delay: Seconds a prompt "runs" before its history appears
+            input_dir: Directory receiving /upload/image files (default: output_dir/input)
+            output_size: Pad fake outputs to this many bytes (exercises chunked /view reads)
+            serial: Run prompts one at a time in queue order (otherwise each
+                runs execute_delay after it was queued)
+        """
+        self.output_dir = output_dir
+        self.input_dir = input_dir or os.path.join(output_dir, "input")
+        self.execute_delay = execute_delay
+        self.output_size = output_size
+        self.prompts: List[Dict[str, Any]] = []
+        self.uploads: List[str] = []
+        self.history: Dict[str, Dict[str, Any]] = {}
+        self.deleted: List[str] = []
+        self.interrupted: List[str] = []
+        self.serial = serial
+        self.running: Optional[str] = None
+        self._pending: List[Any] = []  # (prompt_id, workflow) waiting to run
+        self._wakeup = threading.Condition()
+        self._interrupt = threading.Event()
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._thread = None
+
+    @property
+    def address(self) -> str:
+        """Server address in host:port form, as ComfyUIRunner expects."""
+        host, port = self._server.server_address[:2]
+        return f"{host}:{port}"
+
+    def start(self) -> "FakeComfyUI":
+        """Start serving in a daemon thread."""
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        if self.serial:
+            threading.Thread(target=self._run_queue, daemon=True).start()
+        return self
+
+    def serve_forever(self) -> None:
+        """Serve in the calling thread."""
+        self._server.serve_forever()
+
+    def stop(self) -> None:
+        """Stop the server."""
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _run_queue(self) -> None:
+        """Serial mode: execute pending prompts one at a time."""
+        while True:
+            with self._wakeup:
+                while not self._pending:
+                    self._wakeup.wait()
+                prompt_id, workflow = self._pending.pop(0)
+                self.running = prompt_id
+                self._interrupt.clear()
+            if self._interrupt.wait(self.execute_delay):
+                with self._lock:
+                    self.history[prompt_id] = {
+                        'prompt': [0, prompt_id, workflow, {}, []],
+                        'outputs': {},
+                        'status': {'status_str': 'error', 'completed': False,
+                                   'messages': [['execution_interrupted', {'prompt_id': prompt_id}]]}
+                    }
+            else:
+                self.execute(prompt_id, workflow)
+            with self._wakeup:
+                self.running = None
+
+    def queue_state(self) -> Dict[str, List[Any]]:
+        """Running and pending prompts in the /queue response format."""
+        with self._wakeup:
+            running = [[0, self.running, {}, {}, []]] if self.running else []
+            pending = [[i + 1, prompt_id, {}, {}, []] for i, (prompt_id, _) in enumerate(self._pending)]
+        return {'queue_running': running, 'queue_pending': pending}
+
+    def execute(self, prompt_id: str, workflow: Dict[str, Any]) -> None:
+        """Pretend to run a workflow: write one file per SaveVideo node."""
+        os.makedirs(self.output_dir, exist_ok=True)
+        outputs = {}
+        for node_id, node in workflow.items():
+            if node.get('class_type') not in ('SaveVideo', 'StreamingVAEDecodeSave'):
+                continue
+            filename = f"{node['inputs']['filename_prefix']}_00001_.mp4"
+            content = f"fake video for node {node_id}".encode('utf-8')
+            with open(os.path.join(self.output_dir, filename), 'wb') as f:
+                f.write(content.ljust(self.output_size, b'\0'))
+            outputs[node_id] = {
+                'images': [{'filename': filename, 'subfolder': '', 'type': 'output'}],
+                'animated': [True]
+            }
+
+        with self._lock:
+            self.history[prompt_id] = {
+                'prompt': [len(self.prompts), prompt_id, workflow, {}, list(outputs)],
+                'outputs': outputs,
+                'status': {'status_str': 'success', 'completed': True, 'messages': []}
+            }
+
+    def _make_handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _send_json(self, payload: Any, status: int = 200) -> None:
+                body = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _view_path(self) -> Optional[str]:
+                query = urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query)
+                base = fake.input_dir if query.get('type', ['output'])[0] == 'input' else fake.output_dir
+                filename = query.get('filename', [''])[0]
+                path = os.path.join(base, query.get('subfolder', [''])[0], filename)
+                if not filename or os.path.basename(filename) != filename or not os.path.isfile(path):
+                    return None
+                return path
+
+            def do_HEAD(self):
+                path = self._view_path() if self.path.startswith('/view') else None
+                self.send_response(200 if path else 404)
+                self.send_header('Content-Length', str(os.path.getsize(path)) if path else '0')
+                self.end_headers()
+
+            def do_GET(self):
+                path = self.path.split('?', 1)[0]
+                if path == '/view':
+                    file_path = self._view_path()
+                    if file_path is None:
+                        self._send_json({}, status=404)
+                        return
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'application/octet-stream')
+                    self.send_header('Content-Length', str(os.path.getsize(file_path)))
+                    self.end_headers()
+                    with open(file_path, 'rb') as f:
+                        for chunk in iter(lambda: f.read(64 * 1024), b''):
+                            self.wfile.write(chunk)
+                elif path.startswith('/history/'):
+                    prompt_id = path[len('/history/'):]
+                    with fake._lock:
+                        entry = fake.history.get(prompt_id)
+                    self._send_json({prompt_id: entry} if entry else {})
+                elif path == '/queue':
+                    self._send_json(fake.queue_state())
+                elif path == '/system_stats':
+                    self._send_json({'system': {'os': 'fake'}, 'devices': []})
+                else:
+                    self._send_json({}, status=404)
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                body = self.rfile.read(length)
+                if self.path == '/prompt':
+                    payload = json.loads(body)
+                    prompt_id = str(uuid.uuid4())
+                    with fake._lock:
+                        fake.prompts.append(payload)
+                    if fake.serial:
+                        with fake._wakeup:
+                            fake._pending.append((prompt_id, payload['prompt']))
+                            fake._wakeup.notify()
+                    elif fake.execute_delay > 0:
+                        threading.Timer(fake.execute_delay, fake.execute, (prompt_id, payload['prompt'])).start()
+                    else:
+                        fake.execute(prompt_id, payload['prompt'])
+                    self._send_json({'prompt_id': prompt_id, 'number': len(fake.prompts), 'node_errors': {}})
+                elif self.path == '/upload/image':
+                    message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+                        f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode('utf-8') + body
+                    )
+                    for part in message.iter_parts():
+                        if part.get_param('name', header='content-disposition') == 'image':
+                            filename = os.path.basename(part.get_filename())
+                            os.makedirs(fake.input_dir, exist_ok=True)
+                            with open(os.path.join(fake.input_dir, filename), 'wb') as f:
+                                f.write(part.get_payload(decode=True))
+                            with fake._lock:
+                                fake.uploads.append(filename)
+                            self._send_json({'name': filename, 'subfolder': '', 'type': 'input'})
+                            return
+                    self._send_json({}, status=400)
+                elif self.path == '/queue':
+                    delete = json.loads(body or b'{}').get('delete', [])
+                    with fake._wakeup:
+                        fake._pending = [entry for entry in fake._pending if entry[0] not in delete]
+                    with fake._lock:
+                        fake.deleted.extend(delete)
+                    self._send_json({})
+                elif self.path == '/interrupt':
+                    target = json.loads(body or b'{}').get('prompt_id')
+                    with fake._wakeup:
+                        running = fake.running
+                    if running and target in (None, running):
+                        with fake._lock:
+                            fake.interrupted.append(running)
+                        fake._interrupt.set()
+                    self._send_json({})
+                elif self.path == '/exit':
+                    self._send_json({})
+                    os._exit(1)
+                else:
+                    self._send_json({}, status=404)
+
+        return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake ComfyUI server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8188)
+    parser.add_argument("--output-dir", required=True)
+    parser.add_argument("--execute-delay", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = FakeComfyUI(args.output_dir, host=args.host, port=args.port, execute_delay=args.execute_delay)
+    print(f"Fake ComfyUI listening on {server.address}", flush=True)
+    server.serve_forever()
@@ -6,7 +6,10 @@ Tests all components without requiring GPU or ComfyUI server.
 
 import sys
 import os
+import io
 import json
+import base64
+import contextlib
 from PIL import Image
 
 # Add parent directory to path
@@ -250,6 +253,2472 @@ def test_workflow_api_format():
         return False
 
 
+def test_batch_scheduler():
+    """Test cross-job micro-batching against the fake ComfyUI server."""
+    print("\n=== Test 7: Batch Scheduler ===")
+
+    import asyncio
+    import shutil
+    import tempfile
+    import handler as worker
+    from src.batching import BatchScheduler
+    from tests.fake_comfyui import FakeComfyUI
+
+    try:
+        workdir = tempfile.mkdtemp()
+        fake = FakeComfyUI(output_dir=os.path.join(workdir, 'output')).start()
+        workflow_path = os.path.join(os.path.dirname(__file__), '..', 'workflows', 'wan22_14B_i2v_lightning.json')
+        runner = ComfyUIRunner(
+            server_address=fake.address,
+            workflow_path=workflow_path,
+            input_dir=os.path.join(workdir, 'input'),
+            output_dir=os.path.join(workdir, 'output'),
+            poll_interval=0.05
+        )
+        scheduler = BatchScheduler(runner, window_seconds=0.5, max_batch_size=3)
+
+        image_path = os.path.join(workdir, 'image.png')
+        Image.new('RGB', (64, 64), color='blue').save(image_path)
+
+        async def submit_all():
+            return await asyncio.wait_for(asyncio.gather(*(
+                scheduler.submit(
+                    prompt=f"prompt {index}", negative_prompt="neg",
+                    input_image_path=image_path,
+                    output_video_path=os.path.join(workdir, f"output_{index}"),
+                    width=512, height=512, frames=33, fps=16, cfg=1.0, steps=4
+                )
+                for index in range(3)
+            )), 10)
+
+        results = asyncio.run(submit_all())
+        fake.stop()
+
+        assert len(fake.prompts) == 1, f"Expected 1 merged prompt, got {len(fake.prompts)}"
+        merged = fake.prompts[0]['prompt']
+        save_nodes = [n for n in merged.values() if n['class_type'] == 'SaveVideo']
+        assert len(save_nodes) == 3, "Merged prompt should have one SaveVideo per job"
+        assert sum(1 for n in merged.values() if n['class_type'] == 'UNETLoader') == 2, "Loaders should be shared"
+        print(f"✓ 3 jobs merged into one prompt with {len(merged)} nodes")
+
+        for index in range(3):
+            assert os.path.basename(results[index]).startswith(f"output_{index}_"), "Outputs mixed up between jobs"
+        print("✓ Outputs split back to the originating jobs")
+
+        # Cancelling the job that opened the batch leaves the others in it
+        fake = FakeComfyUI(output_dir=os.path.join(workdir, 'output')).start()
+        runner.server_address = fake.address
+        scheduler = BatchScheduler(runner, window_seconds=0.5, max_batch_size=4)
+
+        async def cancel_leader():
+            started = [asyncio.Event() for _ in range(3)]
+            tasks = [
+                asyncio.create_task(scheduler.submit(
+                    prompt=f"prompt {index}", negative_prompt="neg", input_image_path=image_path,
+                    output_video_path=os.path.join(workdir, f"cancel_{index}"), started=started[index],
+                    width=512, height=512, frames=33, fps=16, cfg=1.0, steps=4
+                ))
+                for index in range(3)
+            ]
+            await asyncio.sleep(0.1)
+            tasks[0].cancel()
+            results = await asyncio.wait_for(asyncio.gather(*tasks, return_exceptions=True), 10)
+            return results, [event.is_set() for event in started]
+
+        try:
+            results, started = asyncio.run(cancel_leader())
+        finally:
+            fake.stop()
+        assert isinstance(results[0], asyncio.CancelledError), results
+        assert all(os.path.basename(results[i]).startswith(f"cancel_{i}_") for i in (1, 2)), results
+        assert started == [False, True, True], started
+        merged = fake.prompts[0]['prompt']
+        assert sum(1 for n in merged.values() if n['class_type'] == 'SaveVideo') == 2, "Cancelled job still batched"
+        print("✓ Cancelling the batch leader drops only its own job")
+
+        # Under RunPod's runner: a deadline job (never batched) holds the gate, two
+        # compatible jobs merge during the window and their batch waits for the gate
+        workdir_jobs = tempfile.mkdtemp()
+        fake = FakeComfyUI(output_dir=os.path.join(workdir_jobs, 'output'), execute_delay=0.8).start()
+        queued_before_done = []
+        execute = fake.execute
+
+        def record_execute(prompt_id, workflow):
+            queued_before_done.append(len(fake.prompts))
+            execute(prompt_id, workflow)
+
+        fake.execute = record_execute
+        try:
+            image = png_base64('orange')
+            jobs = [
+                {'id': 'd', 'input': {'prompt': 'first', 'image_base64': image, 'width': 64, 'height': 64, 'deadline_ms': 60000}},
+                {'id': 'x', 'input': {'prompt': 'second', 'image_base64': image, 'width': 64, 'height': 64}},
+                {'id': 'y', 'input': {'prompt': 'third', 'image_base64': image, 'width': 64, 'height': 64}},
+            ]
+            with patched(worker, **fake_comfyui_settings(fake, BATCH_WINDOW_MS=300, _batch_scheduler=None)):
+                timeline, job_results = run_with_runpod(worker.handler, jobs, delays=[0, 0.1, 0.2])
+        finally:
+            fake.stop()
+            shutil.rmtree(workdir_jobs, ignore_errors=True)
+        assert all('error' not in result for result in job_results.values()), job_results
+        assert len(fake.prompts) == 2, f"Expected the deadline job and one merged prompt, got {len(fake.prompts)}"
+        merged = fake.prompts[1]['prompt']
+        assert sum(1 for n in merged.values() if n['class_type'] == 'SaveVideo') == 2, "x and y should share a prompt"
+        assert queued_before_done[0] == 1, "The batch must not be queued while the gate is held"
+        d_queued = next(i for i, (owner, item) in enumerate(timeline) if owner == 'd' and item.get('type') == 'queued')
+        for job_id in ('x', 'y'):
+            assert [item for owner, item in timeline if owner == job_id][-1].get('video_base64'), job_id
+            generating = [i for i, (owner, item) in enumerate(timeline) if owner == job_id and item.get('stage') == 'generating']
+            assert len(generating) == 1 and generating[0] > d_queued, f"{job_id} not generating once its batch ran"
+        print("✓ Concurrent jobs merged under RunPod's runner; the batch waited for the gate")
+
+        # A merged prompt that times out is interrupted rather than left running
+        workdir_timeout = tempfile.mkdtemp()
+        fake = FakeComfyUI(output_dir=os.path.join(workdir_timeout, 'output'), execute_delay=5, serial=True).start()
+        try:
+            runner.server_address = fake.address
+            scheduler = BatchScheduler(runner, window_seconds=0.1, max_batch_size=2, timeout=0.2)
+
+            async def submit_timeout():
+                return await asyncio.gather(*(
+                    scheduler.submit(
+                        prompt=f"prompt {index}", negative_prompt="neg", input_image_path=image_path,
+                        output_video_path=os.path.join(workdir_timeout, f"output_{index}"),
+                        width=512, height=512, frames=33, fps=16, cfg=1.0, steps=4
+                    )
+                    for index in range(2)
+                ), return_exceptions=True)
+
+            errors = asyncio.run(submit_timeout())
+            assert all(isinstance(error, ComfyUIError) for error in errors), errors
+            assert len(fake.interrupted) == 1, f"Timed-out prompt not interrupted: {fake.interrupted}"
+            assert not fake.queue_state()['queue_pending'], "Prompt left in the ComfyUI queue"
+        finally:
+            fake.stop()
+            shutil.rmtree(workdir_timeout, ignore_errors=True)
+        print("✓ Timed-out batch interrupted in ComfyUI")
+
+        return True
+    except Exception as e:
+        print(f"✗ Batch scheduler test failed: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_prompt_variants():
+    """Test multi-prompt fan-out from a single input image."""
+    print("\n=== Test 8: Prompt Variants ===")
+
+    import tempfile
+    import time
+    from tests.fake_comfyui import FakeComfyUI
+
+    try:
+        # Validation accepts a prompt list with matching seeds
+        params = validate_input({
+            'prompts': ['wave', 'jump', 'wave'],
+            'seeds': [1, 2, 3],
+            'image_url': 'https://example.com/image.png'
+        })
+        assert params['prompts'] == ['wave', 'jump', 'wave'], "Prompts not normalized"
+        print("✓ Prompt list accepted")
+
+        try:
+            validate_input({'prompts': ['a', 'b'], 'seeds': [1], 'image_url': 'https://example.com/image.png'})
+            print("✗ Should have rejected mismatched seeds")
+            return False
+        except ValidationError:
+            print("✓ Mismatched seeds rejected")
+
+        workdir = tempfile.mkdtemp()
+        fake = FakeComfyUI(output_dir=os.path.join(workdir, 'output')).start()
+        workflow_path = os.path.join(os.path.dirname(__file__), '..', 'workflows', 'wan22_14B_i2v_lightning.json')
+        runner = ComfyUIRunner(
+            server_address=fake.address,
+            workflow_path=workflow_path,
+            input_dir=os.path.join(workdir, 'input'),
+            output_dir=os.path.join(workdir, 'output'),
+            poll_interval=0.05
+        )
+        image_path = os.path.join(workdir, 'image.png')
+        Image.new('RGB', (64, 64), color='green').save(image_path)
+
+        outputs = dict(runner.iter_variants(
+            prompts=params['prompts'], seeds=params['seeds'], negative_prompt='neg',
+            input_image_path=image_path, output_video_path=os.path.join(workdir, 'output_job')
+        ))
+        fake.stop()
+
+        assert len(os.listdir(os.path.join(workdir, 'input'))) == 1, "Image should be uploaded once"
+        queued_prompts = [p['prompt']['93']['inputs']['text'] for p in fake.prompts]
+        assert queued_prompts == ['jump', 'wave', 'wave'], f"Duplicate prompts not adjacent: {queued_prompts}"
+        assert fake.prompts[0]['prompt']['86']['inputs']['noise_seed'] == 2, "Seed not injected"
+        for index in range(3):
+            assert os.path.basename(outputs[index]).startswith(f"output_job_{index}_"), "Variant outputs mixed up"
+        print("✓ One upload, variants queued adjacently, outputs mapped back")
+
+        # A failed or abandoned fan-out stops the variants still in ComfyUI's queue
+        for mode in ('failed', 'abandoned'):
+            fake = FakeComfyUI(output_dir=os.path.join(workdir, 'output'), execute_delay=0.3, serial=True).start()
+            runner.server_address = fake.address
+            variants = runner.iter_variants(
+                prompts=['a', 'b', 'c'], seeds=[1, 2, 3], negative_prompt='neg',
+                input_image_path=image_path, output_video_path=os.path.join(workdir, f"output_{mode}")
+            )
+            next(variants)
+            if mode == 'failed':
+                def timed_out(prompt_id, timeout=600):
+                    raise ComfyUIError("Execution timed out after 600 seconds")
+
+                with patched(runner, wait_for_completion=timed_out):
+                    try:
+                        next(variants)
+                        raise AssertionError("Variant failure not raised")
+                    except ComfyUIError:
+                        pass
+            else:
+                variants.close()
+            time.sleep(0.4)
+            fake.stop()
+            assert len(fake.interrupted) == 1, f"{mode}: running variant not interrupted"
+            assert len(fake.deleted) == 2 and fake.interrupted[0] in fake.deleted, f"{mode}: {fake.deleted}"
+            assert len(fake.history) == 2, f"{mode}: a cancelled variant still ran"
+            print(f"✓ {mode.capitalize()} fan-out: running variant interrupted, pending variant deleted")
+
+        return True
+    except Exception as e:
+        print(f"✗ Prompt variants test failed: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_text_conditioning_cache():
+    """Test the text-conditioning cache node with a stub encoder (CPU only)."""
+    print("\n=== Test 9: Text Conditioning Cache ===")
+
+    try:
+        import torch
+    except ImportError:
+        print("- Skipped: torch not installed")
+        return True
+
+    import tempfile
+    from custom_nodes.wan_worker_nodes.tensor_cache import TensorCache
+    from custom_nodes.wan_worker_nodes.text_cache import encode_cached
+    from src.graph_rewrites import apply_rewrites
+    from src.input_validator import DEFAULT_NEGATIVE_PROMPT
+
+    try:
+        calls = []
+
+        def stub_encoder(text):
+            calls.append(text)
+            return [[torch.full((1, 4, 8), float(len(text))), {"pooled_output": None}]]
+
+        cache_dir = tempfile.mkdtemp()
+        cache = TensorCache(max_bytes=1024 * 1024, cache_dir=cache_dir)
+        first, first_hit = encode_cached(cache, 'umt5.safetensors', DEFAULT_NEGATIVE_PROMPT, stub_encoder)
+        second, second_hit = encode_cached(cache, 'umt5.safetensors', DEFAULT_NEGATIVE_PROMPT, stub_encoder)
+        assert len(calls) == 1, "Repeat prompt should not re-run the encoder"
+        assert (first_hit, second_hit) == (False, True), "Lookups should report miss then hit"
+        assert torch.equal(first[0][0], second[0][0]), "Cached conditioning differs"
+        print("✓ Repeat prompt served from memory")
+
+        encode_cached(cache, 'other_encoder.safetensors', DEFAULT_NEGATIVE_PROMPT, stub_encoder)
+        assert len(calls) == 2, "Different encoder file must miss the cache"
+        print("✓ Cache keyed by encoder file")
+
+        # Fresh process: memory is empty, disk still has the entry
+        restarted = TensorCache(max_bytes=1024 * 1024, cache_dir=cache_dir)
+        third, third_hit = encode_cached(restarted, 'umt5.safetensors', DEFAULT_NEGATIVE_PROMPT, stub_encoder)
+        assert len(calls) == 2 and third_hit and torch.equal(first[0][0], third[0][0]), "Disk entry not reused"
+        assert third[0][1] == {"pooled_output": None}, "Extras not restored"
+        print("✓ Conditioning restored from safetensors on disk")
+
+        workflow_path = os.path.join(os.path.dirname(__file__), '..', 'workflows', 'wan22_14B_i2v_lightning.json')
+        with open(workflow_path) as f:
+            wf = apply_rewrites(json.load(f), ['text_cache'])
+        assert wf['89']['class_type'] == 'CachedCLIPTextEncode', "Negative encode not rewritten"
+        assert wf['93']['inputs']['clip_name'] == wf['146']['inputs']['clip_name'], "Encoder name not wired"
+        print("✓ Workflow rewrite routes prompts through the cache")
+
+        return True
+    except Exception as e:
+        print(f"✗ Text conditioning cache test failed: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_start_image_latent_cache():
+    """Test the start-image latent cache with a stub VAE (CPU only)."""
+    print("\n=== Test 10: Start Image Latent Cache ===")
+
+    try:
+        import torch
+    except ImportError:
+        print("- Skipped: torch not installed")
+        return True
+
+    from custom_nodes.wan_worker_nodes.tensor_cache import TensorCache
+    from custom_nodes.wan_worker_nodes.latent_cache import encode_start_image_cached
+
+    try:
+        class StubVAE:
+            def __init__(self):
+                self.calls = 0
+
+            def encode(self, pixels):
+                self.calls += 1
+                # [frames, H, W, 3] -> [1, 16, latent_frames, H/8, W/8]
+                frames = ((pixels.shape[0] - 1) // 4) + 1
+                pooled = torch.nn.functional.avg_pool2d(pixels.movedim(-1, 1), 8).mean(dim=1)
+                return pooled[:frames].unsqueeze(0).unsqueeze(0).repeat(1, 16, 1, 1, 1)
+
+        def upscale_fn(samples, width, height):
+            return torch.nn.functional.interpolate(samples, size=(height, width), mode='bilinear')
+
+        vae = StubVAE()
+        image = torch.rand(1, 40, 24, 3)
+        cache = TensorCache(max_bytes=64 * 1024)
+
+        first, first_hit = encode_start_image_cached(cache, 'vae.safetensors', vae, image, 32, 32, 9, upscale_fn)
+        second, second_hit = encode_start_image_cached(cache, 'vae.safetensors', vae, image.clone(), 32, 32, 9, upscale_fn)
+        assert vae.calls == 1, "Same image content should hit the cache"
+        assert (first_hit, second_hit) == (False, True), "Lookups should report miss then hit"
+        assert torch.equal(first, second), "Cached latent differs"
+        print("✓ Repeat image served without VAE encode")
+
+        encode_start_image_cached(cache, 'vae.safetensors', vae, image, 32, 32, 17, upscale_fn)
+        encode_start_image_cached(cache, 'vae.safetensors', vae, image, 64, 32, 9, upscale_fn)
+        assert vae.calls == 3, "Length and size must be part of the key"
+        print("✓ Cache keyed by length and resolution")
+
+        for _ in range(20):
+            encode_start_image_cached(cache, 'vae.safetensors', vae, torch.rand(1, 40, 24, 3), 64, 64, 9, upscale_fn)
+        assert cache.size_bytes <= cache.max_bytes, "LRU exceeded its memory bound"
+        print(f"✓ LRU bounded at {cache.size_bytes} / {cache.max_bytes} bytes")
+
+        return True
+    except Exception as e:
+        print(f"✗ Latent cache test failed: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_dispatch_gate():
+    """Test cache-affinity ordering with a fairness bound, directly and through RunPod's job runner."""
+    print("\n=== Test 11: Dispatch Gate ===")
+
+    import asyncio
+    import shutil
+    import tempfile
+    import handler as worker
+    from src.dispatch import DispatchGate
+    from tests.fake_comfyui import FakeComfyUI
+
+    async def admission_order(max_skips):
+        gate = DispatchGate(window=4, max_skips=max_skips)
+        order = []
+        release = asyncio.Event()
+
+        async def job(name, image, hold=None):
+            async with gate.slot({'image': image}):
+                order.append(name)
+                if hold:
+                    await hold.wait()
+
+        tasks = [asyncio.create_task(job('a', 'x', release))]
+        await asyncio.sleep(0)
+        for name, image in [('b', 'y'), ('c', 'x'), ('d', 'x')]:
+            tasks.append(asyncio.create_task(job(name, image)))
+            await asyncio.sleep(0)
+        assert order == ['a'] and len(gate._waiters) == 3, (order, gate._waiters)
+        release.set()
+        await asyncio.wait_for(asyncio.gather(*tasks), 5)
+        return order
+
+    try:
+        order = asyncio.run(admission_order(max_skips=3))
+        assert order == ['a', 'c', 'd', 'b'], f"Unexpected order: {order}"
+        print(f"✓ Same-image jobs run back-to-back: {order}")
+
+        order = asyncio.run(admission_order(max_skips=1))
+        assert order == ['a', 'c', 'b', 'd'], f"Unexpected order: {order}"
+        print(f"✓ Fairness bound stops starvation: {order}")
+
+        # Through RunPod's job runner: while 'a' runs, the job sharing its image overtakes 'b'
+        workdir = tempfile.mkdtemp()
+        fake = FakeComfyUI(output_dir=os.path.join(workdir, 'output'), execute_delay=0.8).start()
+        try:
+            images = {'a': png_base64('red'), 'b': png_base64('green'), 'c': png_base64('red')}
+            jobs = [
+                {'id': name, 'input': {'prompt': 'a cat', 'image_base64': image, 'width': 64, 'height': 64}}
+                for name, image in images.items()
+            ]
+            with patched(worker, **fake_comfyui_settings(fake)):
+                timeline, results = run_with_runpod(worker.handler, jobs, delays=[0, 0.2, 0.4])
+        finally:
+            fake.stop()
+            shutil.rmtree(workdir, ignore_errors=True)
+        assert all('error' not in result for result in results.values()), results
+        order = [owner for owner, item in timeline if item.get('stage') == 'generating']
+        assert order == ['a', 'c', 'b'], f"Unexpected order: {order}"
+        print(f"✓ Handler jobs admitted by cache affinity under RunPod's runner: {order}")
+
+        return True
+    except Exception as e:
+        print(f"✗ Dispatch gate test failed: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_progress_events():
+    """Test progress event parsing and streamed workflow execution."""
+    print("\n=== Test 12: Progress Events ===")
+
+    import struct
+    import tempfile
+    from src.comfy_runner import parse_event
+    from tests.fake_comfyui import FakeComfyUI
+
+    try:
+        progress = parse_event(json.dumps({
+            'type': 'progress', 'data': {'value': 1, 'max': 2, 'prompt_id': 'p1', 'node': '86'}
+        }), 'p1')
+        assert progress == {'type': 'progress', 'node': '86', 'stage': 'sampling_high_noise', 'step': 1, 'total': 2}, progress
+        print(f"✓ Sampler step parsed: {progress['stage']} {progress['step']}/{progress['total']}")
+
+        other = parse_event(json.dumps({'type': 'progress', 'data': {'prompt_id': 'p2', 'node': '86'}}), 'p1')
+        assert other is None, "Messages for other prompts must be ignored"
+        done = parse_event(json.dumps({'type': 'executing', 'data': {'node': None, 'prompt_id': 'p1'}}), 'p1')
+        assert done == {'type': 'done'}, "End of execution not detected"
+        preview = parse_event(struct.pack('>II', 1, 1) + b'jpegdata', 'p1')
+        assert preview['type'] == 'preview' and preview['format'] == 'jpeg', "Preview frame not parsed"
+        print("✓ Foreign prompts ignored, completion and previews detected")
+
+        workdir = tempfile.mkdtemp()
+        fake = FakeComfyUI(output_dir=os.path.join(workdir, 'output')).start()
+        workflow_path = os.path.join(os.path.dirname(__file__), '..', 'workflows', 'wan22_14B_i2v_lightning.json')
+        runner = ComfyUIRunner(
+            server_address=fake.address,
+            workflow_path=workflow_path,
+            input_dir=os.path.join(workdir, 'input'),
+            output_dir=os.path.join(workdir, 'output'),
+            poll_interval=0.05
+        )
+        image_path = os.path.join(workdir, 'image.png')
+        Image.new('RGB', (64, 64), color='red').save(image_path)
+
+        stream = runner.stream_workflow(
+            prompt='wave', negative_prompt='neg', input_image_path=image_path,
+            output_video_path=os.path.join(workdir, 'output_stream')
+        )
+        events = []
+        try:
+            while True:
+                events.append(next(stream))
+        except StopIteration as stop:
+            output_path = stop.value
+
+        assert events and events[0]['type'] == 'queued', "First event should report the queued prompt"
+        assert os.path.basename(output_path).startswith('output_stream_'), "Wrong output path"
+        print(f"✓ Streamed workflow yielded {len(events)} event(s) and returned the output")
+
+        from websocket import WebSocketConnectionClosedException, WebSocketTimeoutException
+
+        class FakeSocket:
+            def __init__(self, *errors):
+                self.errors = list(errors)
+
+            def settimeout(self, timeout):
+                pass
+
+            def recv(self):
+                raise self.errors.pop(0)
+
+        prompt_id = events[0]['prompt_id']
+        # Timeouts poll history; a dropped connection ends progress without failing the job
+        for error in (WebSocketConnectionClosedException("closed"), ConnectionResetError("reset")):
+            socket = FakeSocket(WebSocketTimeoutException("timed out"), error)
+            assert list(runner.iter_progress(socket, 'missing-prompt')) == [] and not socket.errors
+        assert runner.wait_for_completion(prompt_id)['outputs'], "Polling should still find the result"
+        try:
+            list(runner.iter_progress(FakeSocket(ValueError("bad frame")), prompt_id))
+            print("✗ Unexpected receive errors must not be treated as timeouts")
+            return False
+        except ValueError:
+            pass
+        fake.stop()
+        print("✓ WebSocket timeouts poll history; dropped connections fall back to polling")
+
+        return True
+    except Exception as e:
+        print(f"✗ Progress events test failed: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_segment_chaining():
+    """Test long-video segment chaining against the fake ComfyUI server."""
+    print("\n=== Test 13: Segment Chaining ===")
+
+    import tempfile
+    from src.long_video import SegmentChainer
+    from tests.fake_comfyui import FakeComfyUI
+
+    try:
+        workdir = tempfile.mkdtemp()
+        fake = FakeComfyUI(output_dir=os.path.join(workdir, 'output')).start()
+        workflow_path = os.path.join(os.path.dirname(__file__), '..', 'workflows', 'wan22_14B_i2v_lightning.json')
+        runner = ComfyUIRunner(
+            server_address=fake.address,
+            workflow_path=workflow_path,
+            input_dir=os.path.join(workdir, 'input'),
+            output_dir=os.path.join(workdir, 'output'),
+            poll_interval=0.05
+        )
+        image_path = os.path.join(workdir, 'image.png')
+        Image.new('RGB', (64, 64), color='red').save(image_path)
+
+        # Stub media steps: ffmpeg is not needed to test the orchestration
+        calls = []
+
+        def extract_last_frame(video_path, frame_path):
+            calls.append(('extract', os.path.basename(video_path)))
+            with open(frame_path, 'w') as f:
+                f.write(f"last frame of {video_path}")
+            return frame_path
+
+        def remux(video_path, ts_path):
+            calls.append(('remux', os.path.basename(video_path)))
+            with open(ts_path, 'w') as f:
+                f.write(video_path)
+            return ts_path
+
+        def concat(parts, output_path):
+            calls.append(('concat', len(parts)))
+            with open(output_path, 'w') as f:
+                f.write("|".join(open(p).read() for p in parts))
+            return output_path
+
+        chainer = SegmentChainer(runner, extract_last_frame, remux, concat)
+        stream = chainer.run(
+            segments=3, prompt='walk', negative_prompt='neg', input_image_path=image_path,
+            output_video_path=os.path.join(workdir, 'output_long'), seed=10
+        )
+        events = []
+        try:
+            while True:
+                events.append(next(stream))
+        except StopIteration as stop:
+            output_path = stop.value
+        fake.stop()
+
+        assert len(fake.prompts) == 3, "Expected one prompt per segment"
+        start_images = [p['prompt']['137']['inputs']['image'] for p in fake.prompts]
+        assert len(set(start_images)) == 3, "Each segment should start from the previous last frame"
+        assert [p['prompt']['86']['inputs']['noise_seed'] for p in fake.prompts] == [10, 11, 12], "Seeds not offset"
+        print("✓ Each segment starts from the previous segment's last frame")
+
+        assert [c for c in calls if c[0] == 'extract'] == [('extract', 'output_long_seg0_00001_.mp4'), ('extract', 'output_long_seg1_00001_.mp4')]
+        assert calls[-1] == ('concat', 3), "Segments not concatenated"
+        assert sum(1 for e in events if e['type'] == 'segment_complete') == 3, "Missing segment events"
+        with open(output_path) as f:
+            assert f.read().count('_seg') == 3, "Concatenated output missing segments"
+        assert not [n for n in os.listdir(workdir) if n.endswith('.ts')], "Intermediates not cleaned up"
+        print("✓ Segments muxed, concatenated in order and intermediates removed")
+
+        return True
+    except Exception as e:
+        print(f"✗ Segment chaining test failed: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_frame_interpolation():
+    """Test CPU frame interpolation on the post-processing pool."""
+    print("\n=== Test 14: Frame Interpolation ===")
+
+    import shutil
+    import tempfile
+    from concurrent.futures import Future
+    import handler as worker
+    from src.media import run_ffmpeg, count_frames
+    from src.postprocess import submit_postprocess
+    from tests.fake_comfyui import FakeComfyUI
+
+    try:
+        # Fan-out variants report their frame counts like a single video does
+        # (the fake outputs cannot be probed, so delivered_frames is estimated)
+        def copy_postprocess(video_path, output_prefix, target_fps=None, profile=None):
+            future = Future()
+            shutil.copyfile(video_path, f"{output_prefix}.mp4")
+            future.set_result(f"{output_prefix}.mp4")
+            return future
+
+        workdir = tempfile.mkdtemp()
+        fake = FakeComfyUI(output_dir=os.path.join(workdir, 'output')).start()
+        try:
+            job = {'id': 'fan', 'input': {
+                'prompts': ['wave', 'jump'], 'image_base64': png_base64('olive'),
+                'width': 64, 'height': 64, 'frames': 33, 'fps': 16, 'target_fps': 48
+            }}
+            with patched(worker, **fake_comfyui_settings(fake, submit_postprocess=copy_postprocess)):
+                timeline, results = run_with_runpod(worker.handler, [job])
+        finally:
+            fake.stop()
+            shutil.rmtree(workdir, ignore_errors=True)
+        result = timeline[-1][1]
+        assert result['metadata']['generated_frames'] == 33, result['metadata']
+        assert result['metadata']['delivered_fps'] == 48, result['metadata']
+        assert [video['delivered_frames'] for video in result['videos']] == [99, 99], result['videos']
+        print("✓ Fan-out metadata reports generated and delivered frames per variant")
+
+        if not shutil.which('ffmpeg') or not shutil.which('ffprobe'):
+            print("- Skipped: ffmpeg not installed")
+            return True
+
+        workdir = tempfile.mkdtemp()
+        source = os.path.join(workdir, 'source.mp4')
+        run_ffmpeg(["-f", "lavfi", "-i", "testsrc=size=64x64:rate=16", "-frames:v", "33",
+                    "-c:v", "libx264", "-pix_fmt", "yuv420p", source])
+        assert count_frames(source) == 33, "Source clip should have 33 frames"
+
+        output = submit_postprocess(source, os.path.join(workdir, 'interpolated'), target_fps=48).result()
+        delivered = count_frames(output)
+        assert delivered is not None and 95 <= delivered <= 100, f"Unexpected delivered frame count: {delivered}"
+        print(f"✓ 33 frames @ 16 fps interpolated to {delivered} frames @ 48 fps")
+
+        assert submit_postprocess(source, os.path.join(workdir, 'noop')).result() == source, "No-op should pass through"
+        print("✓ No target_fps leaves the video untouched")
+
+        shutil.rmtree(workdir, ignore_errors=True)
+        return True
+    except Exception as e:
+        print(f"✗ Frame interpolation test failed: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_output_profiles():
+    """Test output encoding profiles on the post-processing pool."""
+    print("\n=== Test 15: Output Profiles ===")
+
+    import shutil
+    import tempfile
+    from src.input_validator import validate_input, ValidationError
+    from src.media import run_ffmpeg, count_frames
+    from src.postprocess import OUTPUT_PROFILES, submit_postprocess, output_mime_type
+
+    try:
+        base = {"image_url": "https://example.com/image.jpg", "prompt": "test"}
+        assert validate_input(base)['output_profile'] is None, "Default profile should keep SaveVideo output"
+        assert validate_input({**base, "output_profile": "webm-vp9"})['output_profile'] == "webm-vp9"
+        try:
+            validate_input({**base, "output_profile": "gif"})
+            print("✗ Unknown profile should be rejected")
+            return False
+        except ValidationError:
+            print("✓ Profile names validated")
+        assert output_mime_type(None) == "video/mp4" and output_mime_type("webm-vp9") == "video/webm"
+    except Exception as e:
+        print(f"✗ Output profile validation failed: {e}")
+        return False
+
+    if not shutil.which('ffmpeg') or not shutil.which('ffprobe'):
+        print("- Skipped encoding: ffmpeg not installed")
+        return True
+
+    try:
+        workdir = tempfile.mkdtemp()
+        source = os.path.join(workdir, 'source.mp4')
+        run_ffmpeg(["-f", "lavfi", "-i", "testsrc=size=128x128:rate=16", "-frames:v", "33",
+                    "-c:v", "libx264", "-crf", "0", "-pix_fmt", "yuv420p", source])
+        source_size = os.path.getsize(source)
+
+        futures = {
+            name: submit_postprocess(source, os.path.join(workdir, name), profile=name)
+            for name in OUTPUT_PROFILES
+        }
+        for name, future in futures.items():
+            try:
+                output = future.result()
+            except Exception as e:
+                # Builds without an encoder (e.g. libx265) can't produce every profile
+                print(f"- {name}: encoder unavailable ({e})")
+                continue
+            assert output.endswith("." + OUTPUT_PROFILES[name]['extension']), f"Wrong extension: {output}"
+            assert count_frames(output) == 33, f"{name} changed the frame count"
+            size = os.path.getsize(output)
+            assert size < source_size, f"{name} should be smaller than the lossless source"
+            print(f"✓ {name}: {source_size} -> {size} bytes")
+
+        combined = submit_postprocess(source, os.path.join(workdir, 'combined'), target_fps=32, profile='preview').result()
+        delivered = count_frames(combined)
+        assert delivered is not None and delivered > 33, "Interpolation and profile should apply in one pass"
+        print(f"✓ Interpolation + preview profile in one pass ({delivered} frames)")
+
+        shutil.rmtree(workdir, ignore_errors=True)
+        return True
+    except Exception as e:
+        print(f"✗ Output profile test failed: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_streaming_decode():
+    """Test chunked VAE decode into the encoder with a stub VAE (CPU only)."""
+    print("\n=== Test 16: Streaming Decode ===")
+
+    import json
+    from src.comfy_runner import ComfyUIRunner
+    from src.graph_rewrites import apply_rewrites
+
+    try:
+        with open('workflows/wan22_14B_i2v_lightning.json', 'r') as f:
+            workflow = apply_rewrites(json.load(f), ["streaming_decode"])
+        assert "87" not in workflow and "94" not in workflow, "Decode/CreateVideo should be fused"
+        assert workflow["108"]["class_type"] == "StreamingVAEDecodeSave"
+        assert workflow["108"]["inputs"]["samples"] == ["85", 0] and workflow["108"]["inputs"]["vae"] == ["143", 0]
+        injected = ComfyUIRunner().inject_parameters(
+            workflow, "p", "n", "in.png", "/tmp/output_abc", 512, 512, 33, 24, 1.0, 4
+        )
+        assert injected["108"]["inputs"]["fps"] == 24 and injected["108"]["inputs"]["filename_prefix"] == "output_abc"
+        print("✓ streaming_decode rewrite fuses nodes 87/94/108")
+    except Exception as e:
+        print(f"✗ Streaming decode rewrite failed: {e}")
+        return False
+
+    try:
+        import torch
+    except ImportError:
+        print("- Skipped: torch not installed")
+        return True
+
+    import shutil
+    import tempfile
+    from custom_nodes.wan_worker_nodes.streaming_decode import FrameEncoder, decode_to_encoder, to_uint8_frames
+
+    class StubVAE:
+        """Causal stand-in for the Wan VAE: 1 frame for latent 0, 4 per later latent, 8x spatial."""
+
+        def temporal_compression_decode(self):
+            return 4
+
+        def decode(self, latent):
+            x = latent.mean(dim=1)
+            x = torch.cat([x[:, :1], x[:, 1:].repeat_interleave(4, dim=1)], dim=1)
+            x = x.repeat_interleave(8, dim=2).repeat_interleave(8, dim=3)
+            return torch.sigmoid(x).unsqueeze(-1).expand(-1, -1, -1, -1, 3)
+
+    class CaptureEncoder:
+        def __init__(self):
+            self.chunks = []
+
+        def write(self, frames):
+            self.chunks.append(frames)
+
+    class WanVAEWrapper:
+        """The parts of comfy.sd.VAE the node uses, around a Wan VAE module on CPU."""
+
+        def __init__(self, model):
+            self.first_stage_model = model
+            self.vae_dtype = torch.float32
+            self.device = self.output_device = torch.device('cpu')
+
+        def process_output(self, image):
+            return image.add(1.0).div(2.0).clamp(0.0, 1.0)
+
+    sys.path.insert(1, os.getenv('COMFYUI_DIR', '/ComfyUI'))
+    try:
+        vae = StubVAE()
+        latent = torch.randn(1, 16, 9, 8, 8, generator=torch.Generator().manual_seed(0))
+        reference = (vae.decode(latent)[0].clamp(0, 1) * 255).round().to(torch.uint8)
+
+        capture = CaptureEncoder()
+        written = decode_to_encoder(vae, latent, capture, chunk_size=2)
+        streamed = torch.cat(capture.chunks)
+        assert written == 33 and streamed.shape == (33, 64, 64, 3), f"Unexpected frames: {tuple(streamed.shape)}"
+        assert torch.equal(streamed, reference), "One-pass decode should match VAE.decode"
+        assert max(c.shape[0] for c in capture.chunks) <= 8, "Encoder writes should stay small"
+        print(f"✓ Non-Wan VAE decoded in one pass, written in {len(capture.chunks)} chunks")
+
+        try:
+            from comfy.ldm.wan.vae import WanVAE
+        except ImportError:
+            WanVAE = None
+        if WanVAE is None:
+            print("- Skipped causal decode: ComfyUI's Wan VAE not importable")
+        else:
+            torch.manual_seed(0)
+            model = WanVAE(dim=16, z_dim=16).eval()
+            wan_vae = WanVAEWrapper(model)
+            wan_latent = torch.randn(1, 16, 7, 4, 4, generator=torch.Generator().manual_seed(1))
+            with torch.no_grad():
+                full = wan_vae.process_output(model.decode(wan_latent)).movedim(1, -1)
+            reference = to_uint8_frames(full).int()
+
+            capture = CaptureEncoder()
+            written = decode_to_encoder(wan_vae, wan_latent, capture, chunk_size=3)
+            streamed = torch.cat(capture.chunks).int()
+            assert written == 25 and streamed.shape == reference.shape, f"Unexpected frames: {tuple(streamed.shape)}"
+            assert [c.shape[0] for c in capture.chunks] == [9, 12, 4], "Chunks should follow the latent frames"
+            difference = (streamed - reference).abs().max().item()
+            assert difference <= 1, f"Chunked decode differs from WanVAE.decode by {difference}/255"
+            print(f"✓ 7 latent frames decoded in 3 chunks, within {difference}/255 of WanVAE.decode")
+
+        if not shutil.which('ffmpeg') or not shutil.which('ffprobe'):
+            print("- Skipped encoding: ffmpeg not installed")
+            return True
+
+        from src.media import count_frames
+        workdir = tempfile.mkdtemp()
+        encoder = FrameEncoder(os.path.join(workdir, 'streamed.mp4'), fps=16, queue_size=1)
+        decode_to_encoder(StubVAE(), latent, encoder, chunk_size=2)
+        output = encoder.close()
+        assert count_frames(output) == 33, "Encoded video should hold every decoded frame"
+        print("✓ Frames piped through a bounded queue into ffmpeg")
+
+        shutil.rmtree(workdir, ignore_errors=True)
+        return True
+    except Exception as e:
+        print(f"✗ Streaming decode test failed: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_metrics():
+    """Test the metrics registry, its exporters and runner instrumentation."""
+    print("\n=== Test 17: Metrics ===")
+
+    import tempfile
+    import urllib.request
+    from src.metrics import Registry, StageTimer, CACHE_REQUESTS, COMFYUI_PROMPT_SECONDS, cache_hit_ratio
+    from src.metrics import start_http_server, write_textfile
+    from tests.fake_comfyui import FakeComfyUI
+
+    try:
+        registry = Registry()
+        jobs = registry.counter("test_jobs_total", "Jobs", ("outcome",))
+        depth = registry.gauge("test_queue_depth", "Queue depth")
+        stage = registry.histogram("test_stage_seconds", "Stage time", ("stage",), buckets=(1, 5))
+        jobs.inc(outcome="success")
+        jobs.inc(2, outcome="validation_error")
+        depth.set_function(lambda: 3)
+        stage.observe(0.5, stage="generating")
+        stage.observe(7, stage="generating")
+
+        text = registry.render()
+        assert '# TYPE test_jobs_total counter' in text
+        assert 'test_jobs_total{outcome="validation_error"} 2' in text
+        assert 'test_queue_depth 3' in text
+        assert 'test_stage_seconds_bucket{stage="generating",le="1"} 1' in text
+        assert 'test_stage_seconds_bucket{stage="generating",le="+Inf"} 2' in text
+        assert 'test_stage_seconds_count{stage="generating"} 2' in text
+        print("✓ Counters, gauges and histograms render in Prometheus text format")
+
+        timer = StageTimer(stage)
+        timer.enter("validating")
+        timer.enter("encoding_output")
+        timer.finish()
+        assert stage.count(stage="validating") == 1 and stage.count(stage="encoding_output") == 1
+        print("✓ Stage timer records consecutive stages")
+
+        server = start_http_server(0, host="127.0.0.1", registry=registry)
+        body = urllib.request.urlopen(f"http://127.0.0.1:{server.server_address[1]}/metrics").read().decode('utf-8')
+        server.shutdown()
+        assert body == registry.render(), "HTTP exporter should serve the registry"
+        textfile = os.path.join(tempfile.mkdtemp(), 'worker.prom')
+        write_textfile(textfile, registry)
+        with open(textfile) as f:
+            assert 'test_jobs_total{outcome="success"} 1' in f.read()
+        print("✓ HTTP and textfile exporters")
+
+        workdir = tempfile.mkdtemp()
+        fake = FakeComfyUI(output_dir=os.path.join(workdir, 'output')).start()
+        workflow_path = os.path.join(os.path.dirname(__file__), '..', 'workflows', 'wan22_14B_i2v_lightning.json')
+        runner = ComfyUIRunner(
+            server_address=fake.address,
+            workflow_path=workflow_path,
+            input_dir=os.path.join(workdir, 'input'),
+            output_dir=os.path.join(workdir, 'output'),
+            poll_interval=0.05
+        )
+        image_path = os.path.join(workdir, 'image.png')
+        Image.new('RGB', (64, 64), color='blue').save(image_path)
+
+        hits_before = CACHE_REQUESTS.value(cache="input_image", result="hit")
+        prompts_before = COMFYUI_PROMPT_SECONDS.count()
+        for i in range(2):
+            runner.run_workflow(prompt='wave', negative_prompt='neg', input_image_path=image_path,
+                                output_video_path=os.path.join(workdir, f'output_{i}'))
+        assert runner.get_queue_depth() == 0
+        fake.stop()
+
+        assert CACHE_REQUESTS.value(cache="input_image", result="hit") == hits_before + 1, "Repeat upload should hit"
+        assert COMFYUI_PROMPT_SECONDS.count() == prompts_before + 2, "Prompt latency should be observed"
+        assert CACHE_REQUESTS.value(cache="comfyui_node", result="miss") > 0, "Executed nodes should count as misses"
+        print(f"✓ Runner reports uploads, node cache and prompt latency (input hit ratio {cache_hit_ratio('input_image'):.2f})")
+
+        def lookups(cache):
+            return CACHE_REQUESTS.value(cache=cache, result="hit"), CACHE_REQUESTS.value(cache=cache, result="miss")
+
+        text_before, latent_before = lookups("text_conditioning"), lookups("start_latent")
+        runner.record_completion("p2", {
+            "outputs": {
+                "93": {"tensor_cache": [{"cache": "text_conditioning", "result": "miss"}]},
+                "89": {"tensor_cache": [{"cache": "text_conditioning", "result": "hit"}]},
+                "98": {"tensor_cache": [{"cache": "start_latent", "result": "hit"}]},
+            },
+            "status": {"messages": [["execution_cached", {"nodes": ["89"], "prompt_id": "p2"}]]},
+        })
+        text_after, latent_after = lookups("text_conditioning"), lookups("start_latent")
+        assert text_after == (text_before[0], text_before[1] + 1), "Node-cached encodes made no new lookup"
+        assert latent_after == (latent_before[0] + 1, latent_before[1])
+        print("✓ Text-conditioning and start-latent lookups read from node UI outputs")
+        return True
+    except Exception as e:
+        print(f"✗ Metrics test failed: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_concurrency_controller():
+    """Test the load-aware concurrency controller with simulated signals."""
+    print("\n=== Test 18: Concurrency Controller ===")
+
+    import threading
+    import time
+    from src.concurrency import ConcurrencyController, LoadSignals, read_mem_available_mb
+    from src.cost_model import CostModel, job_units
+
+    try:
+        default_job = {'width': 512, 'height': 512, 'frames': 33, 'steps': 4, 'segments': 1, 'prompts': ['a']}
+        large_job = {**default_job, 'width': 1024, 'height': 1024, 'frames': 81}
+        assert job_units(default_job) == 1.0
+        model = CostModel(seconds_per_unit=35.0, alpha=0.5)
+        model.observe(default_job, 20.0)
+        model.observe(default_job, 30.0)
+        assert model.predict(default_job) == 25.0, "EWMA should blend observed GPU times"
+        print(f"✓ Cost model: large job predicted at {model.predict(large_job):.0f}s")
+
+        now = [0.0]
+        memory = [64000.0]
+        queue = [1]
+        controller = ConcurrencyController(
+            min_concurrency=1, max_concurrency=3,
+            low_backlog_seconds=60, high_backlog_seconds=180, hold_seconds=30,
+            job_memory_mb=3000, min_free_memory_mb=4000,
+            cost_model=model, queue_depth_fn=lambda: queue[0],
+            memory_fn=lambda: memory[0], clock=lambda: now[0]
+        )
+        assert controller.signals().queue_depth is None, "No queue depth before the first sample"
+        controller.sample_queue_depth()
+
+        controller.job_started('a', default_job)
+        assert controller(1) == 2, "Short backlog with a busy slot should raise intake"
+        controller.job_started('b', default_job)
+        now[0] = 5
+        assert controller(2) == 2, "Backlog between watermarks should hold"
+        controller.job_finished('b')
+        assert controller(2) == 2, "Raising again must wait for the dwell time"
+        print("✓ Raises on a short backlog, holds between watermarks and during dwell")
+
+        controller.job_started('b', large_job)
+        now[0] = 40
+        assert controller(2) == 1, "Backlog above the high watermark should lower intake"
+        controller.job_finished('b')
+        now[0] = 45
+        levels = [controller(1) for _ in range(10)]
+        assert levels == [1] * 10, f"Controller oscillated: {levels}"
+        print("✓ Lowers on a long backlog without oscillating")
+
+        now[0] = 100
+        queue[0] = 3
+        controller.sample_queue_depth()
+        assert controller(1) == 1, "A deep ComfyUI queue should block raising"
+        controller.queue_depth_fn = lambda: (_ for _ in ()).throw(RuntimeError("down"))
+        assert controller.sample_queue_depth() is None
+        assert controller.signals().queue_depth is None and controller(1) == 1, "Unknown queue depth should hold"
+        controller.queue_depth_fn = lambda: 0
+        controller.sample_queue_depth()
+        assert controller(1) == 2
+        memory[0] = 3000
+        now[0] = 101
+        assert controller(2) == 1, "Memory pressure should lower intake despite the dwell time"
+        print("✓ Queue depth and free memory gate intake")
+
+        signals = LoadSignals(queue_depth=0, backlog_seconds=0, free_memory_mb=None, in_flight=0)
+        assert controller.desired_change(signals) == 0, "Unused slots should not raise intake"
+        assert read_mem_available_mb('/nonexistent/meminfo') is None
+
+        # RunPod calls the modifier on its event loop: it must only read the sampled depth
+        slow_calls = []
+        sampled = threading.Event()
+
+        def slow_queue_depth():
+            slow_calls.append(threading.current_thread().name)
+            time.sleep(0.2)
+            sampled.set()
+            return 0
+
+        controller = ConcurrencyController(queue_depth_fn=slow_queue_depth, memory_fn=lambda: None)
+        start = time.perf_counter()
+        controller(1)
+        assert not slow_calls and time.perf_counter() - start < 0.05, "Modifier must not query ComfyUI"
+        controller.start_sampling(interval=0.05)
+        assert sampled.wait(2) and controller.signals().queue_depth == 0
+        assert slow_calls[0] == 'concurrency-sampler'
+        print("✓ Queue depth sampled on a background thread; the modifier reads the cache")
+        return True
+    except Exception as e:
+        print(f"✗ Concurrency controller test failed: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_comfyui_supervisor():
+    """Test crash detection and restart with a fake ComfyUI process."""
+    print("\n=== Test 19: ComfyUI Supervisor ===")
+
+    import socket
+    import tempfile
+    import threading
+    import time
+    import urllib.request
+    from src.supervisor import ComfyUISupervisor
+
+    supervisor = None
+    try:
+        workdir = tempfile.mkdtemp()
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]
+        address = f"127.0.0.1:{port}"
+
+        warmups = []
+        supervisor = ComfyUISupervisor(
+            command=[sys.executable, os.path.join(os.path.dirname(__file__), 'fake_comfyui.py'),
+                     '--port', str(port), '--output-dir', os.path.join(workdir, 'output'), '--execute-delay', '1.5'],
+            server_address=address,
+            log_path=os.path.join(workdir, 'comfyui.log'),
+            startup_timeout=15,
+            check_interval=0.1,
+            stats_timeout=1,
+            backoff_initial=0.1,
+            warmup_fn=lambda: warmups.append(time.time())
+        ).start()
+        assert supervisor.state == 'running' and len(warmups) == 1, "Start should warm up once"
+        first_pid = supervisor.pid
+        print(f"✓ ComfyUI started and warmed up (pid {first_pid})")
+
+        workflow_path = os.path.join(os.path.dirname(__file__), '..', 'workflows', 'wan22_14B_i2v_lightning.json')
+        runner = ComfyUIRunner(
+            server_address=address,
+            workflow_path=workflow_path,
+            input_dir=os.path.join(workdir, 'input'),
+            output_dir=os.path.join(workdir, 'output'),
+            poll_interval=0.05,
+            supervisor=supervisor
+        )
+        image_path = os.path.join(workdir, 'image.png')
+        Image.new('RGB', (64, 64), color='green').save(image_path)
+
+        def crash():
+            time.sleep(0.3)
+            try:
+                urllib.request.urlopen(urllib.request.Request(f"http://{address}/exit", data=b'{}'))
+            except Exception:
+                pass
+
+        threading.Thread(target=crash, daemon=True).start()
+        start = time.time()
+        try:
+            runner.run_workflow(prompt='wave', negative_prompt='neg', input_image_path=image_path,
+                                output_video_path=os.path.join(workdir, 'output_crash'))
+            print("✗ Job should fail when ComfyUI crashes")
+            return False
+        except ComfyUIError as e:
+            elapsed = time.time() - start
+            assert elapsed < 5, f"Crash took {elapsed:.1f}s to surface"
+            print(f"✓ In-flight job failed {elapsed:.1f}s after start: {e}")
+
+        supervisor.wait_ready(timeout=15)
+        assert supervisor.pid != first_pid and supervisor.restarts == 1, "ComfyUI should be restarted"
+        assert len(warmups) == 2, "Warm-up should re-run after a restart"
+        output = runner.run_workflow(prompt='wave', negative_prompt='neg', input_image_path=image_path,
+                                     output_video_path=os.path.join(workdir, 'output_after'))
+        assert os.path.exists(output), "Jobs should succeed after the restart"
+        print(f"✓ Restarted (pid {supervisor.pid}), warmed up and serving jobs again")
+        return True
+    except Exception as e:
+        print(f"✗ Supervisor test failed: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+    finally:
+        if supervisor is not None:
+            supervisor.stop()
+
+
+def test_vram_profile():
+    """Test VRAM profile selection with mocked memory detection."""
+    print("\n=== Test 20: VRAM Profile ===")
+
+    import subprocess
+    import tempfile
+    from src.vram_profile import detect_gpu_memory_gb, detect_host_memory_gb, resolve_profile, select_profile
+
+    try:
+        commands = []
+
+        def fake_nvidia_smi(output, returncode=0):
+            def run(cmd, **kwargs):
+                commands.append(cmd)
+                return subprocess.CompletedProcess(cmd, returncode, stdout=output.encode('utf-8'))
+            return run
+
+        assert detect_gpu_memory_gb(fake_nvidia_smi("81559\n"), visible_devices="2,3") == 81559 / 1024
+        assert commands[-1][-2:] == ["-i", "2"], f"Should query the first visible GPU: {commands[-1]}"
+        assert detect_gpu_memory_gb(fake_nvidia_smi("24564\n"), visible_devices="GPU-8d1f,GPU-77c2") == 24564 / 1024
+        assert commands[-1][-2:] == ["-i", "GPU-8d1f"]
+        with patched(os, environ=dict(os.environ, CUDA_VISIBLE_DEVICES="1")):
+            detect_gpu_memory_gb(fake_nvidia_smi("49140\n"))
+        assert commands[-1][-2:] == ["-i", "1"], "CUDA_VISIBLE_DEVICES should be read from the environment"
+        assert detect_gpu_memory_gb(fake_nvidia_smi("81559\n"), visible_devices="") is None, "No visible GPU"
+        assert detect_gpu_memory_gb(fake_nvidia_smi("", returncode=9), visible_devices="0") is None
+
+        def missing(cmd, **kwargs):
+            raise FileNotFoundError(cmd[0])
+
+        assert detect_gpu_memory_gb(missing, visible_devices="0") is None
+        meminfo = os.path.join(tempfile.mkdtemp(), 'meminfo')
+        with open(meminfo, 'w') as f:
+            f.write("MemTotal:       65838040 kB\nMemAvailable:   60000000 kB\n")
+        assert round(detect_host_memory_gb(meminfo)) == 63
+        print("✓ GPU and host memory detection (nvidia-smi and /proc/meminfo mocked)")
+
+        cases = {80: ("high", "--highvram", True), 48: ("normal", "--normalvram", True),
+                 24: ("low", "--normalvram", False), 16: ("minimal", "--lowvram", False)}
+        for gpu_gb, (name, flag, resident) in cases.items():
+            profile = select_profile(gpu_gb * 0.995)
+            assert (profile.name, profile.vram_flag, profile.both_experts_resident) == (name, flag, resident), \
+                f"{gpu_gb} GB selected {profile}"
+            assert '--reserve-vram' in profile.args()
+            assert ('--disable-smart-memory' in profile.args()) == (not resident), \
+                f"{name} should offload experts only when they are not resident: {profile.args()}"
+        assert select_profile(None).name == 'low', "Unknown GPUs should get a conservative profile"
+        print("✓ 80/48/24/16 GB cards map to high/normal/low/minimal")
+
+        assert select_profile(47.5, 128.0).name == 'normal'
+        assert select_profile(47.5, 32.0).name == 'high', "Small host memory should keep both experts on the GPU"
+        assert select_profile(23.9, 32.0).name == 'low', "Cards that cannot hold both experts still swap"
+        assert resolve_profile('auto', lambda: 47.5, lambda: 32.0).name == 'high'
+        print("✓ Host memory below 40 GB pins both experts on 48 GB cards")
+
+        assert resolve_profile('minimal', lambda: 80.0, lambda: 256.0).name == 'minimal', "Override should win"
+        assert resolve_profile('auto', lambda: 80.0, lambda: None).name == 'high'
+        try:
+            select_profile(80.0, override='huge')
+            print("✗ Unknown override should be rejected")
+            return False
+        except ValueError:
+            print("✓ Env override applied and validated")
+        return True
+    except Exception as e:
+        print(f"✗ VRAM profile test failed: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_step_cache():
+    """Test the step-output cache on a toy block stack (CPU only)."""
+    print("\n=== Test 21: Step Cache ===")
+
+    import json
+    from src.comfy_runner import ComfyUIRunner, summarize_step_cache
+    from src.input_validator import validate_input, ValidationError
+
+    try:
+        with open('workflows/wan22_14B_i2v_lightning.json', 'r') as f:
+            workflow = json.load(f)
+        runner = ComfyUIRunner()
+        plain = runner.inject_parameters(workflow, "p", "n", "in.png", "/tmp/output_abc", 512, 512, 33, 16, 1.0, 4)
+        assert "151" not in plain, "Threshold 0 should leave the graph unchanged"
+        cached = runner.inject_parameters(
+            workflow, "p", "n", "in.png", "/tmp/output_abc", 512, 512, 33, 16, 1.0, 4, step_cache_threshold=0.15
+        )
+        assert cached["86"]["inputs"]["model"] == ["151", 0] and cached["151"]["inputs"]["model"] == ["150", 0]
+        assert cached["85"]["inputs"]["model"] == ["152", 0] and cached["152"]["inputs"]["model"] == ["147", 0]
+        assert cached["153"]["class_type"] == "WanStepCacheStats" and cached["153"]["inputs"]["label"] == "output_abc"
+        assert cached["151"]["inputs"]["threshold"] == 0.15
+        print("✓ Per-job rewrite wraps nodes 147/150 and adds the stats node")
+
+        base = {'prompt': 'a cat', 'image_url': 'https://example.com/cat.png'}
+        assert validate_input(base)['step_cache_threshold'] == 0.0
+        assert validate_input(dict(base, step_cache_threshold=0.2))['step_cache_threshold'] == 0.2
+        try:
+            validate_input(dict(base, step_cache_threshold=2))
+            print("✗ Out-of-range threshold should be rejected")
+            return False
+        except ValidationError:
+            pass
+
+        runner.record_completion("p1", {"outputs": {"b0_153": {"step_cache": [
+            {"model": "high_noise", "label": "output_abc_seg0", "threshold": 0.15, "steps": 2, "skipped": 1},
+            {"model": "low_noise", "label": "output_abc_seg0", "threshold": 0.15, "steps": 2, "skipped": 0},
+        ]}}})
+        assert runner.pop_step_cache_stats("/tmp/output_abcd") is None, "Other jobs' labels must not match"
+        stats = runner.pop_step_cache_stats("/tmp/output_abc")
+        assert stats["steps"] == 4 and stats["skipped"] == 1 and stats["skip_rate"] == 0.25, stats
+        assert stats["by_model"]["high_noise"] == {"steps": 2, "skipped": 1}
+        assert runner.pop_step_cache_stats("/tmp/output_abc") is None and summarize_step_cache([]) is None
+        print(f"✓ Per-job statistics collected: {stats['skipped']}/{stats['steps']} steps skipped")
+    except Exception as e:
+        print(f"✗ Step cache wiring failed: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+    try:
+        import torch
+    except ImportError:
+        print("- Skipped: torch not installed")
+        return True
+
+    from custom_nodes.wan_worker_nodes.step_cache import StepCache, relative_l1
+
+    class ToyBlock(torch.nn.Module):
+        """Wan-like block: AdaLN-modulated residual MLP."""
+
+        def __init__(self, dim):
+            super().__init__()
+            self.norm1 = torch.nn.LayerNorm(dim, elementwise_affine=False)
+            self.modulation = torch.nn.Parameter(torch.randn(1, 6, dim) * 0.1)
+            self.linear = torch.nn.Linear(dim, dim)
+
+        def forward(self, x, e):
+            shift, scale = (self.modulation + e).chunk(6, dim=1)[:2]
+            return x + 0.1 * torch.tanh(self.linear(self.norm1(x) * (1 + scale) + shift))
+
+    class ToyDiT(torch.nn.Module):
+        """Runs blocks through "dit" block-replace patches like ComfyUI's Wan forward."""
+
+        def __init__(self, dim=16, depth=4):
+            super().__init__()
+            self.blocks = torch.nn.ModuleList(ToyBlock(dim) for _ in range(depth))
+
+        def forward(self, x, e, transformer_options):
+            patches = transformer_options.get("patches_replace", {}).get("dit", {})
+            for index, block in enumerate(self.blocks):
+                if ("double_block", index) in patches:
+                    def block_wrap(args, block=block):
+                        return {"img": block(args["img"], args["vec"])}
+                    args = {"img": x, "vec": e, "transformer_options": transformer_options}
+                    x = patches[("double_block", index)](args, {"original_block": block_wrap})["img"]
+                else:
+                    x = block(x, e)
+            return x
+
+    try:
+        torch.manual_seed(0)
+        model = ToyDiT()
+        x0, e0 = torch.randn(1, 8, 16), torch.randn(1, 6, 16)
+        sigmas = [1.0, 0.9, 0.8, 0.7]
+        # Slowly drifting inputs: each step changes the modulated input by ~1%
+        inputs = [(x0 + 0.01 * i * torch.randn(1, 8, 16), e0 * (1 + 0.01 * i)) for i in range(len(sigmas))]
+
+        def run(threshold):
+            cache = StepCache(threshold, len(model.blocks), first_block=model.blocks[0])
+            patches = {("double_block", i): cache.block_patch(i) for i in range(len(model.blocks))}
+            outputs = []
+            with torch.no_grad():
+                for (x, e), sigma in zip(inputs, sigmas):
+                    options = {"patches_replace": {"dit": patches}, "cond_or_uncond": [0], "sigmas": torch.tensor([sigma])}
+                    outputs.append(model(x, e, options))
+            return cache, outputs
+
+        with torch.no_grad():
+            reference = [model(x, e, {}) for x, e in inputs]
+
+        cache, outputs = run(0.0)
+        assert cache.stats()["skipped"] == 0 and all(torch.allclose(a, b) for a, b in zip(outputs, reference))
+        print("✓ Threshold 0 computes every step and matches the unpatched model")
+
+        cache, outputs = run(0.5)
+        stats = cache.stats()
+        assert stats["steps"] == 4 and stats["skipped"] == 3, stats
+        assert torch.allclose(outputs[0], reference[0]), "The first step must always be computed"
+        residual = reference[0] - inputs[0][0]
+        assert torch.allclose(outputs[1], inputs[1][0] + residual), "Skipped steps reuse the cached residual"
+        error = max(relative_l1(out, ref) for out, ref in zip(outputs, reference))
+        print(f"✓ Threshold 0.5 skips {stats['skipped']}/{stats['steps']} steps (max relative L1 error {error:.4f})")
+
+        cache, _ = run(0.001)
+        assert cache.stats()["skipped"] == 0, "Changes above a small threshold must be recomputed"
+
+        # A new sampling run (sigma rises again) resets residuals and statistics
+        cache, _ = run(0.5)
+        with torch.no_grad():
+            options = {"patches_replace": {"dit": {("double_block", i): cache.block_patch(i) for i in range(4)}},
+                       "cond_or_uncond": [0], "sigmas": torch.tensor([1.0])}
+            out = model(inputs[0][0], inputs[0][1], options)
+        stats = cache.stats()
+        assert (stats["steps"], stats["skipped"]) == (1, 0) and torch.allclose(out, reference[0]), stats
+        print("✓ New sampling run resets the cache and its statistics")
+        return True
+    except Exception as e:
+        print(f"✗ Step cache test failed: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_remote_transport():
+    """Test uploading and fetching files over ComfyUI's HTTP API against the fake server."""
+    print("\n=== Test 22: Remote Transport ===")
+
+    import base64
+    import shutil
+    import tempfile
+    from src.comfy_runner import ComfyUIRunner
+    from src.utils import encode_chunks_to_base64
+    from tests.fake_comfyui import FakeComfyUI
+
+    try:
+        data = bytes(range(256)) * 41
+        for size in (1, 2, 3, 1000, 4096):
+            chunks = [data[i:i + size] for i in range(0, len(data), size)]
+            assert encode_chunks_to_base64(chunks) == base64.b64encode(data).decode('utf-8'), size
+        print("✓ Chunked base64 matches whole-file encoding")
+
+        # The handler side shares no directories with the fake ComfyUI host
+        workdir = tempfile.mkdtemp()
+        fake = FakeComfyUI(
+            output_dir=os.path.join(workdir, 'gpu_host', 'output'),
+            input_dir=os.path.join(workdir, 'gpu_host', 'input'),
+            output_size=300 * 1024
+        ).start()
+        workflow_path = os.path.join(os.path.dirname(__file__), '..', 'workflows', 'wan22_14B_i2v_lightning.json')
+        runner = ComfyUIRunner(
+            server_address=fake.address,
+            workflow_path=workflow_path,
+            input_dir=os.path.join(workdir, 'missing_input'),
+            output_dir=os.path.join(workdir, 'missing_output'),
+            poll_interval=0.05,
+            transport="http",
+            download_dir=os.path.join(workdir, 'downloads'),
+            chunk_size=64 * 1024
+        )
+        image_path = os.path.join(workdir, 'image.png')
+        with open(image_path, 'wb') as f:
+            f.write(b'\x89PNG fake image bytes')
+
+        try:
+            first = runner.upload_image(image_path)
+            second = runner.upload_image(image_path)
+            assert first == second and fake.uploads == [first], fake.uploads
+            with open(os.path.join(fake.input_dir, first), 'rb') as f:
+                assert f.read() == b'\x89PNG fake image bytes'
+            print(f"✓ Image uploaded once via /upload/image (re-upload skipped): {first}")
+
+            output_path = runner.run_workflow(
+                prompt="p", negative_prompt="n", input_image_path=image_path,
+                output_video_path=os.path.join(workdir, 'output_remote')
+            )
+            assert output_path.startswith(os.path.join(workdir, 'downloads')), output_path
+            remote_path = os.path.join(fake.output_dir, os.path.basename(output_path))
+            with open(output_path, 'rb') as f, open(remote_path, 'rb') as g:
+                assert f.read() == g.read(), "Downloaded output differs from the remote file"
+            assert not os.path.exists(runner.output_dir), "The local output directory must not be used"
+            print(f"✓ Output streamed from /view to disk ({os.path.getsize(output_path)} bytes)")
+
+            stream = runner.stream_workflow(
+                prompt="p2", negative_prompt="n", input_image_path=image_path,
+                output_video_path=os.path.join(workdir, 'output_direct'), download=False
+            )
+            try:
+                while True:
+                    next(stream)
+            except StopIteration as stop:
+                url = stop.value
+            assert url.startswith(f"http://{fake.address}/view?"), url
+            ref = {'filename': 'output_direct_00001_.mp4', 'subfolder': '', 'type': 'output'}
+            with open(os.path.join(fake.output_dir, ref['filename']), 'rb') as f:
+                expected = base64.b64encode(f.read()).decode('utf-8')
+            assert encode_chunks_to_base64(runner.iter_output(ref)) == expected
+            assert not os.path.exists(os.path.join(runner.download_dir, ref['filename']))
+            print("✓ Output streamed from /view straight into base64 without touching disk")
+        finally:
+            fake.stop()
+            shutil.rmtree(workdir, ignore_errors=True)
+        return True
+    except Exception as e:
+        print(f"✗ Remote transport test failed: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_priority_scheduling():
+    """Test priority classes, deadline ordering and deadline drops in the dispatch gate."""
+    print("\n=== Test 23: Priority Scheduling ===")
+
+    import asyncio
+    import shutil
+    import tempfile
+    import time
+    import handler as worker
+    from src.comfy_runner import ComfyUIRunner
+    from src.dispatch import DispatchGate, DeadlineExceeded
+    from src.input_validator import validate_input, ValidationError
+    from tests.fake_comfyui import FakeComfyUI
+
+    async def wait_until(condition, timeout=5):
+        end = time.time() + timeout
+        while not condition() and time.time() < end:
+            await asyncio.sleep(0.01)
+        assert condition(), "Timed out waiting for the gate"
+
+    async def gate_scenarios():
+        gate = DispatchGate()
+        order = []
+        release = asyncio.Event()
+
+        async def job(name, priority, deadline=None, hold=None):
+            async with gate.slot({'image': name}, priority=priority, deadline=deadline):
+                order.append(name)
+                if hold:
+                    await hold.wait()
+
+        tasks = [asyncio.create_task(job('a', 'batch', None, release))]
+        await wait_until(lambda: order == ['a'])
+        for name, priority, deadline in [('b', 'batch', None), ('c', 'normal', None), ('d', 'normal', time.monotonic() + 60)]:
+            tasks.append(asyncio.create_task(job(name, priority, deadline)))
+            await wait_until(lambda: len(gate._waiters) == len(tasks) - 1)
+        release.set()
+        await asyncio.wait_for(asyncio.gather(*tasks), 5)
+        assert order == ['a', 'd', 'c', 'b'], f"Unexpected order: {order}"
+        print(f"✓ Class first, then earliest deadline: {order}")
+
+        # An interactive job runs alongside a lower-class holder; a second one waits for it
+        order.clear()
+        release_a, release_i = asyncio.Event(), asyncio.Event()
+        holder = asyncio.create_task(job('a', 'normal', None, release_a))
+        await wait_until(lambda: order == ['a'])
+        urgent = asyncio.create_task(job('i', 'interactive', None, release_i))
+        await wait_until(lambda: order == ['a', 'i'])
+        second = asyncio.create_task(job('j', 'interactive'))
+        await wait_until(lambda: len(gate._waiters) == 1)
+        assert order == ['a', 'i'], "Only one interactive job may bypass at a time"
+        release_i.set()
+        await wait_until(lambda: order == ['a', 'i', 'j'])
+        release_a.set()
+        await asyncio.wait_for(asyncio.gather(holder, urgent, second), 5)
+        print("✓ Interactive job admitted while a normal job holds the gate")
+
+        try:
+            async with gate.slot({}, deadline=time.monotonic() + 5, cost_seconds=30):
+                pass
+            raise AssertionError("Infeasible deadline should be dropped on arrival")
+        except DeadlineExceeded:
+            pass
+
+        release.clear()
+        holder = asyncio.create_task(job('h', 'normal', None, release))
+        await wait_until(lambda: 'h' in order)
+        start = time.monotonic()
+        try:
+            async with gate.slot({}, deadline=time.monotonic() + 0.4, cost_seconds=0.2):
+                pass
+            raise AssertionError("Waiting job should be dropped once its deadline is unreachable")
+        except DeadlineExceeded:
+            waited = time.monotonic() - start
+        assert 0.15 < waited < 1.0 and not gate._waiters, waited
+
+        # A job cancelled while waiting leaves the queue; the next one is still admitted
+        waiting = asyncio.create_task(job('x', 'normal'))
+        await wait_until(lambda: len(gate._waiters) == 1)
+        waiting.cancel()
+        await asyncio.gather(waiting, return_exceptions=True)
+        assert not gate._waiters, gate._waiters
+        release.set()
+        await asyncio.wait_for(holder, 5)
+        async with gate.slot({}):
+            pass
+        print(f"✓ Jobs dropped when predicted cost no longer fits (waited {waited:.2f}s)")
+
+        # A trickle of deadline jobs passes an ordinary job at most max_skips times
+        gate = DispatchGate(max_skips=2)
+        order.clear()
+        release.clear()
+        tasks = [asyncio.create_task(job('h', 'normal', None, release))]
+        await wait_until(lambda: order == ['h'])
+        for name, deadline in [('n', None), ('d1', 60), ('d2', 61), ('d3', 62)]:
+            tasks.append(asyncio.create_task(job(name, 'normal', deadline and time.monotonic() + deadline)))
+            await wait_until(lambda: len(gate._waiters) == len(tasks) - 1)
+        release.set()
+        await asyncio.wait_for(asyncio.gather(*tasks), 5)
+        assert order == ['h', 'd1', 'd2', 'n', 'd3'], f"Unexpected order: {order}"
+        print(f"✓ Deadline jobs cannot starve an ordinary job: {order}")
+
+    try:
+        base = {'prompt': 'a cat', 'image_url': 'https://example.com/cat.png'}
+        params = validate_input(dict(base, priority='interactive', deadline_ms=5000))
+        assert params['priority'] == 'interactive' and params['deadline_ms'] == 5000
+        assert validate_input(base)['priority'] == 'normal' and validate_input(base)['deadline_ms'] is None
+        for bad in ({'priority': 'urgent'}, {'deadline_ms': 0}, {'deadline_ms': 'soon'}):
+            try:
+                validate_input(dict(base, **bad))
+                print(f"✗ Invalid input accepted: {bad}")
+                return False
+            except ValidationError:
+                pass
+        print("✓ priority / deadline_ms validated")
+
+        asyncio.run(gate_scenarios())
+
+        workdir = tempfile.mkdtemp()
+        fake = FakeComfyUI(output_dir=os.path.join(workdir, 'output')).start()
+        try:
+            ComfyUIRunner(server_address=fake.address).queue_prompt({})
+            ComfyUIRunner(server_address=fake.address, front=True).queue_prompt({})
+            assert 'front' not in fake.prompts[0] and fake.prompts[1]['front'] is True
+        finally:
+            fake.stop()
+            shutil.rmtree(workdir, ignore_errors=True)
+        print("✓ Urgent runners queue at the front of ComfyUI's queue")
+
+        # The same policy for handler jobs under RunPod's runner, each predicted at 0.2s of GPU time
+        workdir = tempfile.mkdtemp()
+        fake = FakeComfyUI(output_dir=os.path.join(workdir, 'output'), execute_delay=1.0).start()
+        try:
+            image = png_base64('purple')
+            arrivals = [
+                ('hold', {'priority': 'batch'}, 0.0),
+                ('urgent', {'priority': 'interactive'}, 0.1),
+                ('b', {'priority': 'batch'}, 0.2),
+                ('n', {'priority': 'normal'}, 0.2),
+                ('d', {'priority': 'normal', 'deadline_ms': 60000}, 0.3),
+                ('late', {'priority': 'normal', 'deadline_ms': 500}, 0.3),
+            ]
+            jobs = [
+                {'id': name, 'input': dict(extra, prompt=f'prompt {name}', image_base64=image, width=64, height=64)}
+                for name, extra, _ in arrivals
+            ]
+            with patched(worker._concurrency.cost_model, predict=lambda params: 0.2), \
+                    patched(worker, **fake_comfyui_settings(fake)):
+                timeline, results = run_with_runpod(
+                    worker.handler, jobs, delays=[delay for _, _, delay in arrivals]
+                )
+            fronts = [bool(prompt.get('front')) for prompt in fake.prompts]
+        finally:
+            fake.stop()
+            shutil.rmtree(workdir, ignore_errors=True)
+        order = [owner for owner, item in timeline if item.get('stage') == 'generating']
+        assert order == ['hold', 'urgent', 'd', 'n', 'b'], f"Unexpected order: {order}"
+        assert fronts == [False, True, False, False, False], fronts
+        assert results['late'].get('error', '').startswith('handler: Deadline exceeded'), results['late']
+        assert all('error' not in results[name] for name in order), results
+        print(f"✓ Handler jobs under RunPod's runner: {order}, 'late' dropped while waiting")
+        return True
+    except Exception as e:
+        print(f"✗ Priority scheduling test failed: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_chunked_output():
+    """Test bounded-memory base64 chunking of output videos."""
+    print("\n=== Test 24: Chunked Output ===")
+
+    import base64
+    import hashlib
+    import shutil
+    import tempfile
+    import tracemalloc
+    import handler as worker
+    from src.input_validator import validate_input, ValidationError
+    from src.utils import iter_base64_chunks
+    from tests.fake_comfyui import FakeComfyUI
+
+    try:
+        base = {'prompt': 'a cat', 'image_url': 'https://example.com/cat.png'}
+        params = validate_input(dict(base, stream_output=True, output_chunk_size=65536))
+        assert params['stream_output'] is True and params['output_chunk_size'] == 65536
+        for bad in ({'stream_output': 'yes'}, {'output_chunk_size': 65537}, {'output_chunk_size': 1024}):
+            try:
+                validate_input(dict(base, **bad))
+                print(f"✗ Invalid input accepted: {bad}")
+                return False
+            except ValidationError:
+                pass
+        print("✓ stream_output / output_chunk_size validated")
+
+        workdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(workdir, 'video.mp4')
+            content = os.urandom(1024 * 1024 + 7)
+            with open(path, 'wb') as f:
+                f.write(content)
+
+            digest = hashlib.sha256()
+            chunks = list(iter_base64_chunks(path, chunk_size=65536, digest=digest))
+            assert all(len(chunk) == 65536 for chunk in chunks[:-1]), "Every chunk but the last must be full"
+            assert ''.join(chunks) == base64.b64encode(content).decode('utf-8')
+            assert b''.join(base64.b64decode(chunk) for chunk in chunks) == content, "Chunks must decode independently"
+            assert digest.hexdigest() == hashlib.sha256(content).hexdigest()
+            print(f"✓ {len(chunks)} ordered chunks reassemble the video and match its sha256")
+
+            # Peak memory is bounded by the chunk size, not the video length
+            with open(path, 'wb') as f:
+                for _ in range(32):
+                    f.write(os.urandom(1024 * 1024))
+            tracemalloc.start()
+            total = sum(len(chunk) for chunk in iter_base64_chunks(path, chunk_size=65536))
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            assert total == (32 * 1024 * 1024 + 2) // 3 * 4
+            assert peak < 1024 * 1024, f"Peak {peak} bytes grows with the video"
+            print(f"✓ 32 MB video streamed with {peak / 1024:.0f} KB peak allocation")
+
+            # Aggregation would keep every chunk: stream_output needs RETURN_AGGREGATE_STREAM=0
+            fake = FakeComfyUI(output_dir=os.path.join(workdir, 'comfyui'), output_size=300 * 1024).start()
+            try:
+                job = {'id': 'chunked', 'input': {
+                    'prompt': 'p', 'image_base64': png_base64('navy'), 'width': 64, 'height': 64,
+                    'stream_output': True, 'output_chunk_size': 65536
+                }}
+                with patched(worker, **fake_comfyui_settings(fake, RETURN_AGGREGATE_STREAM=True)):
+                    _, rejected = run_with_runpod(worker.handler, [job], return_aggregate_stream=True)
+                with patched(worker, **fake_comfyui_settings(fake, RETURN_AGGREGATE_STREAM=False)):
+                    timeline, accepted = run_with_runpod(worker.handler, [job], return_aggregate_stream=False)
+                remote = [entry.path for entry in os.scandir(fake.output_dir) if entry.is_file()][0]
+                with open(remote, 'rb') as f:
+                    expected = f.read()
+            finally:
+                fake.stop()
+            assert 'RETURN_AGGREGATE_STREAM=0' in rejected['chunked'].get('error', ''), rejected
+            chunks = [item['data'] for _, item in timeline if item.get('type') == 'video_chunk']
+            assert len(chunks) > 1 and base64.b64decode(''.join(chunks)) == expected
+            assert timeline[-1][1]['video_sha256'] == hashlib.sha256(expected).hexdigest()
+            assert accepted['chunked'] == {'output': []}, "Chunks must not be aggregated"
+            print(f"✓ stream_output rejected with aggregation on; {len(chunks)} chunks streamed without it")
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+        return True
+    except Exception as e:
+        print(f"✗ Chunked output test failed: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_input_preprocessing():
+    """Test CPU-side orientation, resize and crop/pad of input images."""
+    print("\n=== Test 25: Input Preprocessing ===")
+
+    import shutil
+    import tempfile
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+    import handler as worker
+    from src.input_validator import validate_input, ValidationError
+    from src.utils import fit_box, preprocess_image, submit_preprocess
+    from tests.fake_comfyui import FakeComfyUI
+
+    try:
+        base = {'prompt': 'a cat', 'image_url': 'https://example.com/cat.png'}
+        assert validate_input(base)['resize_mode'] == 'crop'
+        assert validate_input(dict(base, resize_mode='pad'))['resize_mode'] == 'pad'
+        try:
+            validate_input(dict(base, resize_mode='stretch'))
+            print("✗ Invalid resize_mode accepted")
+            return False
+        except ValidationError:
+            pass
+        print("✓ resize_mode validated")
+
+        assert fit_box((400, 200), (100, 100)) == (100.0, 0.0, 300.0, 200.0)
+        assert fit_box((200, 400), (200, 100)) == (0.0, 150.0, 200.0, 250.0)
+        assert fit_box((640, 480), (320, 240)) == (0.0, 0.0, 640.0, 480.0)
+        print("✓ Crop box is centered with the target aspect ratio")
+    except Exception as e:
+        print(f"✗ Input preprocessing test failed: {e}")
+        return False
+
+    try:
+        from PIL import Image
+        Image.Exif
+    except (ImportError, AttributeError):
+        print("- Skipped: Pillow not installed")
+        return True
+
+    workdir = tempfile.mkdtemp()
+    try:
+        # Landscape JPEG, red left half and blue right half, tagged "rotate 90° clockwise"
+        source = Image.new('RGB', (1600, 800), (0, 0, 255))
+        source.paste((255, 0, 0), (0, 0, 800, 800))
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        image_path = os.path.join(workdir, 'upload.jpg')
+        source.save(image_path, 'JPEG', exif=exif, quality=95)
+
+        def is_red(pixel):
+            return pixel[0] > 200 and pixel[2] < 60
+
+        def is_blue(pixel):
+            return pixel[2] > 200 and pixel[0] < 60
+
+        # Upright the image is portrait: red on top, blue below
+        cropped_path = submit_preprocess(image_path, os.path.join(workdir, 'crop'), 128, 128, 'crop').result()
+        with Image.open(cropped_path) as cropped:
+            assert cropped.size == (128, 128) and cropped.mode == 'RGB'
+            assert is_red(cropped.getpixel((64, 10))) and is_blue(cropped.getpixel((64, 118)))
+        print("✓ crop: EXIF orientation applied, center-cropped to 128x128")
+
+        padded_path = submit_preprocess(image_path, os.path.join(workdir, 'pad'), 128, 128, 'pad').result()
+        with Image.open(padded_path) as padded:
+            assert padded.size == (128, 128)
+            assert is_red(padded.getpixel((64, 10))) and is_blue(padded.getpixel((64, 118)))
+            assert padded.getpixel((5, 64)) == (0, 0, 0) and padded.getpixel((122, 64)) == (0, 0, 0)
+        print("✓ pad: whole image fitted and letterboxed to 128x128")
+
+        assert os.path.getsize(cropped_path) < os.path.getsize(image_path)
+        print(f"✓ Prepared input is {os.path.getsize(cropped_path)} bytes (upload {os.path.getsize(image_path)})")
+
+        broken_path = os.path.join(workdir, 'broken.jpg')
+        with open(broken_path, 'wb') as f:
+            f.write(b'not an image')
+        try:
+            submit_preprocess(broken_path, os.path.join(workdir, 'broken'), 128, 128).result()
+            print("✗ Undecodable image accepted")
+            return False
+        except ValueError:
+            print("✓ Undecodable image rejected")
+
+        # Under RunPod's runner, other jobs keep running while an image is prepared
+        pool = ThreadPoolExecutor(max_workers=1)
+
+        def slow_preprocess(*args):
+            return pool.submit(lambda: (time.sleep(0.8), preprocess_image(*args))[1])
+
+        fake = FakeComfyUI(output_dir=os.path.join(workdir, 'comfyui'), execute_delay=0.3).start()
+        try:
+            image = png_base64('yellow', size=(320, 200))
+            jobs = [
+                {'id': 'fit', 'input': {'prompt': 'p', 'image_base64': image, 'width': 64, 'height': 64}},
+                {'id': 'raw', 'input': {'prompt': 'p', 'image_base64': image, 'width': 64, 'height': 64, 'resize_mode': 'none'}},
+            ]
+            with patched(worker, **fake_comfyui_settings(fake, submit_preprocess=slow_preprocess)):
+                timeline, results = run_with_runpod(worker.handler, jobs, delays=[0, 0.1])
+        finally:
+            pool.shutdown()
+            fake.stop()
+        assert all('error' not in result for result in results.values()), results
+        finished = [owner for owner, item in timeline if 'type' not in item]
+        assert finished == ['raw', 'fit'], f"A job stalled behind preprocessing: {finished}"
+        print(f"✓ Preprocessing awaited off the event loop: finished {finished}")
+        return True
+    except Exception as e:
+        print(f"✗ Input preprocessing test failed: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def test_job_profiling():
+    """Test the opt-in per-job profiler."""
+    print("\n=== Test 26: Job Profiling ===")
+
+    import asyncio
+    import shutil
+    import tempfile
+    import src.profiling as profiling
+    from src.aio import run_blocking
+    from src.input_validator import validate_input, ValidationError
+
+    workdir = tempfile.mkdtemp()
+    allowlist = profiling.PROFILE_ALLOWLIST
+    try:
+        base = {'prompt': 'a cat', 'image_url': 'https://example.com/cat.png'}
+        profiling.PROFILE_ALLOWLIST = ()
+        assert validate_input(base)['profile'] is None
+        assert profiling.requested_mode(dict(base, profile='cpu')) is None, "Profiling must be off by default"
+        try:
+            validate_input(dict(base, profile='cpu'))
+            print("✗ Profiling accepted without an allowlist")
+            return False
+        except ValidationError:
+            pass
+        profiling.PROFILE_ALLOWLIST = ('cpu', 'full')
+        assert validate_input(dict(base, profile='full'))['profile'] == 'full'
+        for bad in ('memory', 'perf'):
+            try:
+                validate_input(dict(base, profile=bad))
+                print(f"✗ Invalid profile accepted: {bad}")
+                return False
+            except ValidationError:
+                pass
+        assert profiling.requested_mode(dict(base, profile='cpu')) == 'cpu'
+        print("✓ profile gated by PROFILE_ALLOWLIST")
+
+        def encode_output():
+            return [bytes(1024) for _ in range(2048)]
+
+        async def fake_job():
+            yield {"type": "status", "stage": "encoding_output"}
+            # Blocking work runs on a worker thread, as in run_job
+            buffers = await run_blocking(encode_output)
+            yield {"type": "status", "stage": "done"}
+            del buffers
+            yield {"video_base64": "AAAA", "metadata": {}}
+
+        def profiled(mode, label, **kwargs):
+            async def collect():
+                return [event async for event in profiling.profile_job(fake_job(), mode, label, output_dir=workdir, **kwargs)]
+            return asyncio.run(collect())
+
+        events = profiled('full', 'job-1', top=10)
+        assert [event.get('stage') for event in events[:2]] == ['encoding_output', 'done']
+        result = events[-1]
+        assert result['video_base64'] == "AAAA" and 'profile' in result
+        summary = result['profile']
+        assert any('encode_output' in row['function'] for row in summary['top_functions'])
+        assert summary['peak_memory_mb'] >= 2.0, summary['peak_memory_mb']
+        assert summary['top_allocations'] and summary['top_allocations'][0]['size_kb'] >= 2048
+        assert os.path.exists(summary['pstats']) and os.path.exists(summary['report'])
+        print(f"✓ full profile: {len(summary['top_functions'])} functions, "
+              f"{summary['peak_memory_mb']} MB peak, report {os.path.basename(summary['report'])}")
+
+        cpu_only = profiled('cpu', 'job-2')[-1]['profile']
+        assert 'top_functions' in cpu_only and 'top_allocations' not in cpu_only
+        print("✓ cpu profile skips tracemalloc")
+
+        # Only one job is profiled at a time; the other runs normally
+        with profiling._session:
+            skipped = profiled('cpu', 'job-3')
+        assert len(skipped) == 3 and skipped[-1]['profile']['skipped']
+        assert profiling._session.acquire(blocking=False), "Profiler lock leaked"
+        profiling._session.release()
+        print("✓ Concurrent profile request runs unprofiled")
+        return True
+    except Exception as e:
+        print(f"✗ Job profiling test failed: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+    finally:
+        profiling.PROFILE_ALLOWLIST = allowlist
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def test_lora_merge():
+    """Test the offline LoRA pre-merge tool on tiny synthetic safetensors."""
+    print("\n=== Test 27: LoRA Pre-merge ===")
+
+    import json
+    import shutil
+    import tempfile
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'scripts'))
+    import merge_lora
+
+    try:
+        workflow_dir = os.path.join(os.path.dirname(__file__), '..', 'workflows')
+        with open(os.path.join(workflow_dir, 'wan22_14B_i2v_lightning.json'), 'r', encoding='utf-8') as f:
+            workflow = json.load(f)
+        with open(os.path.join(workflow_dir, 'wan22_14B_i2v_lightning_merged.json'), 'r', encoding='utf-8') as f:
+            shipped = json.load(f)
+        merges = merge_lora.lora_merges(workflow)
+        assert [(m['lora_node'], m['unet_node']) for m in merges] == [('148', '144'), ('149', '145')]
+        variant = merge_lora.merged_workflow(workflow)
+        assert variant == shipped, "Shipped merged workflow is out of date"
+        assert '148' not in variant and '149' not in variant
+        assert variant['150']['inputs']['model'] == ['144', 0] and variant['147']['inputs']['model'] == ['145', 0]
+        assert variant['144']['inputs']['unet_name'].endswith('_lightx2v_4steps_merged.safetensors')
+        print("✓ Merged workflow loads fused UNets directly (nodes 148/149 removed)")
+    except Exception as e:
+        print(f"✗ LoRA merge test failed: {e}")
+        return False
+
+    try:
+        import torch
+    except ImportError:
+        print("- Skipped: torch not installed")
+        return True
+
+    workdir = tempfile.mkdtemp()
+    try:
+        torch.manual_seed(0)
+        fp8 = torch.float8_e4m3fn
+        q = torch.randn(16, 32) * 0.02
+        q_scale = q.abs().max() / 448
+        base = {
+            'scaled_fp8': torch.empty(0, dtype=fp8),
+            'model.diffusion_model.blocks.0.self_attn.q.weight': (q / q_scale).to(fp8),
+            'model.diffusion_model.blocks.0.self_attn.q.scale_weight': q_scale.reshape(1),
+            'model.diffusion_model.blocks.0.self_attn.q.bias': torch.randn(16).to(torch.bfloat16),
+            'model.diffusion_model.blocks.0.norm3.weight': torch.ones(32),
+            'model.diffusion_model.blocks.0.ffn.0.weight': torch.randn(8, 32).to(torch.bfloat16),
+        }
+        up, down = torch.randn(16, 4) * 0.1, torch.randn(4, 32) * 0.1
+        diff = torch.randn(32) * 0.01
+        diff_b = torch.randn(16) * 0.01
+        lora = {
+            'diffusion_model.blocks.0.self_attn.q.lora_up.weight': up.to(torch.bfloat16),
+            'diffusion_model.blocks.0.self_attn.q.lora_down.weight': down.to(torch.bfloat16),
+            'diffusion_model.blocks.0.self_attn.q.alpha': torch.tensor(2.0),
+            'diffusion_model.blocks.0.self_attn.q.diff_b': diff_b,
+            'diffusion_model.blocks.0.norm3.diff': diff,
+        }
+        base_path = os.path.join(workdir, 'base.safetensors')
+        lora_path = os.path.join(workdir, 'lora.safetensors')
+        merged_path = os.path.join(workdir, 'merged.safetensors')
+        merge_lora.save_tensors(base_path, base, {'format': 'pt'})
+        merge_lora.save_tensors(lora_path, lora)
+
+        stats = merge_lora.merge_file(base_path, lora_path, 0.8, merged_path)
+        assert stats['patched_tensors'] == 3 and stats['lora_modules'] == 2
+        assert os.path.getsize(merged_path) - os.path.getsize(base_path) < 512, "Tensor data must keep its size"
+
+        merged = merge_lora.SafetensorsFile(merged_path)
+        assert list(merged.tensors) == list(merge_lora.SafetensorsFile(base_path).tensors)
+        assert json.loads(merged.metadata['lora_merge'])['strength'] == 0.8 and merged.metadata['format'] == 'pt'
+        with open(merged_path, 'rb') as f:
+            result = {name: merged.read(f, name) for name in merged.tensors}
+
+        prefix = 'model.diffusion_model.blocks.0.'
+        expected_q = base[prefix + 'self_attn.q.weight'].float() * q_scale \
+            + 0.8 * (2.0 / 4) * (up.to(torch.bfloat16).float() @ down.to(torch.bfloat16).float())
+        actual_q = result[prefix + 'self_attn.q.weight'].float() * result[prefix + 'self_attn.q.scale_weight']
+        assert result[prefix + 'self_attn.q.weight'].dtype == fp8
+        assert torch.allclose(actual_q, expected_q, atol=float(q_scale) * 32, rtol=0.07), "fp8 merge out of tolerance"
+        assert torch.allclose(result[prefix + 'self_attn.q.bias'].float(),
+                              (base[prefix + 'self_attn.q.bias'].float() + 0.8 * diff_b).to(torch.bfloat16).float())
+        assert torch.allclose(result[prefix + 'norm3.weight'], torch.ones(32) + 0.8 * diff)
+        assert torch.equal(result[prefix + 'ffn.0.weight'], base[prefix + 'ffn.0.weight']), "Untouched tensor changed"
+        assert result['scaled_fp8'].numel() == 0
+        print("✓ fp8-scaled weight, bias and norm patches merged; other tensors copied unchanged")
+
+        # A LoRA that pushes weights past the fp8 range grows the scale instead of saturating
+        merge_lora.save_tensors(lora_path, {
+            'diffusion_model.blocks.0.self_attn.q.lora_up.weight': torch.ones(16, 1),
+            'diffusion_model.blocks.0.self_attn.q.lora_down.weight': torch.ones(1, 32),
+        })
+        stats = merge_lora.merge_file(base_path, lora_path, 1.0, merged_path)
+        with open(merged_path, 'rb') as f:
+            weight = merged.read(f, prefix + 'self_attn.q.weight').float()
+            scale = merged.read(f, prefix + 'self_attn.q.scale_weight')
+        assert stats['grown_fp8_scales'] == 1 and float(scale) > float(q_scale)
+        assert not torch.isnan(weight).any() and abs(float((weight * scale).mean()) - 1.0) < 0.05
+        print(f"✓ Overflowing merge grows scale_weight {float(q_scale):.2e} -> {float(scale):.2e}")
+
+        # Modules the base model lacks are skipped and counted, as ComfyUI does
+        merge_lora.save_tensors(lora_path, dict(lora, **{
+            'diffusion_model.blocks.0.cross_attn.k_img.lora_up.weight': torch.ones(16, 1),
+            'diffusion_model.blocks.0.cross_attn.k_img.lora_down.weight': torch.ones(1, 32),
+            'diffusion_model.blocks.0.norm3.diff_b': torch.ones(32),
+        }))
+        stats = merge_lora.merge_file(base_path, lora_path, 0.8, merged_path)
+        assert stats['patched_tensors'] == 3 and stats['lora_modules'] == 3, stats
+        assert stats['skipped_lora_modules'] == 2, stats
+        with open(merged_path, 'rb') as f:
+            assert torch.allclose(merged.read(f, prefix + 'norm3.weight'), torch.ones(32) + 0.8 * diff)
+        print("✓ LoRA modules missing from the base model skipped and counted")
+
+        try:
+            from safetensors.torch import load_file
+            assert set(load_file(merged_path)) == set(base)
+            print("✓ Output readable by safetensors")
+        except ImportError:
+            pass
+
+        # End to end from the workflow: merged files, manifest and workflow variant
+        models_dir = os.path.join(workdir, 'models')
+        os.makedirs(os.path.join(models_dir, 'diffusion_models'))
+        os.makedirs(os.path.join(models_dir, 'loras'))
+        for merge in merges:
+            shutil.copy(base_path, os.path.join(models_dir, 'diffusion_models', merge['unet_name']))
+            shutil.copy(lora_path, os.path.join(models_dir, 'loras', merge['lora_name']))
+        workflow_out = os.path.join(workdir, 'merged_workflow.json')
+        manifest = merge_lora.merge_workflow_loras(
+            os.path.join(workflow_dir, 'wan22_14B_i2v_lightning.json'), models_dir, workflow_out=workflow_out
+        )
+        assert [entry['merged'] for entry in manifest['models']] == \
+            [shipped['144']['inputs']['unet_name'], shipped['145']['inputs']['unet_name']]
+        for entry in manifest['models']:
+            assert os.path.exists(os.path.join(models_dir, 'diffusion_models', entry['merged']))
+        with open(os.path.join(models_dir, 'diffusion_models', merge_lora.MANIFEST_NAME), 'r') as f:
+            assert json.load(f) == manifest
+        with open(workflow_out, 'r', encoding='utf-8') as f:
+            assert json.load(f) == shipped
+        print("✓ Workflow merge writes both UNets, the manifest and the workflow variant")
+        return True
+    except Exception as e:
+        print(f"✗ LoRA merge test failed: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+SHARED_WEIGHTS_CHILD = r"""
+import gc
+import sys
+sys.path.insert(0, sys.argv[1])
+import torch
+from custom_nodes.wan_worker_nodes.shared_weights import map_safetensors
+
+
+def anonymous_kb():
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            if line.startswith("Anonymous:"):
+                return int(line.split()[1])
+
+
+before = anonymous_kb()
+tensors, _ = map_safetensors(sys.argv[2])
+if sys.argv[3] == "private":
+    # What a regular load does: one process-local copy of every tensor
+    tensors = {name: tensor.clone() for name, tensor in tensors.items()}
+    gc.collect()
+checksum = sum(float(tensor.sum()) for tensor in tensors.values())
+print(anonymous_kb() - before, flush=True)
+sys.stdin.read()
+"""
+
+
+def test_shared_weights():
+    """Test copy-on-write mapped model weights shared across processes (CPU only)."""
+    print("\n=== Test 28: Shared Weights ===")
+
+    if not os.path.exists('/proc/self/smaps_rollup'):
+        print("- Skipped: /proc/self/smaps_rollup not available")
+        return True
+    try:
+        import torch
+    except ImportError:
+        print("- Skipped: torch not installed")
+        return True
+
+    import shutil
+    import subprocess
+    import tempfile
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'scripts'))
+    from merge_lora import save_tensors
+    from custom_nodes.wan_worker_nodes.shared_weights import (
+        is_shared, load_state_dict_shared, map_safetensors, stage_file
+    )
+
+    def mapped_pss_kb(pid, path):
+        """Pss of a process's mappings of path, from /proc/<pid>/smaps."""
+        total = 0
+        in_mapping = False
+        with open(f'/proc/{pid}/smaps') as f:
+            for line in f:
+                fields = line.split()
+                if '-' in fields[0] and len(fields) >= 5:
+                    in_mapping = line.rstrip().endswith(path)
+                elif in_mapping and fields[0] == 'Pss:':
+                    total += int(fields[1])
+        return total
+
+    workdir = tempfile.mkdtemp()
+    root_dir = tempfile.mkdtemp()
+    children = []
+    try:
+        path = os.path.join(workdir, 'model.safetensors')
+        linear = torch.nn.Linear(32, 16)
+        save_tensors(path, {
+            'weight': linear.weight.detach().clone(),
+            'bias': linear.bias.detach().to(torch.bfloat16),
+            'empty': torch.empty(0, dtype=torch.float8_e4m3fn),
+        }, {'format': 'pt'})
+
+        tensors, metadata = map_safetensors(path)
+        assert metadata == {'format': 'pt'} and torch.equal(tensors['weight'], linear.weight.detach())
+        assert is_shared(tensors['weight']) and not is_shared(tensors['weight'].clone())
+        assert tensors['empty'].numel() == 0
+        tensors['weight'].add_(1.0)
+        assert torch.equal(map_safetensors(path)[0]['weight'], linear.weight.detach()), \
+            "In-place writes must stay private to the mapping"
+        print("✓ Tensors view a copy-on-write mapping of the file")
+
+        load_state_dict = load_state_dict_shared(torch.nn.Module.load_state_dict)
+        module = torch.nn.Linear(32, 16)
+        tensors, _ = map_safetensors(path)
+        load_state_dict(module, tensors, strict=False)
+        assert module.weight.data_ptr() == tensors['weight'].data_ptr(), "Matching tensor must be assigned"
+        assert not is_shared(module.bias) and module.bias.dtype == torch.float32, "bf16 bias must be converted"
+        assert not is_shared(module.to(torch.float16).weight), "Moving the weight must copy it"
+        try:
+            load_state_dict(torch.nn.Linear(32, 16), {'weight': map_safetensors(path)[0]['weight']})
+            print("✗ Missing key accepted with strict=True")
+            return False
+        except RuntimeError:
+            pass
+        print("✓ load_state_dict assigns matching mapped tensors and copies the rest")
+
+        staged = stage_file(path, os.path.join(workdir, 'shm'))
+        mtime = os.stat(staged).st_mtime_ns
+        assert stage_file(path, os.path.join(workdir, 'shm')) == staged and os.stat(staged).st_mtime_ns == mtime
+        with open(path, 'rb') as a, open(staged, 'rb') as b:
+            assert a.read() == b.read()
+        print("✓ Staged once into the shared directory")
+
+        # install() routes CPU safetensors loads under the model roots through the mapping
+        import types
+        from custom_nodes.wan_worker_nodes import shared_weights
+        comfy = types.ModuleType('comfy')
+        comfy.utils = types.ModuleType('comfy.utils')
+        comfy.utils.load_torch_file = lambda ckpt, safe_load=False, device=None, return_metadata=False: 'original'
+        comfy.model_base = types.ModuleType('comfy.model_base')
+
+        class BaseModel:
+            def __init__(self):
+                self.diffusion_model = torch.nn.Linear(32, 16)
+
+            def load_model_weights(self, sd, unet_prefix=""):
+                return self.diffusion_model.load_state_dict(sd, strict=False)
+
+        comfy.model_base.BaseModel = BaseModel
+        saved_modules = {name: sys.modules.get(name) for name in ('comfy', 'comfy.utils', 'comfy.model_base')}
+        original_load_state_dict = torch.nn.Module.load_state_dict
+        sys.modules.update({'comfy': comfy, 'comfy.utils': comfy.utils, 'comfy.model_base': comfy.model_base})
+        try:
+            shared_weights.install(roots=[workdir], stage_dir='')
+            load_torch_file = comfy.utils.load_torch_file
+            assert is_shared(load_torch_file(path)['weight'])
+            assert load_torch_file(path, return_metadata=True)[1] == {'format': 'pt'}
+            assert load_torch_file(path, device=torch.device('cuda')) == 'original'
+            assert load_torch_file(os.path.join(workdir, 'model.ckpt')) == 'original'
+            assert load_torch_file(os.path.join(root_dir, 'model.safetensors')) == 'original'
+            model = BaseModel()
+            model.load_model_weights(load_torch_file(path))
+            assert is_shared(model.diffusion_model.weight), "UNet load must assign mapped tensors"
+            assert 'load_state_dict' not in vars(model.diffusion_model), "Wrapper must not outlive the load"
+            assert torch.nn.Module.load_state_dict is original_load_state_dict, "Module patched process-wide"
+            module = torch.nn.Linear(32, 16)
+            module.load_state_dict(load_torch_file(path), strict=False)
+            assert not is_shared(module.weight), "Loads outside the UNet path must copy"
+        finally:
+            torch.nn.Module.load_state_dict = original_load_state_dict
+            for name, saved in saved_modules.items():
+                if saved is None:
+                    sys.modules.pop(name, None)
+                else:
+                    sys.modules[name] = saved
+        print("✓ install() patches load_torch_file for model files and assigns only in UNet loads")
+
+        # Host memory as processes are added: 64 MB of weights per file
+        big_path = os.path.join(workdir, 'big.safetensors')
+        save_tensors(big_path, {f'blocks.{i}.weight': torch.randn(1024, 4096) for i in range(4)})
+        size_kb = os.path.getsize(big_path) // 1024
+        root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+        def start(mode):
+            child = subprocess.Popen(
+                [sys.executable, '-c', SHARED_WEIGHTS_CHILD, root, big_path, mode],
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True
+            )
+            children.append(child)
+            return int(child.stdout.readline())
+
+        for count in range(1, 5):
+            anonymous = start('shared')
+            total_pss = sum(mapped_pss_kb(child.pid, big_path) for child in children)
+            print(f"  {count} process(es): +{anonymous} KB private each, {total_pss / 1024:.1f} MB weights in total")
+            assert anonymous < size_kb * 0.1, f"Process copied the weights ({anonymous} KB)"
+            assert total_pss < size_kb * 1.1, f"Weights counted {total_pss} KB for {count} processes"
+        private = start('private')
+        assert private > size_kb * 0.9, f"Private load only allocated {private} KB"
+        print(f"✓ Shared weights stay at {size_kb / 1024:.0f} MB as processes are added "
+              f"(a private load adds {private / 1024:.0f} MB per process)")
+        return True
+    except Exception as e:
+        print(f"✗ Shared weights test failed: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+    finally:
+        for child in children:
+            child.stdin.close()
+            child.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+        shutil.rmtree(root_dir, ignore_errors=True)
+
+
+@contextlib.contextmanager
+def patched(module, **attrs):
+    """Temporarily set module attributes (e.g. the handler's settings)."""
+    saved = {name: getattr(module, name) for name in attrs}
+    for name, value in attrs.items():
+        setattr(module, name, value)
+    try:
+        yield module
+    finally:
+        for name, value in saved.items():
+            setattr(module, name, value)
+
+
+def png_base64(color, size=(96, 64)):
+    """Base64 PNG of a solid color, as sent in a job's image_base64."""
+    buffer = io.BytesIO()
+    Image.new('RGB', size, color=color).save(buffer, format='PNG')
+    return base64.b64encode(buffer.getvalue()).decode('utf-8')
+
+
+def fake_comfyui_settings(fake, **extra):
+    """Handler settings that point the worker at a FakeComfyUI over HTTP, with a fresh gate."""
+    from src.dispatch import DispatchGate
+
+    return dict(
+        COMFYUI_SERVER=fake.address,
+        COMFYUI_TRANSPORT='http',
+        COMFYUI_POLL_INTERVAL=0.05,
+        WORKFLOW_PATH=os.path.join(os.path.dirname(__file__), '..', 'workflows', 'wan22_14B_i2v_lightning.json'),
+        _dispatch_gate=DispatchGate(),
+        **extra
+    )
+
+
+def run_with_runpod(handler_fn, jobs, delays=None, timeout=30, **config):
+    """
+    Run jobs concurrently through RunPod's job runner, as its JobScaler does.
+
+    RunPod's HTTP reporting is replaced by capture: every item a job streams
+    and the final result it sends are recorded instead.
+
+    Args:
+        handler_fn: Handler passed to runpod.serverless.start
+        jobs: Job dicts ({"id", "input"})
+        delays: Seconds to wait before starting each job (default: all at once)
+        timeout: Seconds before the run is aborted
+        **config: Extra worker config (e.g. return_aggregate_stream)
+
+    Returns:
+        Tuple of (timeline of (job ID, streamed item), {job ID: final result})
+    """
+    import asyncio
+    from runpod.serverless.modules import rp_job
+
+    timeline = []
+    results = {}
+
+    async def stream_result(session, job_data, job):
+        timeline.append((job['id'], job_data['output']))
+
+    async def send_result(session, job_data, job, is_stream=False):
+        results[job['id']] = job_data
+
+    async def run(job, delay):
+        await asyncio.sleep(delay)
+        await rp_job.handle_job(None, dict(config, handler=handler_fn, rp_args={}), job)
+
+    async def run_all():
+        runs = [run(job, delay) for job, delay in zip(jobs, delays or [0] * len(jobs))]
+        await asyncio.wait_for(asyncio.gather(*runs), timeout)
+
+    original = rp_job.stream_result, rp_job.send_result
+    rp_job.stream_result, rp_job.send_result = stream_result, send_result
+    try:
+        asyncio.run(run_all())
+    finally:
+        rp_job.stream_result, rp_job.send_result = original
+    return timeline, results
+
+
+def test_runpod_concurrency():
+    """Test that concurrent jobs run interleaved on RunPod's event loop."""
+    print("\n=== Test 29: RunPod Concurrency ===")
+
+    import shutil
+    import tempfile
+    import handler as worker
+    from tests.fake_comfyui import FakeComfyUI
+
+    workdir = tempfile.mkdtemp()
+    fake = FakeComfyUI(output_dir=os.path.join(workdir, 'output'), execute_delay=0.5).start()
+    try:
+        image = png_base64('blue')
+        jobs = [
+            {'id': name, 'input': {'prompt': f'prompt {name}', 'image_base64': image, 'width': 64, 'height': 64}}
+            for name in ('job-a', 'job-b')
+        ]
+
+        with patched(worker, **fake_comfyui_settings(fake)):
+            timeline, results = run_with_runpod(worker.handler, jobs)
+
+        for job in jobs:
+            outputs = [item for job_id, item in timeline if job_id == job['id']]
+            assert 'error' not in results[job['id']], results[job['id']]
+            assert outputs[-1].get('video_base64'), outputs[-1]
+        assert len(fake.prompts) == 2, fake.prompts
+
+        def position(job_id, predicate):
+            return next(i for i, (owner, item) in enumerate(timeline) if owner == job_id and predicate(item))
+
+        # Whichever job got the gate first, the other kept streaming while it ran
+        first, second = [owner for owner, item in timeline if item.get('stage') == 'generating']
+        assert position(second, lambda item: item.get('stage') == 'waiting_for_gpu') < position(
+            first, lambda item: 'video_base64' in item), "The waiting job stalled while the other ran"
+        assert position(first, lambda item: 'video_base64' in item) < position(
+            second, lambda item: 'video_base64' in item)
+        print(f"✓ Two jobs ran concurrently on one event loop ({len(timeline)} events, {first} first)")
+        return True
+    except Exception as e:
+        print(f"✗ RunPod concurrency test failed: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+    finally:
+        fake.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def test_failed_jobs():
+    """Test that error results fail the job in RunPod instead of completing it."""
+    print("\n=== Test 30: Failed Jobs ===")
+
+    import handler as worker
+    from src.metrics import JOBS
+
+    try:
+        jobs = [
+            {'id': 'no-image', 'input': {'prompt': 'a cat'}},
+            {'id': 'bad-image', 'input': {'prompt': 'a cat', 'image_base64': 'bm90IGFuIGltYWdl'}},
+        ]
+        before = {outcome: JOBS.value(outcome=outcome) for outcome in ('validation_error', 'image_processing_error')}
+        timeline, results = run_with_runpod(worker.handler, jobs, return_aggregate_stream=True)
+
+        for job_id, message in (('no-image', 'Validation error'), ('bad-image', 'Image processing error')):
+            streamed = [item for owner, item in timeline if owner == job_id]
+            assert message in results[job_id].get('error', ''), results[job_id]
+            assert 'output' not in results[job_id], "A failed job must not carry an output"
+            assert streamed[-1] == {'type': 'status', 'stage': 'failed'}, streamed[-1]
+            assert not any('error' in item for item in streamed), "Errors must not be streamed as output"
+        print("✓ Error results raise, so RunPod reports the jobs as FAILED")
+
+        assert JOBS.value(outcome='validation_error') == before['validation_error'] + 1
+        assert JOBS.value(outcome='image_processing_error') == before['image_processing_error'] + 1
+        print("✓ wan_jobs_total counts them by outcome")
+        return True
+    except Exception as e:
+        print(f"✗ Failed jobs test failed: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_postprocess_concurrency():
+    """Test that jobs keep running while another job's video is post-processed."""
+    print("\n=== Test 31: Post-processing Concurrency ===")
+
+    import shutil
+    import tempfile
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+    import handler as worker
+    from tests.fake_comfyui import FakeComfyUI
+
+    pool = ThreadPoolExecutor(max_workers=2)
+
+    def slow_postprocess(video_path, output_prefix, target_fps=None, profile=None):
+        """Stand-in for the ffmpeg pool: 0.8s of CPU work per video."""
+        def work():
+            time.sleep(0.8)
+            shutil.copyfile(video_path, f"{output_prefix}.mp4")
+            return f"{output_prefix}.mp4"
+        return pool.submit(work)
+
+    workdir = tempfile.mkdtemp()
+    fake = FakeComfyUI(output_dir=os.path.join(workdir, 'output'), execute_delay=0.3).start()
+    try:
+        image = png_base64('teal')
+        jobs = [
+            {'id': 'post', 'input': {'prompt': 'slow', 'image_base64': image, 'width': 64, 'height': 64, 'target_fps': 32}},
+            {'id': 'plain', 'input': {'prompt': 'fast', 'image_base64': image, 'width': 64, 'height': 64}},
+        ]
+        with patched(worker, **fake_comfyui_settings(fake, submit_postprocess=slow_postprocess)):
+            timeline, results = run_with_runpod(worker.handler, jobs, delays=[0, 0.1])
+        assert all('error' not in result for result in results.values()), results
+        finished = [owner for owner, item in timeline if 'type' not in item]
+        stages = [(owner, item['stage']) for owner, item in timeline if item.get('type') == 'status']
+        assert stages.index(('post', 'interpolating')) < stages.index(('plain', 'generating')), stages
+        assert finished == ['plain', 'post'], f"A job stalled behind post-processing: {finished}"
+        print(f"✓ Another job ran on the GPU while a video was post-processed: finished {finished}")
+
+        # Fan-out variants release the gate once sampled; their post-processing runs after
+        jobs[0] = {'id': 'fan', 'input': {
+            'prompts': ['wave', 'jump'], 'image_base64': image, 'width': 64, 'height': 64, 'target_fps': 32
+        }}
+        with patched(worker, **fake_comfyui_settings(fake, submit_postprocess=slow_postprocess)):
+            timeline, results = run_with_runpod(worker.handler, jobs, delays=[0, 0.1])
+        assert all('error' not in result for result in results.values()), results
+        fan = [item for owner, item in timeline if owner == 'fan']
+        assert [video['prompt'] for video in fan[-1]['videos']] == ['wave', 'jump'], fan[-1]
+        assert all(video['video_base64'] for video in fan[-1]['videos'])
+        assert sum(1 for item in fan if item.get('type') == 'variant_complete') == 2
+        finished = [owner for owner, item in timeline if 'type' not in item]
+        assert finished == ['plain', 'fan'], f"The gate was held during variant post-processing: {finished}"
+        print("✓ Variants post-processed and encoded after the GPU was released")
+
+        # Each variant is delivered as soon as it is sampled, not after the last one
+        serial = FakeComfyUI(output_dir=os.path.join(workdir, 'serial'), execute_delay=0.4, serial=True).start()
+        sampled, delivered = [], []
+        execute = serial.execute
+
+        def record_execute(prompt_id, workflow):
+            execute(prompt_id, workflow)
+            sampled.append(time.monotonic())
+
+        async def record_handler(job):
+            async for item in worker.handler(job):
+                if item.get('type') == 'variant_complete':
+                    delivered.append(time.monotonic())
+                yield item
+
+        serial.execute = record_execute
+        try:
+            job = {'id': 'fan', 'input': {'prompts': ['wave', 'jump', 'spin'], 'image_base64': image, 'width': 64, 'height': 64}}
+            with patched(worker, **fake_comfyui_settings(serial)):
+                timeline, results = run_with_runpod(record_handler, [job])
+        finally:
+            serial.stop()
+        assert 'error' not in results['fan'], results
+        assert len(sampled) == 3 and len(delivered) == 3, (sampled, delivered)
+        assert delivered[0] < sampled[-1], "The first variant waited for the last one to finish sampling"
+        print(f"✓ First variant delivered {sampled[-1] - delivered[0]:.2f}s before the last finished sampling")
+        return True
+    except Exception as e:
+        print(f"✗ Post-processing concurrency test failed: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+    finally:
+        pool.shutdown()
+        fake.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
 def main():
     """Run all tests."""
     print("=" * 60)
@@ -263,6 +2732,31 @@ def main():
         test_parameter_injection,
         test_utility_functions,
         test_workflow_api_format,
+        test_batch_scheduler,
+        test_prompt_variants,
+        test_text_conditioning_cache,
+        test_start_image_latent_cache,
+        test_dispatch_gate,
+        test_progress_events,
+        test_segment_chaining,
+        test_frame_interpolation,
+        test_output_profiles,
+        test_streaming_decode,
+        test_metrics,
+        test_concurrency_controller,
+        test_comfyui_supervisor,
+        test_vram_profile,
+        test_step_cache,
+        test_remote_transport,
+        test_priority_scheduling,
+        test_chunked_output,
+        test_input_preprocessing,
+        test_job_profiling,
+        test_lora_merge,
+        test_shared_weights,
+        test_runpod_concurrency,
+        test_failed_jobs,
+        test_postprocess_concurrency,
     ]
 
     results = []